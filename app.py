@@ -6,7 +6,12 @@ import os
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file
+import click
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_mail import Mail, Message
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -19,7 +24,13 @@ import base64
 import io
 import csv
 import secrets
+import time
+import queue
+import threading
+import socket
 import traceback
+from fuel_stats import (compute_efficiency_stats, compute_consumption_series, summarize_efficiency, empty_efficiency,
+                        ewma_update, is_valid_consumption, valid_segment, consumption_in_range, MAX_SEGMENT_KM)
 try:
     from PIL import Image
 except ImportError:
@@ -87,6 +98,18 @@ if not app.config['SQLALCHEMY_DATABASE_URI']:
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
+app.config['DASHBOARD_CACHE_ENABLED'] = os.environ.get('DASHBOARD_CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+app.config['RANKING_SNAPSHOT_ENABLED'] = os.environ.get('RANKING_SNAPSHOT_ENABLED', 'true').lower() in ['true', 'on', '1']
+app.config['ALERT_WORKERS'] = int(os.environ.get('ALERT_WORKERS', '1'))  # Processos da verificação diária de alertas
+# Reavaliação de alertas ao gravar abastecimento/manutenção: 'job' (fila de jobs, fora do request), 'thread'
+# (thread do próprio processo; só com servidor de longa duração), 'sync' (no commit) ou 'off'
+app.config['ALERT_INCREMENTAL_MODE'] = os.environ.get('ALERT_INCREMENTAL_MODE', 'job').lower()
+# Envio dos resumos de alertas por email: 'thread' (fora da avaliação), 'sync' ou 'off'. Na Vercel o padrão é
+# 'sync': a função pode ser congelada depois da resposta e a thread perderia os emails sem erro
+app.config['ALERT_EMAIL_MODE'] = os.environ.get('ALERT_EMAIL_MODE', 'sync' if os.environ.get('VERCEL') else 'thread').lower()
+# Execução dos jobs em segundo plano: 'worker' (processo `flask worker`) ou 'inline' (no próprio request,
+# para ambientes sem worker como a Vercel)
+app.config['JOB_EXECUTION_MODE'] = os.environ.get('JOB_EXECUTION_MODE', 'inline' if os.environ.get('VERCEL') else 'worker').lower()
 
 # Configurações de sessão mais simples para debug
 app.config['SESSION_COOKIE_SECURE'] = False
@@ -541,6 +564,11 @@ class User(UserMixin, db.Model):
         'custom_branding': False
     })
 
+    # Versão dos dados do usuário (incrementada a cada escrita; invalida o cache do dashboard)
+    data_version = db.Column(db.Integer, nullable=False, default=0)
+    # Alertas pessoais ativos e não lidos (mantido a cada gravação; conferido por reconcile_unread_alert_counters)
+    unread_alerts_count = db.Column(db.Integer, nullable=False, default=0)
+
     # Relacionamentos
     vehicles = db.relationship('Vehicle', backref='owner', lazy=True, cascade='all, delete-orphan')
     
@@ -593,6 +621,16 @@ class Fleet(db.Model):
         'custom_alerts': True
     })
     
+    # Alertas da frota ativos e não lidos (mantido a cada gravação; conferido por reconcile_unread_alert_counters)
+    unread_alerts_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Incrementada a cada escrita que altera o ranking de motoristas (invalida o snapshot)
+    ranking_version = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Veículos e membros ativos (mantidos a cada gravação; conferidos por reconcile_fleet_counters)
+    active_vehicles_count = db.Column(db.Integer, nullable=False, default=0)
+    active_members_count = db.Column(db.Integer, nullable=False, default=0)
+    
     # Metadados
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -615,13 +653,13 @@ class Fleet(db.Model):
     
     @property
     def vehicles_count(self):
-        """Conta veículos ativos da frota"""
-        return Vehicle.query.filter_by(fleet_id=self.id, is_active=True).count()
+        """Veículos ativos da frota (contador, sem consulta)"""
+        return self.active_vehicles_count or 0
     
     @property
     def members_count(self):
-        """Conta membros ativos da frota"""
-        return FleetMember.query.filter_by(fleet_id=self.id, is_active=True).count()
+        """Membros ativos da frota (contador, sem consulta)"""
+        return self.active_members_count or 0
     
     def can_add_vehicle(self):
         """Verifica se pode adicionar mais veículos"""
@@ -654,7 +692,10 @@ class FleetMember(db.Model):
     inviter = db.relationship('User', foreign_keys=[invited_by])
     
     # Índice único para evitar duplicatas
-    __table_args__ = (db.UniqueConstraint('fleet_id', 'user_id', name='unique_fleet_member'),)
+    __table_args__ = (
+        db.UniqueConstraint('fleet_id', 'user_id', name='unique_fleet_member'),
+        db.Index('ix_fleet_members_user_active', 'user_id', 'is_active'),
+    )
     
     def __repr__(self):
         return f'<FleetMember {self.user.username} in {self.fleet.company_name}>'
@@ -674,6 +715,10 @@ class FleetMember(db.Model):
     @property
     def can_view_reports(self):
         return self.role in ['owner', 'admin', 'manager']
+    
+    @property
+    def can_manage_vehicles(self):
+        return self.role in ['owner', 'admin', 'manager']
 
 class Driver(db.Model):
     """Motoristas da frota"""
@@ -711,6 +756,11 @@ class Driver(db.Model):
 
 class Vehicle(db.Model):
     __tablename__ = 'vehicles'
+    __table_args__ = (
+        db.Index('ix_vehicles_user_active', 'user_id', 'is_active'),
+        db.Index('ix_vehicles_fleet_active', 'fleet_id', 'is_active'),
+        db.Index('ix_vehicles_driver', 'driver_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -765,6 +815,10 @@ class Vehicle(db.Model):
 
 class FuelRecord(db.Model):
     __tablename__ = 'fuel_records'
+    __table_args__ = (
+        db.Index('ix_fuel_records_vehicle_date', 'vehicle_id', 'date'),
+        db.Index('ix_fuel_records_vehicle_odometer', 'vehicle_id', 'odometer'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=False)
@@ -780,24 +834,67 @@ class FuelRecord(db.Model):
     ai_extracted_data = db.Column(db.Text)  # JSON com dados extraidos pela IA
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Segmento desde o abastecimento anterior (mantido por refresh_fuel_segments)
+    kilometers = db.Column(db.Float, nullable=True)  # Distância desde o abastecimento anterior
+    consumption = db.Column(db.Float, nullable=True)  # km/L do segmento
+    cost_per_km = db.Column(db.Float, nullable=True)  # R$/km do segmento
+    
     def __repr__(self):
         return f'<FuelRecord {self.date} - {self.liters}L>'
     
-    def consumption(self):
-        """Calcula o consumo para este abastecimento"""
-        previous_record = FuelRecord.query.filter(
-            FuelRecord.vehicle_id == self.vehicle_id,
-            FuelRecord.odometer < self.odometer
-        ).order_by(FuelRecord.odometer.desc()).first()
-        
-        if not previous_record:
-            return 0
+    def update_segment(self, previous_record):
+        """Atualiza distância, consumo e custo/km em relação ao abastecimento anterior"""
+        if previous_record is None or not valid_segment(self.odometer, previous_record.odometer):
+            self.kilometers = None
+            self.consumption = None
+            self.cost_per_km = None
+            return
         
         distance = self.odometer - previous_record.odometer
-        if distance <= 0 or self.liters <= 0:
-            return 0
-        
-        return distance / self.liters
+        self.kilometers = distance
+        self.consumption = distance / self.liters if self.liters and self.liters > 0 else None
+        self.cost_per_km = self.total_cost / distance if self.total_cost else None
+
+class FleetDailyRollup(db.Model):
+    """Totais diários de abastecimento por veículo e combustível dos veículos de frota"""
+    __tablename__ = 'fleet_daily_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('vehicle_id', 'day', 'fuel_type', name='uq_fleet_daily_rollups_vehicle_day_fuel'),
+        db.Index('ix_fleet_daily_rollups_fleet_day', 'fleet_id', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    fleet_id = db.Column(db.Integer, db.ForeignKey('fleets.id', ondelete='CASCADE'), nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id', ondelete='CASCADE'), nullable=False)
+    fuel_type = db.Column(db.String(20), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    
+    # Mantidos por refresh_fleet_rollups a cada gravação de abastecimento
+    total_cost = db.Column(db.Float, nullable=False, default=0)
+    liters = db.Column(db.Float, nullable=False, default=0)
+    kilometers = db.Column(db.Float, nullable=False, default=0)  # Soma dos segmentos dos abastecimentos do dia
+    fill_ups = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<FleetDailyRollup vehicle={self.vehicle_id} {self.day} {self.fuel_type}>'
+
+class VehicleConsumptionState(db.Model):
+    """Estado incremental do consumo de cada veículo (médias móveis exponenciais de km/L)"""
+    __tablename__ = 'vehicle_consumption_states'
+    
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id', ondelete='CASCADE'), primary_key=True)
+    sample_count = db.Column(db.Integer, nullable=False, default=0)  # Trechos válidos considerados
+    mean_consumption = db.Column(db.Float, nullable=True)  # Média histórica (EWMA lenta)
+    variance_consumption = db.Column(db.Float, nullable=True)  # Variância da média histórica
+    recent_consumption = db.Column(db.Float, nullable=True)  # Média dos últimos abastecimentos (EWMA rápida)
+    last_consumption = db.Column(db.Float, nullable=True)
+    last_zscore = db.Column(db.Float, nullable=True)  # Último trecho comparado ao estado anterior
+    last_odometer = db.Column(db.Float, nullable=True)  # Fim do histórico já incorporado
+    last_record_id = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<VehicleConsumptionState vehicle={self.vehicle_id} n={self.sample_count}>'
 
 class FleetInvite(db.Model):
     __tablename__ = 'fleet_invites'
@@ -846,6 +943,14 @@ class FleetInvite(db.Model):
 
 class Alert(db.Model):
     __tablename__ = 'alerts'
+    __table_args__ = (
+        db.Index('ix_alerts_vehicle_type_created', 'vehicle_id', 'alert_type', 'created_at'),
+        # Um alerta automático por veículo, tipo e janela: garante a deduplicação mesmo com execuções concorrentes
+        db.Index('uq_alerts_vehicle_type_bucket', 'vehicle_id', 'alert_type', 'dedup_bucket', unique=True),
+        # Caixa de entrada: paginação por cursor (created_at, id) dos alertas pessoais e das frotas
+        db.Index('ix_alerts_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_alerts_fleet_created', 'fleet_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Null para alertas de frota
@@ -869,6 +974,7 @@ class Alert(db.Model):
     
     # Metadados
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    dedup_bucket = db.Column(db.Integer, nullable=True)  # Janela de deduplicação dos alertas automáticos (NULL nos manuais)
     
     # Relacionamentos
     user = db.relationship('User', foreign_keys=[user_id], backref='alerts')
@@ -893,18 +999,193 @@ class Alert(db.Model):
         }
         return icon_map.get(self.alert_type, 'fas fa-bell text-primary')
     
+    def to_dict(self):
+        """Dados do alerta para a caixa de entrada"""
+        return {
+            'id': self.id,
+            'alert_type': self.alert_type,
+            'severity': self.severity,
+            'title': self.title,
+            'message': self.message,
+            'icon': self.icon,
+            'vehicle_id': self.vehicle_id,
+            'vehicle_name': self.vehicle.name if self.vehicle else None,
+            'fleet_id': self.fleet_id,
+            'is_read': self.is_read,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
     def mark_as_read(self):
         """Marcar alerta como lido"""
+        if self.is_active and not self.is_read:
+            adjust_unread_alert_counters([(self.user_id, self.fleet_id)], -1)
         self.is_read = True
         db.session.commit()
     
     def dismiss(self, user_id):
         """Dispensar alerta"""
+        if self.is_active and not self.is_read:
+            adjust_unread_alert_counters([(self.user_id, self.fleet_id)], -1)
         self.is_active = False
         self.dismissed_at = datetime.utcnow()
         self.dismissed_by = user_id
+        self.dedup_bucket = None  # Fora da chave única: a regra pode voltar a alertar na mesma janela
         db.session.commit()
 
+class DashboardCache(db.Model):
+    """Contexto calculado do dashboard, compartilhado entre os workers"""
+    __tablename__ = 'dashboard_cache'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'cache_key', name='uq_dashboard_cache_user_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    cache_key = db.Column(db.String(100), nullable=False)  # Filtros: veículo e período
+    data_version = db.Column(db.Integer, nullable=False)  # users.data_version no momento do cálculo
+    computed_on = db.Column(db.Date, nullable=False)  # Métricas dependem da data atual
+    payload = db.Column(db.Text, nullable=False)  # JSON com o contexto do template
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DashboardCache user={self.user_id} {self.cache_key}>'
+
+class RankingSnapshot(db.Model):
+    """Controle do snapshot do ranking de motoristas de uma frota"""
+    __tablename__ = 'ranking_snapshots'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    fleet_id = db.Column(db.Integer, db.ForeignKey('fleets.id', ondelete='CASCADE'), nullable=False, unique=True)
+    data_version = db.Column(db.Integer, nullable=False)  # fleets.ranking_version no momento do cálculo
+    computed_on = db.Column(db.Date, nullable=False)  # Períodos são contados a partir da data atual
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RankingSnapshot fleet={self.fleet_id} v{self.data_version}>'
+
+class RankingSnapshotRow(db.Model):
+    """Métricas pré-calculadas de um motorista em um período padrão do ranking"""
+    __tablename__ = 'ranking_snapshot_rows'
+    __table_args__ = (
+        db.UniqueConstraint('fleet_id', 'period_days', 'driver_id', name='uq_ranking_snapshot_rows_driver'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    fleet_id = db.Column(db.Integer, db.ForeignKey('fleets.id', ondelete='CASCADE'), nullable=False)
+    period_days = db.Column(db.Integer, nullable=False)
+    driver_id = db.Column(db.Integer, db.ForeignKey('drivers.id', ondelete='CASCADE'), nullable=False)
+    
+    total_cost = db.Column(db.Float, nullable=False, default=0)
+    total_liters = db.Column(db.Float, nullable=False, default=0)
+    total_km = db.Column(db.Float, nullable=False, default=0)
+    avg_consumption = db.Column(db.Float, nullable=False, default=0)
+    cost_per_km = db.Column(db.Float, nullable=False, default=0)
+    avg_price_per_liter = db.Column(db.Float, nullable=False, default=0)
+    fuel_records_count = db.Column(db.Integer, nullable=False, default=0)
+    monthly_projection = db.Column(db.Float, nullable=False, default=0)
+    efficiency_score = db.Column(db.Float, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<RankingSnapshotRow fleet={self.fleet_id} {self.period_days}d driver={self.driver_id}>'
+
+class BackgroundJob(db.Model):
+    """Tarefa pesada enfileirada pelos requests e executada pelo `flask worker`"""
+    __tablename__ = 'background_jobs'
+    __table_args__ = (
+        # Próximo job a executar: fila por status, prioridade e horário liberado
+        db.Index('ix_background_jobs_claim', 'status', 'priority', 'run_after'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)  # 'run_alerts', 'send_email', 'fleet_report', etc
+    payload = db.Column(db.JSON, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'succeeded', 'failed'
+    priority = db.Column(db.Integer, nullable=False, default=0)  # Maior executa primeiro
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Adiado nas novas tentativas
+    
+    # Execução
+    locked_by = db.Column(db.String(100), nullable=True)  # host:pid do worker
+    locked_at = db.Column(db.DateTime, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    result_file = db.Column(db.LargeBinary, nullable=True)  # Arquivo gerado (relatórios)
+    error = db.Column(db.Text, nullable=True)
+    
+    # Metadados
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        """Status do job para os endpoints de acompanhamento"""
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'result': self.result,
+            'error': self.error,
+            'has_file': self.result_file is not None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.job_type} {self.status}>'
+
+class JobRun(db.Model):
+    """Execução de uma tarefa periódica (início, fim, duração e resultado)"""
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        db.Index('ix_job_runs_name_started', 'job_name', 'started_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(50), nullable=False)  # 'daily_alerts', 'cleanup', etc
+    trigger = db.Column(db.String(20), nullable=False, default='scheduler')  # 'scheduler', 'cron', 'manual', 'cli'
+    status = db.Column(db.String(20), nullable=False, default='running')  # 'running', 'succeeded', 'failed'
+    worker = db.Column(db.String(100), nullable=True)  # host:pid que executou
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    duration_seconds = db.Column(db.Float, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    
+    def to_dict(self):
+        """Dados da execução para a API administrativa"""
+        return {
+            'id': self.id,
+            'job_name': self.job_name,
+            'trigger': self.trigger,
+            'status': self.status,
+            'worker': self.worker,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_seconds': self.duration_seconds,
+            'result': self.result,
+            'error': self.error
+        }
+    
+    def __repr__(self):
+        return f'<JobRun {self.job_name} {self.status}>'
+
+class SchedulerLease(db.Model):
+    """Trava entre processos: só quem detém a linha (até expires_at) executa a tarefa"""
+    __tablename__ = 'scheduler_leases'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(100), nullable=True)
+    acquired_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchedulerLease {self.name} {self.holder}>'
+
 @login_manager.user_loader
 def load_user(user_id):
     print(f"[LOAD_USER] Tentando carregar usuário com ID: {user_id}")
@@ -1019,66 +1300,512 @@ def process_receipt_with_ai(image_path):
         print(f"Erro no processamento da IA: {e}")
         return None
 
-def calculate_fuel_efficiency(vehicle_id):
-    """Calcula eficiencia de combustivel"""
-    records = FuelRecord.query.filter_by(vehicle_id=vehicle_id).filter(
-        FuelRecord.odometer.isnot(None)
-    ).order_by(FuelRecord.date).all()
-    
-    if len(records) < 2:
-        return {
-            'average_consumption': 0,
-            'best_consumption': 0,
-            'worst_consumption': 0,
-            'trend': 'stable',
-            'has_data': False
+def compute_fuel_segments(vehicle_ids=None, user_id=None, fleet_id=None):
+    """Calcula os segmentos de todos os abastecimentos do escopo em uma única consulta
+
+    Retorna {fuel_record_id: (kilometers, consumption, cost_per_km)}, com None quando não há
+    abastecimento anterior ou a distância é inválida (mesma regra de
+    FuelRecord.update_segment()). No PostgreSQL usa LAG() sobre
+    (vehicle_id ORDER BY odometer); nos demais bancos o cálculo é feito em
+    Python sobre uma única consulta ordenada. Sem filtros, considera todos os veículos.
+    """
+    if vehicle_ids is not None and not vehicle_ids:
+        return {}
+
+    use_window = db.engine.dialect.name == 'postgresql'
+
+    columns = [FuelRecord.id, FuelRecord.vehicle_id, FuelRecord.odometer,
+               FuelRecord.liters, FuelRecord.total_cost]
+    if use_window:
+        columns.append(db.func.lag(FuelRecord.odometer).over(
+            partition_by=FuelRecord.vehicle_id,
+            order_by=(FuelRecord.odometer, FuelRecord.id)
+        ).label('previous_odometer'))
+
+    query = db.session.query(*columns)
+    if vehicle_ids is not None:
+        query = query.filter(FuelRecord.vehicle_id.in_(vehicle_ids))
+    if user_id is not None or fleet_id is not None:
+        query = query.join(Vehicle, Vehicle.id == FuelRecord.vehicle_id)
+        if user_id is not None:
+            query = query.filter(Vehicle.user_id == user_id)
+        if fleet_id is not None:
+            query = query.filter(Vehicle.fleet_id == fleet_id)
+
+    def segment(odometer, liters, total_cost, previous_odometer):
+        if previous_odometer is None or not valid_segment(odometer, previous_odometer):
+            return None, None, None
+        distance = odometer - previous_odometer
+        return (
+            distance,
+            distance / liters if liters and liters > 0 else None,
+            total_cost / distance if total_cost else None
+        )
+
+    segments = {}
+
+    if use_window:
+        for record_id, _, odometer, liters, total_cost, previous_odometer in query.all():
+            segments[record_id] = segment(odometer, liters, total_cost, previous_odometer)
+        return segments
+
+    # Fallback (SQLite): mesma ordenação do LAG(), percorrida em Python
+    rows = query.order_by(FuelRecord.vehicle_id, FuelRecord.odometer, FuelRecord.id).all()
+    previous_vehicle_id = None
+    previous_odometer = None
+    for record_id, vehicle_id, odometer, liters, total_cost in rows:
+        if vehicle_id != previous_vehicle_id:
+            previous_odometer = None
+        segments[record_id] = segment(odometer, liters, total_cost, previous_odometer)
+        previous_vehicle_id = vehicle_id
+        previous_odometer = odometer
+
+    return segments
+
+def _adjacent_fuel_record(vehicle_id, odometer, record_id, after):
+    """Abastecimento vizinho na ordem (odometer, id) do veículo, ignorando o próprio registro"""
+    query = FuelRecord.query.filter(
+        FuelRecord.vehicle_id == vehicle_id,
+        FuelRecord.id != record_id
+    )
+    if after:
+        query = query.filter(db.or_(
+            FuelRecord.odometer > odometer,
+            db.and_(FuelRecord.odometer == odometer, FuelRecord.id > record_id)
+        )).order_by(FuelRecord.odometer, FuelRecord.id)
+    else:
+        query = query.filter(db.or_(
+            FuelRecord.odometer < odometer,
+            db.and_(FuelRecord.odometer == odometer, FuelRecord.id < record_id)
+        )).order_by(FuelRecord.odometer.desc(), FuelRecord.id.desc())
+    return query.first()
+
+def refresh_fuel_segments(vehicle_id, *positions):
+    """Recalcula apenas os segmentos vizinhos de abastecimentos alterados
+
+    Cada posição é uma tupla (odometer, record_id) que foi inserida, removida
+    ou deixou de valer (odômetro antigo em uma edição). O próprio registro,
+    se ainda existir, e o seu sucessor são recalculados.
+    """
+    db.session.flush()
+
+    affected = {}
+    appended = None
+    for odometer, record_id in positions:
+        record = db.session.get(FuelRecord, record_id)
+        if record is not None and record.vehicle_id == vehicle_id:
+            affected[record.id] = record
+
+        successor = _adjacent_fuel_record(vehicle_id, odometer, record_id, after=True)
+        if successor is not None:
+            affected[successor.id] = successor
+        elif len(positions) == 1 and record is not None:
+            appended = record  # Novo abastecimento no fim do histórico
+
+    for record in affected.values():
+        previous_record = _adjacent_fuel_record(vehicle_id, record.odometer, record.id, after=False)
+        record.update_segment(previous_record)
+
+    update_consumption_state(vehicle_id, appended)
+    return len(affected)
+
+CONSUMPTION_STATE_FIELDS = ('sample_count', 'mean_consumption', 'variance_consumption', 'recent_consumption',
+                            'last_consumption', 'last_zscore', 'last_odometer', 'last_record_id')
+
+def next_consumption_state(values, odometer, record_id, kilometers, consumption):
+    """Incorpora um abastecimento ao estado (dict com CONSUMPTION_STATE_FIELDS) em O(1)"""
+    if is_valid_consumption(kilometers, consumption):
+        (values['sample_count'], values['mean_consumption'], values['variance_consumption'],
+         values['recent_consumption'], values['last_zscore']) = ewma_update(
+            values['sample_count'], values['mean_consumption'], values['variance_consumption'],
+            values['recent_consumption'], consumption)
+        values['last_consumption'] = consumption
+    values['last_odometer'] = odometer
+    values['last_record_id'] = record_id
+    return values
+
+def update_consumption_state(vehicle_id, appended=None):
+    """Atualiza o estado de consumo do veículo após uma gravação
+
+    Um abastecimento novo além do último odômetro incorporado é aplicado em O(1);
+    edições, exclusões e registros retroativos reconstroem o estado do veículo.
+    """
+    state = db.session.get(VehicleConsumptionState, vehicle_id)
+    if appended is None or state is None or (state.last_odometer is not None
+                                             and appended.odometer <= state.last_odometer):
+        rebuild_consumption_states([vehicle_id])
+        return
+
+    values = next_consumption_state(
+        {field: getattr(state, field) for field in CONSUMPTION_STATE_FIELDS},
+        appended.odometer, appended.id, appended.kilometers, appended.consumption
+    )
+    for field, value in values.items():
+        setattr(state, field, value)
+
+def rebuild_consumption_states(vehicle_ids=None):
+    """Reconstrói o estado de consumo a partir dos segmentos armazenados (todos ou dos veículos informados)"""
+    query = db.session.query(
+        FuelRecord.vehicle_id, FuelRecord.odometer, FuelRecord.id, FuelRecord.kilometers, FuelRecord.consumption
+    ).order_by(FuelRecord.vehicle_id, FuelRecord.odometer, FuelRecord.id)
+    existing = VehicleConsumptionState.query
+    if vehicle_ids is not None:
+        query = query.filter(FuelRecord.vehicle_id.in_(vehicle_ids))
+        existing = existing.filter(VehicleConsumptionState.vehicle_id.in_(vehicle_ids))
+
+    states = {}
+    for vehicle_id, odometer, record_id, kilometers, consumption in query.yield_per(10000):
+        values = states.get(vehicle_id)
+        if values is None:
+            values = states[vehicle_id] = dict.fromkeys(CONSUMPTION_STATE_FIELDS)
+            values['sample_count'] = 0
+        next_consumption_state(values, odometer, record_id, kilometers, consumption)
+
+    existing = {state.vehicle_id: state for state in existing}
+    for vehicle_id, values in states.items():
+        state = existing.pop(vehicle_id, None)
+        if state is None:
+            state = VehicleConsumptionState(vehicle_id=vehicle_id)
+            db.session.add(state)
+        for field, value in values.items():
+            setattr(state, field, value)
+    for state in existing.values():
+        db.session.delete(state)  # Veículo sem abastecimentos
+    db.session.flush()
+    return len(states)
+
+def backfill_fuel_segments(vehicle_ids=None):
+    """Recalcula os segmentos armazenados de todos os abastecimentos (ou dos veículos informados)"""
+    segments = compute_fuel_segments(vehicle_ids=vehicle_ids)
+    if not segments:
+        return 0
+
+    db.session.execute(db.update(FuelRecord), [
+        {
+            'id': record_id,
+            'kilometers': kilometers,
+            'consumption': consumption,
+            'cost_per_km': cost_per_km
         }
-    
-    consumptions = []
-    for i in range(1, len(records)):
-        prev_km = records[i-1].odometer
-        curr_km = records[i].odometer
-        fuel = records[i].liters
-        
-        if prev_km and curr_km and prev_km > 0 and curr_km > prev_km and fuel > 0:
-            distance = curr_km - prev_km
-            # Validar se a distância é razoável (entre 1 e 2000 km por abastecimento)
-            if 1 <= distance <= 2000:
-                consumption = distance / fuel
-                # Validar se o consumo é razoável (entre 3 e 25 km/L)
-                if 3 <= consumption <= 25:
-                    consumptions.append(consumption)
-    
-    if not consumptions:
-        return {
-            'average_consumption': 0,
-            'best_consumption': 0,
-            'worst_consumption': 0,
-            'trend': 'stable',
-            'has_data': False
+        for record_id, (kilometers, consumption, cost_per_km) in segments.items()
+    ])
+
+    # UPDATE em lote não passa pelo flush: invalidar o cache dos donos manualmente
+    owners = db.session.query(Vehicle.user_id).distinct()
+    if vehicle_ids is not None:
+        owners = owners.filter(Vehicle.id.in_(vehicle_ids))
+    bump_user_data_versions(db.session.connection(), user_ids=[row[0] for row in owners])
+    fleets = db.session.query(Vehicle.fleet_id).filter(Vehicle.fleet_id.isnot(None)).distinct()
+    if vehicle_ids is not None:
+        fleets = fleets.filter(Vehicle.id.in_(vehicle_ids))
+    bump_fleet_ranking_versions(db.session.connection(), fleet_ids=[row[0] for row in fleets])
+    fleet_vehicles = db.session.query(Vehicle.id).filter(Vehicle.fleet_id.isnot(None))
+    if vehicle_ids is not None:
+        fleet_vehicles = fleet_vehicles.filter(Vehicle.id.in_(vehicle_ids))
+    refresh_fleet_rollups(db.session.connection(), vehicle_ids={row[0] for row in fleet_vehicles})
+
+    rebuild_consumption_states(vehicle_ids)
+    db.session.commit()
+    return len(segments)
+
+# Formatos das chaves de período (iguais nos dois bancos e em bucket_key)
+TIME_BUCKET_FORMATS = {
+    'day': ('YYYY-MM-DD', '%Y-%m-%d'),
+    'week': ('YYYY-MM-DD', '%Y-%m-%d'),  # Segunda-feira da semana
+    'month': ('YYYY-MM', '%Y-%m'),
+    'year': ('YYYY', '%Y')
+}
+
+def time_bucket(column, unit='month'):
+    """Expressão SQL com a chave do período (dia, semana, mês ou ano) de uma coluna de data
+
+    Usa date_trunc/to_char no PostgreSQL e strftime/date no SQLite, para que
+    o agrupamento aconteça no banco nos dois ambientes.
+    """
+    if unit not in TIME_BUCKET_FORMATS:
+        raise ValueError(f"Período inválido: {unit}")
+    pg_format, sqlite_format = TIME_BUCKET_FORMATS[unit]
+
+    if db.engine.dialect.name == 'sqlite':
+        if unit == 'week':
+            return db.func.date(column, '-6 days', 'weekday 1')
+        return db.func.strftime(sqlite_format, column)
+
+    if unit == 'week':
+        return db.func.to_char(db.func.date_trunc('week', column), pg_format)
+    return db.func.to_char(column, pg_format)
+
+def bucket_key(value, unit='month'):
+    """Chave do período de uma data em Python (mesmo formato de time_bucket)"""
+    if unit == 'week':
+        value = value - timedelta(days=value.weekday())
+    return value.strftime(TIME_BUCKET_FORMATS[unit][1])
+
+def fuel_record_columns(query):
+    """Colunas (vehicle_id, date, odometer, liters, total_cost) dos abastecimentos da consulta
+
+    Ordenadas como os segmentos armazenados (veículo, odômetro, id), para o kernel desempatar
+    odômetros repetidos do mesmo jeito.
+    """
+    rows = query.with_entities(
+        FuelRecord.vehicle_id,
+        FuelRecord.date,
+        FuelRecord.odometer,
+        FuelRecord.liters,
+        FuelRecord.total_cost
+    ).order_by(None).order_by(FuelRecord.vehicle_id, FuelRecord.odometer, FuelRecord.id).all()
+    if not rows:
+        return [], [], [], [], []
+    return [list(column) for column in zip(*rows)]
+
+# Abastecimentos por página no histórico do veículo
+FUEL_HISTORY_PAGE_SIZE = 25
+
+def parse_fuel_cursor(cursor):
+    """Converte o cursor 'AAAA-MM-DD:id' em (data, id); None para a primeira página"""
+    if not cursor:
+        return None
+    record_date, record_id = cursor.split(':', 1)
+    return datetime.strptime(record_date, '%Y-%m-%d').date(), int(record_id)
+
+def fuel_history_page(vehicle_id, cursor=None, limit=FUEL_HISTORY_PAGE_SIZE):
+    """Página do histórico ordenada por (date, id) decrescente, a partir do cursor
+
+    Retorna (registros, próximo cursor ou None). Usa paginação por chave
+    (keyset) em vez de OFFSET, então o custo não cresce com o histórico.
+    """
+    query = FuelRecord.query.filter(FuelRecord.vehicle_id == vehicle_id)
+    if cursor:
+        before_date, before_id = cursor
+        query = query.filter(db.or_(
+            FuelRecord.date < before_date,
+            db.and_(FuelRecord.date == before_date, FuelRecord.id < before_id)
+        ))
+
+    records = query.order_by(FuelRecord.date.desc(), FuelRecord.id.desc()).limit(limit + 1).all()
+    if len(records) <= limit:
+        return records, None
+
+    records = records[:limit]
+    last = records[-1]
+    return records, f"{last.date.isoformat()}:{last.id}"
+
+def valid_consumption_filter():
+    """Condição SQL dos segmentos armazenados com consumo válido (o mesmo predicado do kernel)"""
+    return consumption_in_range(FuelRecord.kilometers, FuelRecord.consumption)
+
+def vehicle_history_stats(vehicle_id):
+    """Estatísticas do cabeçalho do veículo a partir dos segmentos armazenados"""
+    valid_consumption = valid_consumption_filter()
+    thirty_days_ago = (datetime.now() - timedelta(days=30)).date()
+
+    row = db.session.query(
+        db.func.count(FuelRecord.id),
+        db.func.avg(FuelRecord.consumption).filter(valid_consumption),
+        db.func.max(FuelRecord.consumption).filter(valid_consumption),
+        db.func.min(FuelRecord.consumption).filter(valid_consumption),
+        db.func.sum(FuelRecord.total_cost).filter(FuelRecord.date >= thirty_days_ago)
+    ).filter(FuelRecord.vehicle_id == vehicle_id).one()
+
+    stats = empty_efficiency()
+    stats.update({
+        'total_records': row[0] or 0,
+        'recent_expense': row[4] or 0
+    })
+    if row[1] is not None:
+        stats.update({
+            'average_consumption': row[1],
+            'best_consumption': row[2],
+            'worst_consumption': row[3],
+            'has_data': True
+        })
+    return stats
+
+def fleet_vehicle_stats(fleet_id):
+    """Eficiência de todos os veículos da frota em um único SELECT
+
+    Agrupa os segmentos armazenados por veículo, sem carregar o histórico.
+    Retorna {vehicle_id: {'average_consumption', 'has_data', 'total_records'}};
+    os totais por período vêm do rollup diário (fleet_rollup_totals).
+    """
+    rows = db.session.query(
+        FuelRecord.vehicle_id,
+        db.func.count(FuelRecord.id),
+        db.func.avg(FuelRecord.consumption).filter(valid_consumption_filter())
+    ).join(Vehicle, Vehicle.id == FuelRecord.vehicle_id).filter(
+        Vehicle.fleet_id == fleet_id
+    ).group_by(FuelRecord.vehicle_id).all()
+
+    return {
+        vehicle_id: {
+            'average_consumption': average or 0,
+            'has_data': average is not None,
+            'total_records': total_records
         }
-    
-    # Calcular tendencia (comparar ultimos 3 com primeiros 3)
-    trend = 'stable'
-    if len(consumptions) >= 6:
-        first_three = sum(consumptions[:3]) / 3
-        last_three = sum(consumptions[-3:]) / 3
-        
-        if last_three > first_three * 1.05:
-            trend = 'improving'
-        elif last_three < first_three * 0.95:
-            trend = 'worsening'
-    
+        for vehicle_id, total_records, average in rows
+    }
+
+def dashboard_kpis(query, period_start):
+    """Indicadores do dashboard em um único SELECT com agregados condicionais (FILTER)"""
+    row = query.with_entities(
+        db.func.count(FuelRecord.id),
+        db.func.sum(FuelRecord.total_cost),
+        db.func.sum(FuelRecord.liters),
+        db.func.avg(FuelRecord.price_per_liter),
+        db.func.sum(FuelRecord.total_cost).filter(FuelRecord.date >= period_start)
+    ).order_by(None).one()
     return {
-        'average_consumption': sum(consumptions) / len(consumptions),
-        'best_consumption': max(consumptions),
-        'worst_consumption': min(consumptions),
-        'trend': trend,
-        'has_data': True
+        'total_records': row[0] or 0,
+        'total_spent': row[1] or 0,
+        'total_liters': row[2] or 0,
+        'avg_price': row[3] or 0,
+        'period_expense': row[4] or 0
     }
 
+def calculate_fuel_efficiency(vehicle_id):
+    """Calcula eficiencia de combustivel"""
+    columns = fuel_record_columns(FuelRecord.query.filter_by(vehicle_id=vehicle_id))
+    return compute_efficiency_stats(*columns).get(vehicle_id, empty_efficiency())
+
 # === SISTEMA DE ALERTAS INTELIGENTES ===
 
+# Caixa de entrada: tamanho padrão e máximo da página
+ALERT_INBOX_PAGE_SIZE = 20
+ALERT_INBOX_MAX_PAGE_SIZE = 100
+
+def adjust_unread_alert_counters(owners, delta):
+    """Soma delta ao contador de não lidos do dono de cada alerta: a frota ou, sem frota, o usuário
+
+    `owners` são pares (user_id, fleet_id); um UPDATE em lote por tabela, na transação atual.
+    """
+    counts = {Fleet: {}, User: {}}
+    for user_id, fleet_id in owners:
+        model, owner_id = (Fleet, fleet_id) if fleet_id else (User, user_id)
+        if owner_id:
+            counts[model][owner_id] = counts[model].get(owner_id, 0) + delta
+
+    for model, owner_counts in counts.items():
+        if not owner_counts:
+            continue
+        table = model.__table__
+        values = {'unread_alerts_count': table.c.unread_alerts_count + db.bindparam('delta')}
+        if 'updated_at' in table.c:
+            values['updated_at'] = table.c.updated_at  # Contador não é edição do cadastro
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('owner_id')).values(values),
+            [{'owner_id': owner_id, 'delta': value} for owner_id, value in owner_counts.items() if value]
+        )
+
+def reconcile_unread_alert_counters():
+    """Recalcula os contadores de não lidos a partir dos alertas e corrige os que divergirem"""
+    unread = db.and_(Alert.is_active == True, Alert.is_read == False)
+    actual = {
+        Fleet: dict(db.session.query(Alert.fleet_id, db.func.count()).filter(
+            unread, Alert.fleet_id.isnot(None)).group_by(Alert.fleet_id).all()),
+        User: dict(db.session.query(Alert.user_id, db.func.count()).filter(
+            unread, Alert.fleet_id.is_(None), Alert.user_id.isnot(None)).group_by(Alert.user_id).all())
+    }
+
+    fixed = 0
+    for model, counts in actual.items():
+        stored = db.session.query(model.id, model.unread_alerts_count).filter(
+            db.or_(model.unread_alerts_count != 0, model.id.in_(list(counts)))
+        ).all()
+        drifted = [{'owner_id': owner_id, 'value': counts.get(owner_id, 0)}
+                   for owner_id, current in stored if current != counts.get(owner_id, 0)]
+        if drifted:
+            table = model.__table__
+            values = {'unread_alerts_count': db.bindparam('value')}
+            if 'updated_at' in table.c:
+                values['updated_at'] = table.c.updated_at
+            db.session.execute(table.update().where(table.c.id == db.bindparam('owner_id')).values(values), drifted)
+            fixed += len(drifted)
+    db.session.commit()
+    if fixed:
+        print(f"[ALERT] {fixed} contadores de alertas não lidos corrigidos")
+    return fixed
+
+def alert_owner_filters(user_id):
+    """Condições dos alertas visíveis ao usuário: os pessoais e os das frotas em que é membro ativo"""
+    fleet_ids = [fleet_id for fleet_id, in db.session.query(FleetMember.fleet_id).filter_by(
+        user_id=user_id, is_active=True)]
+    filters = [db.and_(Alert.fleet_id.is_(None), Alert.user_id == user_id)]
+    if fleet_ids:
+        filters.append(Alert.fleet_id.in_(fleet_ids))
+    return filters
+
+def encode_alert_cursor(alert):
+    """Cursor opaco com a posição (created_at, id) do último alerta da página"""
+    return base64.urlsafe_b64encode(f'{alert.created_at.isoformat()}|{alert.id}'.encode()).decode()
+
+def decode_alert_cursor(cursor):
+    """Posição (created_at, id) do cursor; ValueError se inválido"""
+    try:
+        created_at, alert_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(alert_id)
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+def alert_inbox_page(user_id, status='active', cursor=None, limit=ALERT_INBOX_PAGE_SIZE):
+    """Página da caixa de entrada, do mais recente para o mais antigo
+
+    Cada origem (pessoal e frotas) é lida pelo seu índice (dono, created_at, id) a partir
+    do cursor, com no máximo limit + 1 linhas; as duas listas são intercaladas em memória.
+    """
+    conditions = []
+    if status == 'unread':
+        conditions += [Alert.is_active == True, Alert.is_read == False]
+    elif status == 'active':
+        conditions.append(Alert.is_active == True)
+    if cursor:
+        conditions.append(db.tuple_(Alert.created_at, Alert.id) < decode_alert_cursor(cursor))
+
+    alerts = []
+    for owner_filter in alert_owner_filters(user_id):
+        alerts.extend(Alert.query.options(db.joinedload(Alert.vehicle))
+                      .filter(owner_filter, *conditions)
+                      .order_by(Alert.created_at.desc(), Alert.id.desc())
+                      .limit(limit + 1).all())
+    alerts.sort(key=lambda alert: (alert.created_at, alert.id), reverse=True)
+
+    page = alerts[:limit]
+    next_cursor = encode_alert_cursor(page[-1]) if len(alerts) > limit else None
+    return page, next_cursor
+
+def update_alerts(user_id, action, alert_ids=None):
+    """Marca como lidos ('read') ou dispensa ('dismiss') em um único UPDATE os alertas visíveis ao usuário
+
+    Sem alert_ids, vale para todos os alertas ativos. Retorna quantos alertas mudaram.
+    """
+    conditions = [db.or_(*alert_owner_filters(user_id)), Alert.is_active == True]
+    if alert_ids is not None:
+        conditions.append(Alert.id.in_(alert_ids))
+    if action == 'read':
+        conditions.append(Alert.is_read == False)
+        values = {'is_read': True}
+    elif action == 'dismiss':
+        values = {'is_active': False, 'dismissed_at': datetime.utcnow(), 'dismissed_by': user_id, 'dedup_bucket': None}
+    else:
+        raise ValueError(f'Ação desconhecida: {action}')
+
+    rows = db.session.execute(
+        db.update(Alert).where(*conditions).values(values)
+        .returning(Alert.user_id, Alert.fleet_id, Alert.is_read)
+        .execution_options(synchronize_session=False)
+    ).all()
+    # Dispensar não altera is_read: o valor retornado é o de antes do UPDATE
+    adjust_unread_alert_counters([(row.user_id, row.fleet_id) for row in rows
+                                  if action == 'read' or not row.is_read], -1)
+    db.session.commit()
+    return len(rows)
+
+def unread_alert_count(user):
+    """Não lidos do usuário pelos contadores mantidos: o pessoal já carregado e a soma das frotas"""
+    fleet_unread = db.session.query(db.func.coalesce(db.func.sum(Fleet.unread_alerts_count), 0))\
+        .join(FleetMember, FleetMember.fleet_id == Fleet.id)\
+        .filter(FleetMember.user_id == user.id, FleetMember.is_active == True).scalar()
+    return (user.unread_alerts_count or 0) + fleet_unread
+
 def create_alert(user_id=None, fleet_id=None, vehicle_id=None, alert_type='info', 
                  severity='info', title='', message='', metadata=None):
     """Criar novo alerta no sistema"""
@@ -1095,6 +1822,7 @@ def create_alert(user_id=None, fleet_id=None, vehicle_id=None, alert_type='info'
         )
         
         db.session.add(alert)
+        adjust_unread_alert_counters([(user_id, fleet_id)], 1)
         db.session.commit()
         
         print(f"[ALERT] ✅ Alerta criado: {title} ({alert_type})")
@@ -1105,514 +1833,1280 @@ def create_alert(user_id=None, fleet_id=None, vehicle_id=None, alert_type='info'
         print(f"[ALERT] ❌ Erro ao criar alerta: {str(e)}")
         return None
 
-def check_fuel_anomalies():
-    """Verificar anomalias de consumo para todos os veículos"""
-    try:
-        print("[ALERT] 🔍 Verificando anomalias de combustível...")
-        
-        # Buscar todos os veículos com dados suficientes
-        vehicles = Vehicle.query.filter_by(is_active=True).all()
-        alerts_created = 0
-        
-        for vehicle in vehicles:
-            # Calcular eficiência atual vs histórica
-            efficiency_data = calculate_fuel_efficiency(vehicle.id)
-            
-            if not efficiency_data.get('has_data') or len(vehicle.fuel_records) < 5:
-                continue
-            
-            # Buscar últimos 3 registros
-            recent_records = FuelRecord.query.filter_by(vehicle_id=vehicle.id)\
-                .order_by(FuelRecord.date.desc()).limit(3).all()
-            
-            if len(recent_records) < 3:
-                continue
-            
-            # Calcular consumo médio dos últimos registros
-            recent_consumptions = []
-            for record in recent_records:
-                consumption = record.consumption()
-                if consumption > 0:
-                    recent_consumptions.append(consumption)
-            
-            if not recent_consumptions:
-                continue
-                
-            recent_avg = sum(recent_consumptions) / len(recent_consumptions)
-            historical_avg = efficiency_data['average_consumption']
-            
-            # Verificar se há anomalia (consumo 20% pior que a média)
-            if recent_avg > 0 and historical_avg > 0:
-                deviation = ((historical_avg - recent_avg) / historical_avg) * 100
-                
-                if deviation > 20:  # Consumo 20% pior
-                    # Verificar se já existe alerta similar recente (últimos 7 dias)
-                    existing_alert = Alert.query.filter(
-                        Alert.vehicle_id == vehicle.id,
-                        Alert.alert_type == 'fuel_anomaly',
-                        Alert.is_active == True,
-                        Alert.created_at >= datetime.utcnow() - timedelta(days=7)
-                    ).first()
-                    
-                    if not existing_alert:
-                        # Determinar se é para usuário individual ou frota
-                        user_id = vehicle.user_id if not vehicle.fleet_id else None
-                        fleet_id = vehicle.fleet_id
-                        
-                        alert = create_alert(
-                            user_id=user_id,
-                            fleet_id=fleet_id,
-                            vehicle_id=vehicle.id,
-                            alert_type='fuel_anomaly',
-                            severity='warning',
-                            title=f'🚨 Consumo elevado - {vehicle.name}',
-                            message=f'O veículo {vehicle.name} está consumindo {deviation:.1f}% mais combustível que o normal. '
-                                  f'Consumo atual: {recent_avg:.1f} km/L vs média histórica: {historical_avg:.1f} km/L. '
-                                  f'Recomendamos verificar filtros, pneus e agendar manutenção preventiva.',
-                            alert_data={
-                                'recent_consumption': recent_avg,
-                                'historical_consumption': historical_avg,
-                                'deviation_percentage': deviation,
-                                'records_analyzed': len(recent_consumptions)
-                            }
-                        )
-                        
-                        if alert:
-                            alerts_created += 1
-                            
-                            # Enviar notificação por email se for crítico (>30%)
-                            if deviation > 30:
-                                send_fuel_anomaly_email(vehicle, deviation, recent_avg, historical_avg)
-        
-        print(f"[ALERT] ✅ Verificação de combustível concluída. {alerts_created} alertas criados.")
-        return alerts_created
-        
-    except Exception as e:
-        print(f"[ALERT] ❌ Erro ao verificar anomalias: {str(e)}")
-        return 0
+# Veículos avaliados por lote: cada lote carrega suas entradas em poucas consultas agregadas
+ALERT_BATCH_SIZE = 500
+
+# Anomalia de consumo: média recente abaixo da histórica (estado EWMA do veículo)
+FUEL_ANOMALY_MIN_SAMPLES = 5            # Trechos válidos antes de avaliar
+FUEL_ANOMALY_DEVIATION_PERCENT = 20     # Piora mínima da média recente
+FUEL_ANOMALY_MIN_ZSCORE = 1.5           # Em desvios-padrão: ignora veículos de consumo naturalmente irregular
+FUEL_ANOMALY_EMAIL_PERCENT = 30         # Piora a partir da qual o alerta também vai por email
+
+# Janela (dias) em que um alerta do mesmo tipo para o mesmo veículo não é repetido
+ALERT_DEDUP_DAYS = {
+    'fuel_anomaly': 7,
+    'maintenance': 7,
+    'consumption_anomaly': 14,
+    'vehicle_age': 90
+}
+
+# Intervalos por tempo, indexados pelos valores reais de MaintenanceRecord.maintenance_type
+MAINTENANCE_TIME_INTERVALS = {
+    'oil': {'interval': 90, 'warning': 75, 'critical': 100},          # 3 meses
+    'filter_oil': {'interval': 90, 'warning': 75, 'critical': 100},
+    'tires': {'interval': 180, 'warning': 150, 'critical': 210},      # 6 meses
+    'alignment': {'interval': 180, 'warning': 150, 'critical': 210},
+    'balancing': {'interval': 180, 'warning': 150, 'critical': 210},
+    'brakes': {'interval': 365, 'warning': 335, 'critical': 395},     # 1 ano
+    'brake_fluid': {'interval': 365, 'warning': 335, 'critical': 395}
+}
+DEFAULT_TIME_INTERVAL = {'interval': 180, 'warning': 150, 'critical': 210}
+
+# Intervalos por quilometragem
+MAINTENANCE_KM_INTERVALS = {
+    'oil': 10000,
+    'filter_oil': 10000,
+    'tires': 15000,
+    'alignment': 15000,
+    'balancing': 15000,
+    'brakes': 40000,
+    'brake_fluid': 40000
+}
+DEFAULT_KM_INTERVAL = 15000
+
+def latest_maintenance_by_vehicle(vehicle_ids):
+    """Última manutenção e última manutenção com km de cada veículo, em uma consulta (ROW_NUMBER)"""
+    ranked = db.session.query(
+        MaintenanceRecord.id.label('id'),
+        db.func.row_number().over(
+            partition_by=MaintenanceRecord.vehicle_id,
+            order_by=(MaintenanceRecord.date.desc(), MaintenanceRecord.id.desc())
+        ).label('position'),
+        db.func.row_number().over(
+            partition_by=MaintenanceRecord.vehicle_id,
+            order_by=(MaintenanceRecord.km_at_service.is_(None), MaintenanceRecord.date.desc(),
+                      MaintenanceRecord.id.desc())
+        ).label('km_position')
+    ).filter(MaintenanceRecord.vehicle_id.in_(vehicle_ids)).subquery()
+
+    rows = db.session.query(MaintenanceRecord, ranked.c.position, ranked.c.km_position)\
+        .join(ranked, ranked.c.id == MaintenanceRecord.id)\
+        .filter(db.or_(ranked.c.position == 1, ranked.c.km_position == 1)).all()
+
+    latest, latest_with_km = {}, {}
+    for record, position, km_position in rows:
+        if position == 1:
+            latest[record.vehicle_id] = record
+        if km_position == 1 and record.km_at_service:
+            latest_with_km[record.vehicle_id] = record
+    return latest, latest_with_km
+
+def fuel_aggregates_by_vehicle(vehicle_ids, today):
+    """Odômetro atual, totais e médias de consumo por janela de cada veículo (um GROUP BY)"""
+    positive = FuelRecord.consumption > 0
+    recent = db.and_(positive, FuelRecord.date >= today - timedelta(days=30))
+    historical = db.and_(positive, FuelRecord.date >= today - timedelta(days=90),
+                         FuelRecord.date < today - timedelta(days=30))
+
+    rows = db.session.query(
+        FuelRecord.vehicle_id,
+        db.func.count(FuelRecord.id),
+        db.func.max(FuelRecord.odometer),
+        db.func.count(FuelRecord.id).filter(recent),
+        db.func.avg(FuelRecord.consumption).filter(recent),
+        db.func.count(FuelRecord.id).filter(historical),
+        db.func.avg(FuelRecord.consumption).filter(historical)
+    ).filter(FuelRecord.vehicle_id.in_(vehicle_ids)).group_by(FuelRecord.vehicle_id).all()
 
-def check_maintenance_alerts():
-    """Verificar alertas de manutenção preventiva inteligente"""
-    try:
-        print("[ALERT] 🔧 Verificando alertas de manutenção preventiva...")
+    return {
+        row[0]: {
+            'total_records': row[1],
+            'current_odometer': row[2],
+            'recent_count': row[3],
+            'recent_average': row[4],
+            'historical_count': row[5],
+            'historical_average': row[6]
+        }
+        for row in rows
+    }
 
-        alerts_created = 0
-        today = datetime.now().date()
+def consumption_states_by_vehicle(vehicle_ids):
+    """Estado EWMA de consumo de cada veículo"""
+    return {
+        state.vehicle_id: state
+        for state in VehicleConsumptionState.query.filter(VehicleConsumptionState.vehicle_id.in_(vehicle_ids))
+    }
 
-        # Buscar todos os veículos ativos
-        vehicles = Vehicle.query.filter_by(is_active=True).all()
+def recent_alerts_by_vehicle(vehicle_ids, now):
+    """Último alerta (qualquer e ativo) por veículo e tipo dentro da maior janela de deduplicação"""
+    since = now - timedelta(days=max(ALERT_DEDUP_DAYS.values()))
+    rows = db.session.query(
+        Alert.vehicle_id,
+        Alert.alert_type,
+        db.func.max(Alert.created_at),
+        db.func.max(Alert.created_at).filter(Alert.is_active == True)
+    ).filter(
+        Alert.vehicle_id.in_(vehicle_ids),
+        Alert.alert_type.in_(list(ALERT_DEDUP_DAYS)),
+        Alert.created_at >= since
+    ).group_by(Alert.vehicle_id, Alert.alert_type).all()
+
+    return {(row[0], row[1]): {'any': row[2], 'active': row[3]} for row in rows}
+
+def load_alert_inputs(vehicle_ids, today):
+    """Entradas de todas as regras para um lote de veículos"""
+    now = datetime.utcnow()
+    latest, latest_with_km = latest_maintenance_by_vehicle(vehicle_ids)
+    return {
+        'today': today,
+        'now': now,
+        'latest_maintenance': latest,
+        'latest_maintenance_with_km': latest_with_km,
+        'fuel': fuel_aggregates_by_vehicle(vehicle_ids, today),
+        'consumption_states': consumption_states_by_vehicle(vehicle_ids),
+        'recent_alerts': recent_alerts_by_vehicle(vehicle_ids, now),
+        'duplicates_suppressed': 0  # Verificações que encontraram alerta na janela (instrumentação)
+    }
 
-        for vehicle in vehicles:
-            # 1. ALERTAS POR TEMPO (última manutenção)
-            alerts_created += check_time_based_maintenance(vehicle, today)
+def alert_dedup_bucket(alert_type, moment):
+    """Número da janela de deduplicação do tipo de alerta que contém o instante"""
+    return moment.toordinal() // ALERT_DEDUP_DAYS.get(alert_type, 1)
 
-            # 2. ALERTAS POR QUILOMETRAGEM
-            alerts_created += check_mileage_based_maintenance(vehicle, today)
+def alert_recently_created(inputs, vehicle_id, alert_type, active_only=False):
+    """Há alerta do mesmo tipo para o veículo dentro da janela de deduplicação?"""
+    recent = inputs['recent_alerts'].get((vehicle_id, alert_type))
+    if not recent:
+        return False
+    created_at = recent['active'] if active_only else recent['any']
+    if created_at is not None and created_at >= inputs['now'] - timedelta(days=ALERT_DEDUP_DAYS[alert_type]):
+        inputs['duplicates_suppressed'] += 1
+        return True
+    return False
 
-            # 3. ALERTAS POR CONSUMO ANÔMALO
-            alerts_created += check_consumption_anomaly_alerts(vehicle, today)
+def build_vehicle_alert(inputs, vehicle, alert_type, severity, title, message, metadata):
+    """Monta a linha do alerta e a registra nas entradas para as regras seguintes do mesmo lote"""
+    inputs['recent_alerts'][(vehicle.id, alert_type)] = {'any': inputs['now'], 'active': inputs['now']}
+    return {
+        'user_id': vehicle.user_id if not vehicle.fleet_id else None,
+        'fleet_id': vehicle.fleet_id,
+        'vehicle_id': vehicle.id,
+        'alert_type': alert_type,
+        'severity': severity,
+        'title': title,
+        'message': message,
+        'alert_data': metadata,
+        'created_at': inputs['now'],
+        'dedup_bucket': alert_dedup_bucket(alert_type, inputs['now'])
+    }
 
-            # 4. ALERTAS POR IDADE DO VEÍCULO
-            alerts_created += check_vehicle_age_alerts(vehicle, today)
+def check_fuel_anomaly_alerts(vehicle, today, inputs):
+    """Média recente de consumo 20% pior que a histórica, a partir do estado incremental do veículo"""
+    state = inputs['consumption_states'].get(vehicle.id)
+    if not state or state.sample_count < FUEL_ANOMALY_MIN_SAMPLES or not state.mean_consumption:
+        return []
+
+    recent_avg = state.recent_consumption
+    historical_avg = state.mean_consumption
+    deviation = ((historical_avg - recent_avg) / historical_avg) * 100
+    std = (state.variance_consumption or 0) ** 0.5
+    zscore = (historical_avg - recent_avg) / std if std > 0 else float('inf')
+
+    # Consumo 20% pior e fora da variação normal do veículo, sem alerta ativo nos últimos 7 dias
+    if deviation <= FUEL_ANOMALY_DEVIATION_PERCENT or zscore < FUEL_ANOMALY_MIN_ZSCORE:
+        return []
+    if alert_recently_created(inputs, vehicle.id, 'fuel_anomaly', active_only=True):
+        return []
+
+    return [build_vehicle_alert(
+        inputs, vehicle, 'fuel_anomaly', 'warning',
+        title=f'🚨 Consumo elevado - {vehicle.name}',
+        message=f'O veículo {vehicle.name} está consumindo {deviation:.1f}% mais combustível que o normal. '
+                f'Consumo atual: {recent_avg:.1f} km/L vs média histórica: {historical_avg:.1f} km/L. '
+                f'Recomendamos verificar filtros, pneus e agendar manutenção preventiva.',
+        metadata={
+            'recent_consumption': recent_avg,
+            'historical_consumption': historical_avg,
+            'deviation_percentage': deviation,
+            'zscore': zscore if std > 0 else None,
+            'records_analyzed': state.sample_count
+        }
+    )]
 
-        print(f"[ALERT] ✅ Manutenção preventiva: {alerts_created} alertas criados")
-        return alerts_created
+def check_time_based_maintenance(vehicle, today, inputs):
+    """Alertas baseados em tempo desde última manutenção"""
+    if alert_recently_created(inputs, vehicle.id, 'maintenance'):
+        return []  # Não criar alertas duplicados
 
-    except Exception as e:
-        print(f"[ALERT] ❌ Erro na verificação de manutenção: {str(e)}")
-        return 0
+    last_maintenance = inputs['latest_maintenance'].get(vehicle.id)
+    if not last_maintenance:
+        # Veículo sem histórico de manutenção
+        return [build_vehicle_alert(
+            inputs, vehicle, 'maintenance', 'warning',
+            title=f'📝 Registrar Primeira Manutenção - {vehicle.brand} {vehicle.model}',
+            message='Nenhuma manutenção registrada para este veículo. Registre o histórico para ativar alertas automáticos.',
+            metadata={'reason': 'no_maintenance_history'}
+        )]
+
+    days_since_maintenance = (today - last_maintenance.date).days
+    config = MAINTENANCE_TIME_INTERVALS.get(last_maintenance.maintenance_type, DEFAULT_TIME_INTERVAL)
+
+    # Alerta crítico (manutenção vencida)
+    if days_since_maintenance >= config['critical']:
+        days_overdue = days_since_maintenance - config['interval']
+        return [build_vehicle_alert(
+            inputs, vehicle, 'maintenance', 'critical',
+            title=f'🚨 Manutenção VENCIDA - {vehicle.brand} {vehicle.model}',
+            message=f'Manutenção de {last_maintenance.maintenance_type} está {days_overdue} dias em atraso. AÇÃO URGENTE necessária!',
+            metadata={
+                'maintenance_type': last_maintenance.maintenance_type,
+                'days_overdue': days_overdue,
+                'last_maintenance_date': last_maintenance.date.isoformat()
+            }
+        )]
+
+    # Alerta de aviso (manutenção próxima)
+    if days_since_maintenance >= config['warning']:
+        days_until_due = config['interval'] - days_since_maintenance
+        return [build_vehicle_alert(
+            inputs, vehicle, 'maintenance', 'warning',
+            title=f'⚠️ Manutenção Próxima - {vehicle.brand} {vehicle.model}',
+            message=f'Manutenção de {last_maintenance.maintenance_type} vence em {abs(days_until_due)} dias. Agende em breve!',
+            metadata={
+                'maintenance_type': last_maintenance.maintenance_type,
+                'days_until_due': days_until_due,
+                'last_maintenance_date': last_maintenance.date.isoformat()
+            }
+        )]
 
-def check_time_based_maintenance(vehicle, today):
-    """Alertas baseados em tempo desde última manutenção"""
-    alerts_created = 0
+    return []
 
-    # Buscar última manutenção
-    last_maintenance = MaintenanceRecord.query.filter_by(
-        vehicle_id=vehicle.id
-    ).order_by(MaintenanceRecord.date.desc()).first()
+def check_mileage_based_maintenance(vehicle, today, inputs):
+    """Alertas baseados em quilometragem percorrida"""
+    fuel = inputs['fuel'].get(vehicle.id)
+    last_maintenance = inputs['latest_maintenance_with_km'].get(vehicle.id)
+    if not fuel or not fuel['current_odometer'] or not last_maintenance:
+        return []
+
+    current_mileage = fuel['current_odometer']
+    km_since_maintenance = current_mileage - last_maintenance.km_at_service
+    interval_km = MAINTENANCE_KM_INTERVALS.get(last_maintenance.maintenance_type, DEFAULT_KM_INTERVAL)
+
+    if km_since_maintenance < interval_km or alert_recently_created(inputs, vehicle.id, 'maintenance'):
+        return []
+
+    km_overdue = km_since_maintenance - interval_km
+    return [build_vehicle_alert(
+        inputs, vehicle, 'maintenance', 'critical' if km_overdue > 2000 else 'warning',
+        title=f'🛣️ Manutenção por KM - {vehicle.brand} {vehicle.model}',
+        message=f'Veículo rodou {km_since_maintenance:,.0f} km desde a última {last_maintenance.maintenance_type}. Limite: {interval_km:,.0f} km.',
+        metadata={
+            'maintenance_type': last_maintenance.maintenance_type,
+            'km_since_maintenance': km_since_maintenance,
+            'km_overdue': km_overdue,
+            'current_mileage': current_mileage
+        }
+    )]
 
-    if last_maintenance:
-        days_since_maintenance = (today - last_maintenance.date).days
+def check_consumption_anomaly_alerts(vehicle, today, inputs):
+    """Alertas por consumo anômalo que pode indicar problemas mecânicos"""
+    fuel = inputs['fuel'].get(vehicle.id)
+
+    # Precisa de pelo menos 3 registros recentes (30 dias) e 3 históricos (30 a 90 dias)
+    if not fuel or fuel['recent_count'] < 3 or fuel['historical_count'] < 3:
+        return []
+
+    avg_recent = fuel['recent_average']
+    avg_historical = fuel['historical_average']
+
+    # Verificar se houve piora significativa (mais de 15% de queda na eficiência)
+    consumption_change = ((avg_recent - avg_historical) / avg_historical) * 100
+    if consumption_change >= -15 or alert_recently_created(inputs, vehicle.id, 'consumption_anomaly'):
+        return []
+
+    return [build_vehicle_alert(
+        inputs, vehicle, 'consumption_anomaly', 'warning',
+        title=f'📉 Consumo Anômalo - {vehicle.brand} {vehicle.model}',
+        message=f'Consumo piorou {abs(consumption_change):.1f}% nos últimos 30 dias. Pode indicar necessidade de manutenção.',
+        metadata={
+            'consumption_change_percent': consumption_change,
+            'avg_recent': avg_recent,
+            'avg_historical': avg_historical,
+            'recent_records_count': fuel['recent_count']
+        }
+    )]
 
-        # Intervalos melhorados por tipo de manutenção
-        maintenance_intervals = {
-            'oil_change': {
-                'interval': 90,      # 3 meses
-                'warning': 75,       # Alerta 15 dias antes
-                'critical': 100      # Crítico 10 dias após vencimento
-            },
-            'tire_rotation': {
-                'interval': 180,     # 6 meses
-                'warning': 150,      # Alerta 30 dias antes
-                'critical': 210      # Crítico 30 dias após
-            },
-            'brake_service': {
-                'interval': 365,     # 1 ano
-                'warning': 335,      # Alerta 30 dias antes
-                'critical': 395      # Crítico 30 dias após
-            },
-            'general_service': {
-                'interval': 180,     # 6 meses
-                'warning': 150,      # Alerta 30 dias antes
-                'critical': 210      # Crítico 30 dias após
-            }
+def check_vehicle_age_alerts(vehicle, today, inputs):
+    """Alertas baseados na idade do veículo"""
+    if not vehicle.year:
+        return []
+
+    vehicle_age = today.year - vehicle.year
+
+    # Veículo com 10+ anos, alerta a cada 3 meses
+    if vehicle_age < 10 or alert_recently_created(inputs, vehicle.id, 'vehicle_age'):
+        return []
+
+    return [build_vehicle_alert(
+        inputs, vehicle, 'vehicle_age', 'critical' if vehicle_age >= 15 else 'warning',
+        title=f'🕐 Veículo Antigo - {vehicle.brand} {vehicle.model}',
+        message=f'Veículo de {vehicle.year} ({vehicle_age} anos) requer manutenção preventiva mais frequente.',
+        metadata={
+            'vehicle_age': vehicle_age,
+            'vehicle_year': vehicle.year,
+            'recommendation': 'Manutenção preventiva a cada 3-4 meses'
         }
+    )]
+
+FUEL_ALERT_RULES = (check_fuel_anomaly_alerts,)
+MAINTENANCE_ALERT_RULES = (
+    check_time_based_maintenance,
+    check_mileage_based_maintenance,
+    check_consumption_anomaly_alerts,
+    check_vehicle_age_alerts
+)
+
+def iter_vehicle_batches(vehicle_ids=None, batch_size=ALERT_BATCH_SIZE, shard=None):
+    """Veículos ativos em lotes, paginados por id (keyset)"""
+    last_id = 0
+    while True:
+        query = Vehicle.query.filter(Vehicle.is_active == True, Vehicle.id > last_id)
+        if vehicle_ids is not None:
+            query = query.filter(Vehicle.id.in_(vehicle_ids))
+        if shard is not None:
+            query = query.filter(shard_vehicle_filter(shard))
+        batch = query.order_by(Vehicle.id).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+def insert_alerts_ignoring_duplicates(alerts):
+    """Grava os alertas em um único INSERT ... ON CONFLICT DO NOTHING e retorna os que foram de fato inseridos"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        db.session.execute(db.insert(Alert), alerts)
+        adjust_unread_alert_counters([(alert.get('user_id'), alert.get('fleet_id')) for alert in alerts], 1)
+        return alerts
+
+    statement = insert(Alert).on_conflict_do_nothing(
+        index_elements=['vehicle_id', 'alert_type', 'dedup_bucket']
+    ).returning(Alert.vehicle_id, Alert.alert_type)
+    inserted = {tuple(row) for row in db.session.execute(statement, alerts)}
+    alerts = [alert for alert in alerts if (alert['vehicle_id'], alert['alert_type']) in inserted]
+    adjust_unread_alert_counters([(alert.get('user_id'), alert.get('fleet_id')) for alert in alerts], 1)
+    return alerts
+
+def alert_requires_email(alert):
+    """Alertas notificados por email: consumo muito acima do normal e manutenção vencida"""
+    if alert['alert_type'] == 'fuel_anomaly':
+        return alert['alert_data'].get('deviation_percentage', 0) > FUEL_ANOMALY_EMAIL_PERCENT
+    return alert['alert_type'] == 'maintenance' and alert['severity'] == 'critical'
+
+def alert_notifications(alerts, vehicle_names):
+    """Notificações (dicts simples, serializáveis entre processos) dos alertas que exigem email"""
+    return [
+        {
+            'user_id': alert['user_id'],
+            'fleet_id': alert['fleet_id'],
+            'vehicle_id': alert['vehicle_id'],
+            'vehicle_name': vehicle_names.get(alert['vehicle_id'], ''),
+            'alert_type': alert['alert_type'],
+            'severity': alert['severity'],
+            'title': alert['title'],
+            'message': alert['message']
+        }
+        for alert in alerts if alert_requires_email(alert)
+    ]
 
-        config = maintenance_intervals.get(last_maintenance.service_type, {
-            'interval': 180, 'warning': 150, 'critical': 210
-        })
+# Contador de comandos SQL da execução de alertas em andamento nesta thread
+alert_query_counter = threading.local()
 
-        # Verificar se já existe alerta recente
-        existing_alert = Alert.query.filter(
-            Alert.vehicle_id == vehicle.id,
-            Alert.alert_type == 'maintenance',
-            Alert.created_at >= today - timedelta(days=7)
-        ).first()
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_alert_queries(conn, cursor, statement, parameters, context, executemany):
+    """Conta os comandos SQL emitidos enquanto uma execução de alertas está ativa na thread"""
+    if getattr(alert_query_counter, 'active', False):
+        alert_query_counter.count += 1
 
-        if existing_alert:
-            return 0  # Não criar alertas duplicados
-
-        # Alerta crítico (manutenção vencida)
-        if days_since_maintenance >= config['critical']:
-            days_overdue = days_since_maintenance - config['interval']
-
-            create_alert(
-                user_id=vehicle.user_id if not vehicle.fleet_id else None,
-                fleet_id=vehicle.fleet_id,
-                vehicle_id=vehicle.id,
-                alert_type='maintenance',
-                severity='critical',
-                title=f'🚨 Manutenção VENCIDA - {vehicle.brand} {vehicle.model}',
-                message=f'Manutenção de {last_maintenance.service_type} está {days_overdue} dias em atraso. AÇÃO URGENTE necessária!',
-                metadata=json.dumps({
-                    'maintenance_type': last_maintenance.service_type,
-                    'days_overdue': days_overdue,
-                    'last_maintenance_date': last_maintenance.date.isoformat()
-                })
-            )
-            alerts_created += 1
-
-        # Alerta de aviso (manutenção próxima)
-        elif days_since_maintenance >= config['warning']:
-            days_until_due = config['interval'] - days_since_maintenance
-
-            create_alert(
-                user_id=vehicle.user_id if not vehicle.fleet_id else None,
-                fleet_id=vehicle.fleet_id,
-                vehicle_id=vehicle.id,
-                alert_type='maintenance',
-                severity='warning',
-                title=f'⚠️ Manutenção Próxima - {vehicle.brand} {vehicle.model}',
-                message=f'Manutenção de {last_maintenance.service_type} vence em {abs(days_until_due)} dias. Agende em breve!',
-                metadata=json.dumps({
-                    'maintenance_type': last_maintenance.service_type,
-                    'days_until_due': days_until_due,
-                    'last_maintenance_date': last_maintenance.date.isoformat()
-                })
-            )
-            alerts_created += 1
-    else:
-        # Veículo sem histórico de manutenção
-        create_alert(
-            user_id=vehicle.user_id if not vehicle.fleet_id else None,
-            fleet_id=vehicle.fleet_id,
-            vehicle_id=vehicle.id,
-            alert_type='maintenance',
-            severity='warning',
-            title=f'📝 Registrar Primeira Manutenção - {vehicle.brand} {vehicle.model}',
-            message=f'Nenhuma manutenção registrada para este veículo. Registre o histórico para ativar alertas automáticos.',
-            metadata=json.dumps({
-                'reason': 'no_maintenance_history'
-            })
-        )
-        alerts_created += 1
+def new_alert_stage_stats():
+    """Métricas de uma etapa (carga das entradas, gravação) da execução de alertas"""
+    return {'queries': 0, 'seconds': 0.0}
 
-    return alerts_created
+def new_alert_rule_stats():
+    """Métricas de uma regra de alerta"""
+    return {'vehicles_evaluated': 0, 'alerts_created': 0, 'duplicates_suppressed': 0, 'queries': 0, 'seconds': 0.0}
 
-def check_mileage_based_maintenance(vehicle, today):
-    """Alertas baseados em quilometragem percorrida"""
+def new_alert_run_stats():
+    """Resumo estruturado de uma execução de alertas: totais, etapas e métricas por regra"""
+    return {
+        'vehicles': 0,
+        'batches': 0,
+        'alerts_created': 0,
+        'duplicates_suppressed': 0,
+        'queries': 0,
+        'seconds': 0.0,
+        'stages': {'load_inputs': new_alert_stage_stats(), 'insert': new_alert_stage_stats()},
+        'rules': {}
+    }
+
+def merge_alert_stats(total, stats):
+    """Soma as métricas de stats em total (shards da mesma execução)"""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            merge_alert_stats(total.setdefault(key, {}), value)
+        else:
+            total[key] = round(total.get(key, 0) + value, 4)
+    return total
+
+def print_alert_stats(stats):
+    """Relatório por regra, da mais lenta para a mais rápida"""
+    print(f"[ALERT] {stats['vehicles']} veículos em {stats['batches']} lotes, {stats['queries']} consultas, "
+          f"{stats['seconds']:.3f}s")
+    for stage, values in stats['stages'].items():
+        print(f"[ALERT]   etapa {stage}: {values['queries']} consultas, {values['seconds']:.3f}s")
+    for name, values in sorted(stats['rules'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"[ALERT]   {name}: {values['vehicles_evaluated']} veículos, {values['alerts_created']} alertas, "
+              f"{values['duplicates_suppressed']} duplicados, {values['queries']} consultas, {values['seconds']:.3f}s")
+
+def run_alert_rules(rules, vehicle_ids=None, today=None, batch_size=ALERT_BATCH_SIZE, shard=None,
+                    notifications=None, stats=None):
+    """Avalia as regras em memória sobre lotes de veículos e grava os alertas de cada lote em um único INSERT
+
+    A consulta de alertas recentes aplica as janelas deslizantes; a chave única
+    (vehicle_id, alert_type, dedup_bucket) descarta duplicatas de execuções concorrentes.
+    As notificações por email são acumuladas em `notifications`; sem a lista, os
+    resumos são enviados ao fim da execução. Com `stats` (new_alert_run_stats), as
+    métricas por regra e por etapa são somadas nele.
+    """
+    today = today or datetime.now().date()
     alerts_created = 0
+    send_digests = notifications is None
+    notifications = [] if send_digests else notifications
+    stats = stats if stats is not None else new_alert_run_stats()
+    rule_stats = {rule.__name__: stats['rules'].setdefault(rule.__name__, new_alert_rule_stats()) for rule in rules}
 
-    try:
-        # Buscar último registro de combustível para verificar quilometragem atual
-        last_fuel_record = FuelRecord.query.filter_by(
-            vehicle_id=vehicle.id
-        ).order_by(FuelRecord.date.desc()).first()
+    previous_counter = (getattr(alert_query_counter, 'active', False), getattr(alert_query_counter, 'count', 0))
+    alert_query_counter.active, alert_query_counter.count = True, 0
+    run_started = time.perf_counter()
 
-        if not last_fuel_record or not last_fuel_record.odometer:
-            return 0
+    def measure(entry, started, queries):
+        entry['seconds'] += time.perf_counter() - started
+        entry['queries'] += alert_query_counter.count - queries
 
-        current_mileage = last_fuel_record.odometer
+    try:
+        for vehicles in iter_vehicle_batches(vehicle_ids, batch_size, shard):
+            stats['vehicles'] += len(vehicles)
+            stats['batches'] += 1
+
+            started, queries = time.perf_counter(), alert_query_counter.count
+            inputs = load_alert_inputs([vehicle.id for vehicle in vehicles], today)
+            measure(stats['stages']['load_inputs'], started, queries)
+
+            alerts, origins = [], {}
+            for vehicle in vehicles:
+                for rule in rules:
+                    entry = rule_stats[rule.__name__]
+                    started, queries, suppressed = time.perf_counter(), alert_query_counter.count, inputs['duplicates_suppressed']
+                    produced = rule(vehicle, today, inputs)
+                    measure(entry, started, queries)
+                    entry['vehicles_evaluated'] += 1
+                    entry['duplicates_suppressed'] += inputs['duplicates_suppressed'] - suppressed
+                    for alert in produced:
+                        origins[(alert['vehicle_id'], alert['alert_type'])] = entry
+                    alerts.extend(produced)
+            if not alerts:
+                continue
 
-        # Buscar última manutenção com quilometragem
-        last_maintenance = MaintenanceRecord.query.filter(
-            MaintenanceRecord.vehicle_id == vehicle.id,
-            MaintenanceRecord.mileage.isnot(None)
-        ).order_by(MaintenanceRecord.date.desc()).first()
+            vehicle_names = {vehicle.id: vehicle.name for vehicle in vehicles}
+            started, queries = time.perf_counter(), alert_query_counter.count
+            try:
+                inserted = insert_alerts_ignoring_duplicates(alerts)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[ALERT] ❌ Erro ao gravar lote de alertas: {str(e)}")
+                continue
+            finally:
+                measure(stats['stages']['insert'], started, queries)
+
+            # Duplicatas barradas pela chave única contam para a regra que gerou o alerta
+            inserted_keys = {(alert['vehicle_id'], alert['alert_type']) for alert in inserted}
+            for key, entry in origins.items():
+                if key in inserted_keys:
+                    entry['alerts_created'] += 1
+                else:
+                    entry['duplicates_suppressed'] += 1
 
-        if last_maintenance and last_maintenance.mileage:
-            km_since_maintenance = current_mileage - last_maintenance.mileage
+            if len(inserted) < len(alerts):
+                print(f"[ALERT] {len(alerts) - len(inserted)} alertas já existentes na janela foram ignorados")
+            alerts_created += len(inserted)
+            notifications.extend(alert_notifications(inserted, vehicle_names))
 
-            # Intervalos por quilometragem
-            mileage_intervals = {
-                'oil_change': 10000,      # 10.000 km
-                'tire_rotation': 15000,   # 15.000 km
-                'brake_service': 40000,   # 40.000 km
-                'general_service': 20000  # 20.000 km
-            }
+        stats['alerts_created'] += alerts_created
+        stats['duplicates_suppressed'] = sum(entry['duplicates_suppressed'] for entry in stats['rules'].values())
+        stats['queries'] += alert_query_counter.count
+        stats['seconds'] += time.perf_counter() - run_started
+    finally:
+        alert_query_counter.active, alert_query_counter.count = previous_counter
 
-            interval_km = mileage_intervals.get(last_maintenance.service_type, 15000)
+    for entry in [stats, *stats['stages'].values(), *stats['rules'].values()]:
+        entry['seconds'] = round(entry['seconds'], 4)
 
-            # Verificar se precisa de manutenção
-            if km_since_maintenance >= interval_km:
-                km_overdue = km_since_maintenance - interval_km
+    if send_digests:
+        send_alert_digests(notifications)
+    return alerts_created
 
-                # Verificar se já existe alerta recente
-                existing_alert = Alert.query.filter(
-                    Alert.vehicle_id == vehicle.id,
-                    Alert.alert_type == 'maintenance',
-                    Alert.created_at >= today - timedelta(days=7)
-                ).first()
+def alert_digest_recipients(notifications):
+    """Agrupa as notificações por destinatário: administradores da frota ou dono do veículo pessoal"""
+    fleet_ids = {item['fleet_id'] for item in notifications if item['fleet_id']}
+    owner_ids = {item['user_id'] for item in notifications if not item['fleet_id'] and item['user_id']}
+
+    fleet_admins, fleet_names = {}, {}
+    if fleet_ids:
+        rows = db.session.query(FleetMember.fleet_id, Fleet.name, User)\
+            .join(Fleet, Fleet.id == FleetMember.fleet_id)\
+            .join(User, User.id == FleetMember.user_id)\
+            .filter(
+                FleetMember.fleet_id.in_(fleet_ids),
+                FleetMember.role.in_(['owner', 'admin']),
+                FleetMember.is_active == True
+            ).all()
+        for fleet_id, fleet_name, user in rows:
+            fleet_admins.setdefault(fleet_id, []).append(user)
+            fleet_names[fleet_id] = fleet_name
+    owners = {user.id: user for user in User.query.filter(User.id.in_(owner_ids))} if owner_ids else {}
+
+    digests = {}
+    for item in notifications:
+        fleet_name = fleet_names.get(item['fleet_id'], '')
+        if item['fleet_id']:
+            users = fleet_admins.get(item['fleet_id'], [])
+        else:
+            users = [owners[item['user_id']]] if item['user_id'] in owners else []
 
-                if not existing_alert:
-                    create_alert(
-                        user_id=vehicle.user_id if not vehicle.fleet_id else None,
-                        fleet_id=vehicle.fleet_id,
-                        vehicle_id=vehicle.id,
-                        alert_type='maintenance',
-                        severity='critical' if km_overdue > 2000 else 'warning',
-                        title=f'🛣️ Manutenção por KM - {vehicle.brand} {vehicle.model}',
-                        message=f'Veículo rodou {km_since_maintenance:,.0f} km desde a última {last_maintenance.service_type}. Limite: {interval_km:,.0f} km.',
-                        metadata=json.dumps({
-                            'maintenance_type': last_maintenance.service_type,
-                            'km_since_maintenance': km_since_maintenance,
-                            'km_overdue': km_overdue,
-                            'current_mileage': current_mileage
-                        })
-                    )
-                    alerts_created += 1
+        for user in users:
+            if not user.email:
+                continue
+            digest = digests.setdefault(user.email, {
+                'user_name': user.username, 'alerts': [], 'fleet_names': []
+            })
+            digest['alerts'].append(dict(item, fleet_name=fleet_name))
+            if fleet_name and fleet_name not in digest['fleet_names']:
+                digest['fleet_names'].append(fleet_name)
+    return digests
+
+def build_alert_digest_messages(digests):
+    """Renderiza uma mensagem por destinatário"""
+    messages = []
+    for email, digest in digests.items():
+        count = len(digest['alerts'])
+        messages.append(Message(
+            f"🚨 Rodo Stats: {count} alerta{'s' if count > 1 else ''} exigindo atenção",
+            recipients=[email],
+            html=render_template(
+                'emails/alert_digest.html',
+                user_name=digest['user_name'],
+                alerts=digest['alerts'],
+                fleet_names=digest['fleet_names'],
+                current_year=datetime.utcnow().year
+            ),
+            sender=app.config['MAIL_DEFAULT_SENDER']
+        ))
+    return messages
+
+def deliver_alert_digests(messages):
+    """Envia todas as mensagens por uma única conexão SMTP (um handshake por execução)"""
+    with app.app_context():
+        sent = 0
+        try:
+            with mail.connect() as connection:
+                for message in messages:
+                    try:
+                        connection.send(message)
+                        sent += 1
+                    except Exception as e:
+                        print(f"[EMAIL] ❌ Erro ao enviar resumo para {message.recipients}: {str(e)}")
+        except Exception as e:
+            print(f"[EMAIL] ❌ Erro na conexão SMTP dos resumos de alertas: {str(e)}")
+        print(f"[EMAIL] ✅ {sent}/{len(messages)} resumos de alertas enviados")
+        return sent
+
+def send_alert_digests(notifications):
+    """Um resumo por destinatário com os alertas da execução, entregue conforme ALERT_EMAIL_MODE"""
+    mode = app.config.get('ALERT_EMAIL_MODE', 'thread')
+    if not notifications or mode == 'off':
+        return 0
 
+    # Os alertas já estão gravados: falhas no email não interrompem a verificação
+    try:
+        messages = build_alert_digest_messages(alert_digest_recipients(notifications))
     except Exception as e:
-        print(f"[ALERT] Erro na verificação por quilometragem: {str(e)}")
+        print(f"[EMAIL] ❌ Erro ao montar resumos de alertas: {str(e)}")
+        return 0
+    if not messages:
+        return 0
+    if mode == 'thread':
+        # Thread não-daemon: o processo (ex.: CLI) só termina após a entrega
+        threading.Thread(target=deliver_alert_digests, args=(messages,), name='alert-digest').start()
+    else:
+        deliver_alert_digests(messages)
+    return len(messages)
 
-    return alerts_created
+def check_fuel_anomalies():
+    """Verificar anomalias de consumo para todos os veículos"""
+    try:
+        print("[ALERT] 🔍 Verificando anomalias de combustível...")
+        alerts_created = run_alert_rules(FUEL_ALERT_RULES)
+        print(f"[ALERT] ✅ Verificação de combustível concluída. {alerts_created} alertas criados.")
+        return alerts_created
 
-def check_consumption_anomaly_alerts(vehicle, today):
-    """Alertas por consumo anômalo que pode indicar problemas mecânicos"""
-    alerts_created = 0
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ALERT] ❌ Erro ao verificar anomalias: {str(e)}")
+        return 0
 
+def check_maintenance_alerts():
+    """Verificar alertas de manutenção preventiva inteligente"""
     try:
-        # Buscar registros dos últimos 30 dias
-        recent_records = FuelRecord.query.filter(
-            FuelRecord.vehicle_id == vehicle.id,
-            FuelRecord.date >= today - timedelta(days=30),
-            FuelRecord.consumption.isnot(None),
-            FuelRecord.consumption > 0
-        ).all()
+        print("[ALERT] 🔧 Verificando alertas de manutenção preventiva...")
+        alerts_created = run_alert_rules(MAINTENANCE_ALERT_RULES)
+        print(f"[ALERT] ✅ Manutenção preventiva: {alerts_created} alertas criados")
+        return alerts_created
 
-        if len(recent_records) < 3:
-            return 0  # Precisa de pelo menos 3 registros
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ALERT] ❌ Erro na verificação de manutenção: {str(e)}")
+        return 0
 
-        # Calcular consumo médio recente
-        recent_consumptions = [r.consumption for r in recent_records]
-        avg_recent = sum(recent_consumptions) / len(recent_consumptions)
+# Shards por processo: faixas menores equilibram frotas de tamanhos diferentes entre os processos
+ALERT_SHARDS_PER_WORKER = 4
 
-        # Buscar registros históricos (últimos 90 dias, excluindo os 30 recentes)
-        historical_records = FuelRecord.query.filter(
-            FuelRecord.vehicle_id == vehicle.id,
-            FuelRecord.date >= today - timedelta(days=90),
-            FuelRecord.date < today - timedelta(days=30),
-            FuelRecord.consumption.isnot(None),
-            FuelRecord.consumption > 0
-        ).all()
+def partition_alert_shards(shard_count):
+    """Divide os veículos ativos em faixas contíguas de ids de frota (ou de usuário, para veículos pessoais)
 
-        if len(historical_records) < 3:
-            return 0  # Precisa de histórico para comparar
+    Um mesmo dono nunca é dividido entre shards, e cada shard recebe aproximadamente o
+    mesmo número de veículos.
+    """
+    owner_kind = db.case((Vehicle.fleet_id.is_(None), 'user'), else_='fleet')
+    owner_id = db.func.coalesce(Vehicle.fleet_id, Vehicle.user_id)
+    owners = db.session.query(owner_kind, owner_id, db.func.count(Vehicle.id))\
+        .filter(Vehicle.is_active == True)\
+        .group_by(owner_kind, owner_id).order_by(owner_kind, owner_id).all()
+
+    total = sum(count for _, _, count in owners)
+    target = max(1, -(-total // max(1, shard_count)))
+
+    shards = []
+    for kind, owner, count in owners:
+        current = shards[-1] if shards else None
+        if current is None or current['kind'] != kind or current['vehicles'] + count > target:
+            current = {'kind': kind, 'first_id': owner, 'last_id': owner, 'vehicles': 0}
+            shards.append(current)
+        current['last_id'] = owner
+        current['vehicles'] += count
+    return shards
+
+def shard_vehicle_filter(shard):
+    """Filtro SQL dos veículos de um shard"""
+    if shard['kind'] == 'fleet':
+        return Vehicle.fleet_id.between(shard['first_id'], shard['last_id'])
+    return db.and_(Vehicle.fleet_id.is_(None), Vehicle.user_id.between(shard['first_id'], shard['last_id']))
+
+def evaluate_alert_shard(shard, today=None, rules=None):
+    """Executa as regras sobre um shard e devolve o relatório de tempo, alertas e notificações"""
+    started = time.perf_counter()
+    notifications = []
+    stats = new_alert_run_stats()
+    alerts_created = run_alert_rules(rules or daily_alert_rules(), today=today, shard=shard,
+                                     notifications=notifications, stats=stats)
+    return dict(shard, alerts_created=alerts_created, seconds=round(time.perf_counter() - started, 3),
+                pid=os.getpid(), notifications=notifications, stats=stats)
+
+def init_alert_shard_process():
+    """Inicialização do processo filho: não reutilizar conexões herdadas do processo pai"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def run_alert_shard_process(shard, today, rules):
+    """Ponto de entrada de um shard no pool de processos (sessão e engine próprios)"""
+    with app.app_context():
+        try:
+            return evaluate_alert_shard(shard, today, rules)
+        finally:
+            db.session.remove()
 
-        # Calcular consumo médio histórico
-        historical_consumptions = [r.consumption for r in historical_records]
-        avg_historical = sum(historical_consumptions) / len(historical_consumptions)
+def run_sharded_alert_checks(workers=None, today=None, rules=None):
+    """Verificação diária particionada por frota/usuário e executada em um pool de processos
 
-        # Verificar se houve piora significativa (mais de 15% de queda na eficiência)
-        consumption_change = ((avg_recent - avg_historical) / avg_historical) * 100
+    No SQLite (banco local ou de testes) ou com um único processo os shards rodam em
+    sequência no processo atual.
+    """
+    workers = workers or app.config.get('ALERT_WORKERS', 1)
+    today = today or datetime.now().date()
+    rules = rules or daily_alert_rules()
+    shards = partition_alert_shards(workers * ALERT_SHARDS_PER_WORKER if workers > 1 else 1)
 
-        if consumption_change < -15:  # Consumo piorou mais de 15%
-            # Verificar se já existe alerta recente
-            existing_alert = Alert.query.filter(
-                Alert.vehicle_id == vehicle.id,
-                Alert.alert_type == 'consumption_anomaly',
-                Alert.created_at >= today - timedelta(days=14)
-            ).first()
+    if workers <= 1 or len(shards) <= 1 or db.engine.dialect.name == 'sqlite':
+        reports = [evaluate_alert_shard(shard, today, rules) for shard in shards]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Devolver as conexões do pool antes do fork; a sessão do processo pai (e o job em
+        # execução) continua válida e cada processo filho abre as próprias conexões
+        db.engine.dispose()
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)), initializer=init_alert_shard_process) as pool:
+            reports = list(pool.map(run_alert_shard_process, shards, [today] * len(shards), [rules] * len(shards)))
+
+    # Um resumo por destinatário para a execução inteira, mesmo com frotas em shards diferentes
+    send_alert_digests([item for report in reports for item in report.pop('notifications')])
+    return reports
+
+def print_shard_report(reports):
+    """Relatório de tempo por shard"""
+    for index, report in enumerate(reports, start=1):
+        print(f"[ALERT] Shard {index} ({report['kind']} {report['first_id']}-{report['last_id']}, "
+              f"{report['vehicles']} veículos, pid {report['pid']}): "
+              f"{report['alerts_created']} alertas em {report['seconds']:.3f}s")
+
+def merge_shard_stats(reports, stats=None):
+    """Resumo da execução inteira a partir das métricas de cada shard"""
+    stats = stats if stats is not None else new_alert_run_stats()
+    for report in reports:
+        merge_alert_stats(stats, report['stats'])
+    stats['shards'] = len(reports)
+    if len(reports) > 1:
+        # Tempo de parede da execução: shards em paralelo não somam
+        stats['seconds'] = max(report['stats']['seconds'] for report in reports)
+    return stats
+
+def run_daily_alert_checks(workers=None, full=False, stats=None, raise_errors=False):
+    """Executar verificações diárias de alertas; com `stats`, preenche o resumo por regra
+
+    Com raise_errors=True a falha é propagada (agendador: a execução fica 'failed' e é repetida).
+    """
+    print("[ALERT] 🤖 Iniciando verificações diárias de alertas...")
+    
+    # Uma única passada por shard: as entradas de cada lote são carregadas uma vez para todas as regras
+    try:
+        reports = run_sharded_alert_checks(workers, rules=daily_alert_rules(full))
+        if len(reports) > 1:
+            print_shard_report(reports)
+        total_alerts = sum(report['alerts_created'] for report in reports)
+        print_alert_stats(merge_shard_stats(reports, stats))
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ALERT] ❌ Erro nas verificações diárias: {str(e)}")
+        if raise_errors:
+            raise
+        total_alerts = 0
 
-            if not existing_alert:
-                create_alert(
-                    user_id=vehicle.user_id if not vehicle.fleet_id else None,
-                    fleet_id=vehicle.fleet_id,
-                    vehicle_id=vehicle.id,
-                    alert_type='consumption_anomaly',
-                    severity='warning',
-                    title=f'📉 Consumo Anômalo - {vehicle.brand} {vehicle.model}',
-                    message=f'Consumo piorou {abs(consumption_change):.1f}% nos últimos 30 dias. Pode indicar necessidade de manutenção.',
-                    metadata=json.dumps({
-                        'consumption_change_percent': consumption_change,
-                        'avg_recent': avg_recent,
-                        'avg_historical': avg_historical,
-                        'recent_records_count': len(recent_records)
-                    })
-                )
-                alerts_created += 1
+    print(f"[ALERT] ✅ Verificações concluídas. Total: {total_alerts} alertas criados")
+    
+    return total_alerts
+
+# === AVALIAÇÃO INCREMENTAL DE ALERTAS ===
+
+# Regras que dependem de abastecimentos e manutenções: reavaliadas a cada gravação do veículo
+INCREMENTAL_ALERT_RULES = (
+    check_fuel_anomaly_alerts,
+    check_time_based_maintenance,
+    check_mileage_based_maintenance,
+    check_consumption_anomaly_alerts
+)
+
+# Regras que mudam só com a passagem do tempo: as únicas que a varredura diária precisa rodar
+TIME_ALERT_RULES = (check_time_based_maintenance, check_vehicle_age_alerts)
+
+# Espera para agrupar gravações em sequência do mesmo veículo no modo 'thread'
+ALERT_QUEUE_DEBOUNCE_SECONDS = 1.0
+
+alert_vehicle_queue = queue.Queue()
+alert_worker_state = {'thread': None, 'lock': threading.Lock()}
+
+def daily_alert_rules(full=False):
+    """Regras da varredura diária: só as de tempo quando a avaliação incremental está ligada"""
+    if full or app.config.get('ALERT_INCREMENTAL_MODE', 'job') == 'off':
+        return FUEL_ALERT_RULES + MAINTENANCE_ALERT_RULES
+    return TIME_ALERT_RULES
+
+@event.listens_for(FuelRecord, 'after_insert')
+@event.listens_for(FuelRecord, 'after_update')
+@event.listens_for(MaintenanceRecord, 'after_insert')
+@event.listens_for(MaintenanceRecord, 'after_update')
+def mark_vehicle_for_alerts(mapper, connection, target):
+    """Marca o veículo do registro gravado para reavaliação após o commit"""
+    session = object_session(target)
+    if session is not None and target.vehicle_id:
+        session.info.setdefault('alert_vehicle_ids', set()).add(target.vehicle_id)
+
+@event.listens_for(Session, 'after_commit')
+def enqueue_alert_vehicles_after_commit(session):
+    """Envia para reavaliação os veículos gravados na transação confirmada"""
+    vehicle_ids = session.info.pop('alert_vehicle_ids', None)
+    if vehicle_ids:
+        enqueue_alert_evaluation(vehicle_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_alert_vehicles_after_rollback(session):
+    """Gravações desfeitas não geram reavaliação"""
+    session.info.pop('alert_vehicle_ids', None)
+
+def evaluate_vehicle_alerts(vehicle_ids):
+    """Reavalia as regras incrementais dos veículos em um app context (e sessão) próprio"""
+    with app.app_context():
+        try:
+            return run_alert_rules(INCREMENTAL_ALERT_RULES, vehicle_ids=sorted(vehicle_ids))
+        except Exception as e:
+            db.session.rollback()
+            print(f"[ALERT] ❌ Erro na reavaliação incremental: {str(e)}")
+            return 0
+        finally:
+            db.session.remove()
+
+def alert_worker_loop():
+    """Consome a fila de veículos, agrupando as gravações próximas em uma única avaliação"""
+    while True:
+        vehicle_ids = {alert_vehicle_queue.get()}
+        time.sleep(ALERT_QUEUE_DEBOUNCE_SECONDS)
+        while True:
+            try:
+                vehicle_ids.add(alert_vehicle_queue.get_nowait())
+            except queue.Empty:
+                break
+        evaluate_vehicle_alerts(vehicle_ids)
+
+def ensure_alert_worker():
+    """Inicia (uma vez por processo) a thread que consome a fila de reavaliação"""
+    with alert_worker_state['lock']:
+        thread = alert_worker_state['thread']
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=alert_worker_loop, name='alert-worker', daemon=True)
+            thread.start()
+            alert_worker_state['thread'] = thread
+
+def enqueue_vehicle_alerts_job(vehicle_ids):
+    """Grava o job de reavaliação dos veículos em um app context (e sessão) próprio"""
+    with app.app_context():
+        try:
+            enqueue_job('vehicle_alerts', {'vehicle_ids': sorted(vehicle_ids)}, priority=JOB_PRIORITY_ALERTS,
+                        defer=True)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[ALERT] ❌ Erro ao enfileirar a reavaliação incremental: {str(e)}")
+        finally:
+            db.session.remove()
+
+def enqueue_alert_evaluation(vehicle_ids):
+    """Agenda a reavaliação dos veículos conforme ALERT_INCREMENTAL_MODE
 
-    except Exception as e:
-        print(f"[ALERT] Erro na verificação de consumo anômalo: {str(e)}")
+    Também é chamada depois das inserções em lote (seeder, usuário demo), que não passam
+    pelos eventos do ORM.
+    """
+    mode = app.config.get('ALERT_INCREMENTAL_MODE', 'job')
+    if mode == 'off' or not vehicle_ids:
+        return
+    if mode == 'job':
+        enqueue_vehicle_alerts_job(vehicle_ids)
+        return
+    if mode == 'thread':
+        ensure_alert_worker()
+        for vehicle_id in vehicle_ids:
+            alert_vehicle_queue.put(vehicle_id)
+        return
+    evaluate_vehicle_alerts(vehicle_ids)
+
+# === FILA DE JOBS EM SEGUNDO PLANO ===
+
+# Espera antes de cada nova tentativa: base * 2^(tentativa - 1) segundos
+JOB_RETRY_BASE_SECONDS = 30
+# Job 'running' há mais tempo que isso pertence a um worker que caiu: volta para a fila
+JOB_LEASE_SECONDS = 30 * 60
+# Jobs concluídos (e seus arquivos) são apagados após este prazo
+JOB_RETENTION_DAYS = 7
+# Intervalo da manutenção da fila (jobs abandonados e antigos) no loop do worker
+JOB_MAINTENANCE_SECONDS = 300
+
+# Prioridades: emails que o usuário aguarda, relatórios pedidos na tela e, por último, varreduras
+JOB_PRIORITY_EMAIL = 20
+JOB_PRIORITY_REPORT = 10
+JOB_PRIORITY_ALERTS = 0
+
+job_handlers = {}
+
+def job_handler(job_type):
+    """Registra a função que executa os jobs do tipo informado"""
+    def decorator(func):
+        job_handlers[job_type] = func
+        return func
+    return decorator
+
+def enqueue_job(job_type, payload=None, priority=0, user_id=None, max_attempts=3, defer=False):
+    """Grava o job na fila; no modo 'inline' já executa a primeira tentativa no próprio request
+
+    Com defer=True o job nunca executa no request: fica para o worker ou para o gatilho do cron.
+    """
+    if job_type not in job_handlers:
+        raise ValueError(f'Tipo de job desconhecido: {job_type}')
 
-    return alerts_created
+    job = BackgroundJob(job_type=job_type, payload=payload or {}, priority=priority,
+                        user_id=user_id, max_attempts=max_attempts)
+    db.session.add(job)
+    db.session.commit()
+    print(f"[JOB] Job {job.id} ({job_type}) enfileirado com prioridade {priority}")
+
+    if not defer and app.config.get('JOB_EXECUTION_MODE', 'worker') == 'inline':
+        claimed = claim_job(job.id, 'inline')
+        if claimed is not None:
+            execute_job(claimed)
+    return job
+
+def claim_job(job_id, worker_id):
+    """Troca condicional queued -> running: só um worker consegue assumir o job"""
+    now = datetime.utcnow()
+    claimed = BackgroundJob.query.filter_by(id=job_id, status='queued').update({
+        'status': 'running',
+        'attempts': BackgroundJob.attempts + 1,
+        'locked_by': worker_id,
+        'locked_at': now,
+        'started_at': now
+    }, synchronize_session=False)
+    db.session.commit()
+    return db.session.get(BackgroundJob, job_id) if claimed else None
+
+def claim_next_job(worker_id):
+    """Assume o próximo job liberado, por prioridade e ordem de chegada"""
+    now = datetime.utcnow()
+    pending = BackgroundJob.query.filter(
+        BackgroundJob.status == 'queued',
+        BackgroundJob.run_after <= now
+    ).order_by(BackgroundJob.priority.desc(), BackgroundJob.id)
+
+    if db.engine.dialect.name == 'postgresql':
+        # Linhas travadas por outro worker são puladas em vez de esperadas
+        job = pending.with_for_update(skip_locked=True).first()
+        if job is None:
+            db.session.rollback()
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.locked_at = now
+        job.started_at = now
+        db.session.commit()
+        return job
 
-def check_vehicle_age_alerts(vehicle, today):
-    """Alertas baseados na idade do veículo"""
-    alerts_created = 0
+    # SQLite não tem SKIP LOCKED: tenta os candidatos com a troca condicional de status
+    candidates = [job_id for job_id, in pending.with_entities(BackgroundJob.id).limit(10)]
+    db.session.rollback()
+    for job_id in candidates:
+        job = claim_job(job_id, worker_id)
+        if job is not None:
+            return job
+    return None
 
+def execute_job(job):
+    """Executa o handler do job e registra o resultado ou agenda a nova tentativa"""
+    job_id = job.id
+    started = time.perf_counter()
     try:
-        if not vehicle.year:
-            return 0
-
-        vehicle_age = today.year - vehicle.year
+        handler = job_handlers.get(job.job_type)
+        if handler is None:
+            raise ValueError(f'Tipo de job desconhecido: {job.job_type}')
+        result = handler(job)
+    except Exception as e:
+        db.session.rollback()
+        fail_job(db.session.get(BackgroundJob, job_id), e)
+        return False
 
-        # Alertas por idade do veículo
-        if vehicle_age >= 10:  # Veículo com 10+ anos
-            # Verificar se já existe alerta recente
-            existing_alert = Alert.query.filter(
-                Alert.vehicle_id == vehicle.id,
-                Alert.alert_type == 'vehicle_age',
-                Alert.created_at >= today - timedelta(days=90)  # Alerta a cada 3 meses
-            ).first()
+    # O handler pode ter trocado a sessão (db.session.remove()); recarregar o job antes de gravar
+    job = db.session.get(BackgroundJob, job_id)
+    job.status = 'succeeded'
+    job.result = result
+    job.error = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    print(f"[JOB] ✅ Job {job_id} ({job.job_type}) concluído em {time.perf_counter() - started:.2f}s")
+    return True
+
+def fail_job(job, error):
+    """Registra a falha: volta para a fila com espera crescente ou falha de vez"""
+    job.error = f'{type(error).__name__}: {error}'
+    job.locked_by = None
+    job.locked_at = None
+    if job.attempts < job.max_attempts:
+        delay = JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+        job.status = 'queued'
+        job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+        print(f"[JOB] ⚠️ Job {job.id} ({job.job_type}) falhou ({job.error}), nova tentativa em {delay}s")
+    else:
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+        print(f"[JOB] ❌ Job {job.id} ({job.job_type}) falhou após {job.attempts} tentativas: {job.error}")
+    db.session.commit()
 
-            if not existing_alert:
-                severity = 'critical' if vehicle_age >= 15 else 'warning'
-
-                create_alert(
-                    user_id=vehicle.user_id if not vehicle.fleet_id else None,
-                    fleet_id=vehicle.fleet_id,
-                    vehicle_id=vehicle.id,
-                    alert_type='vehicle_age',
-                    severity=severity,
-                    title=f'🕐 Veículo Antigo - {vehicle.brand} {vehicle.model}',
-                    message=f'Veículo de {vehicle.year} ({vehicle_age} anos) requer manutenção preventiva mais frequente.',
-                    metadata=json.dumps({
-                        'vehicle_age': vehicle_age,
-                        'vehicle_year': vehicle.year,
-                        'recommendation': 'Manutenção preventiva a cada 3-4 meses'
-                    })
-                )
-                alerts_created += 1
+def maintain_job_queue(now=None):
+    """Devolve à fila os jobs de workers que caíram e apaga os concluídos antigos"""
+    now = now or datetime.utcnow()
+    stale = BackgroundJob.query.filter(
+        BackgroundJob.status == 'running',
+        BackgroundJob.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS)
+    )
+    requeued = stale.filter(BackgroundJob.attempts < BackgroundJob.max_attempts).update({
+        'status': 'queued', 'locked_by': None, 'locked_at': None, 'run_after': now,
+        'error': 'Worker interrompido durante a execução'
+    }, synchronize_session=False)
+    abandoned = stale.update({
+        'status': 'failed', 'finished_at': now, 'error': 'Worker interrompido durante a execução'
+    }, synchronize_session=False)
+    purged = BackgroundJob.query.filter(
+        BackgroundJob.status.in_(['succeeded', 'failed']),
+        BackgroundJob.finished_at < now - timedelta(days=JOB_RETENTION_DAYS)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if requeued or abandoned or purged:
+        print(f"[JOB] Manutenção da fila: {requeued} devolvidos, {abandoned} abandonados, {purged} apagados")
+    return {'requeued': requeued, 'abandoned': abandoned, 'purged': purged}
+
+def run_worker(poll_interval=2.0, once=False, max_jobs=None, worker_id=None, schedule=True):
+    """Loop do worker: executa os jobs da fila e as tarefas periódicas vencidas; com once=True sai quando a fila esvazia"""
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    processed = 0
+    last_maintenance = None
+    last_schedule = None
+    print(f"[JOB] Worker {worker_id} iniciado")
+
+    while max_jobs is None or processed < max_jobs:
+        if last_maintenance is None or time.monotonic() - last_maintenance >= JOB_MAINTENANCE_SECONDS:
+            maintain_job_queue()
+            last_maintenance = time.monotonic()
+        if schedule and (last_schedule is None or time.monotonic() - last_schedule >= SCHEDULER_TICK_SECONDS):
+            run_due_periodic_jobs()
+            last_schedule = time.monotonic()
+
+        job = claim_next_job(worker_id)
+        if job is None:
+            if once:
+                break
+            db.session.remove()
+            time.sleep(poll_interval)
+            continue
+
+        execute_job(job)
+        processed += 1
+        db.session.remove()
+
+    print(f"[JOB] Worker {worker_id} encerrado após {processed} jobs")
+    return processed
+
+@job_handler('run_alerts')
+def run_alerts_job(job):
+    """Verificação de alertas pedida pela API, sob a mesma trava da execução diária"""
+    full = job.payload.get('full', False)
+    run = run_exclusive('daily_alerts', lambda: alert_run_summary(full=full),
+                        trigger='manual', lease_seconds=periodic_jobs['daily_alerts']['lease_seconds'])
+    if run is None:
+        return {'skipped': 'verificação já em execução em outro processo'}
+    if run.status == 'failed':
+        raise RuntimeError(run.error)
+    return run.result
+
+@job_handler('vehicle_alerts')
+def vehicle_alerts_job(job):
+    """Reavaliação incremental dos veículos gravados (modo 'job' de ALERT_INCREMENTAL_MODE)"""
+    vehicle_ids = job.payload.get('vehicle_ids', [])
+    created = run_alert_rules(INCREMENTAL_ALERT_RULES, vehicle_ids=sorted(vehicle_ids))
+    return {'vehicles': len(vehicle_ids), 'alerts_created': created}
+
+@job_handler('welcome_email')
+def welcome_email_job(job):
+    """Email de boas-vindas do cadastro"""
+    user = db.session.get(User, job.payload['user_id'])
+    if user is None:
+        return {'skipped': 'usuário removido'}
+    if not send_welcome_email(user):
+        raise RuntimeError(f'Falha no envio para {user.email}')
+    return {'to': user.email}
+
+@job_handler('fleet_invite_email')
+def fleet_invite_email_job(job):
+    """Email de convite para a frota; na última tentativa sem sucesso o convite fica como 'failed'"""
+    invite = db.session.get(FleetInvite, job.payload['invite_id'])
+    if invite is None:
+        return {'skipped': 'convite removido'}
+    if not send_email(to=invite.email, subject=job.payload['subject'], template='emails/fleet_invite.html',
+                      **job.payload['context']):
+        if job.attempts >= job.max_attempts:
+            invite.status = 'failed'
+            db.session.commit()
+        raise RuntimeError(f'Falha no envio para {invite.email}')
+    return {'to': invite.email}
+
+@job_handler('fleet_report')
+def fleet_report_job(job):
+    """Relatório da frota em PDF ou Excel, guardado no próprio job para download"""
+    from report_generator import generate_fleet_reports
+
+    fleet = db.session.get(Fleet, job.payload['fleet_id'])
+    if fleet is None:
+        raise ValueError('Frota não encontrada')
+
+    report_type = job.payload.get('report_type', 'pdf')
+    period_days = int(job.payload.get('period', 30))
+    pdf_data, excel_data, _ = generate_fleet_reports(fleet, period_days)
+
+    filename = f"relatorio_frota_{fleet.company_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M')}"
+    if report_type == 'excel':
+        job.result_file = excel_data
+        return {'filename': f'{filename}.xlsx', 'report_type': 'excel', 'period_days': period_days,
+                'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}
+    job.result_file = pdf_data
+    return {'filename': f'{filename}.pdf', 'report_type': 'pdf', 'period_days': period_days,
+            'mimetype': 'application/pdf'}
+
+# === TAREFAS PERIÓDICAS ===
+
+# Intervalo entre verificações de tarefas vencidas no loop do worker
+SCHEDULER_TICK_SECONDS = 60
+# Jobs da fila executados por chamada do gatilho do cron (limite de tempo da função serverless)
+CRON_MAX_JOBS = 50
+# Espera antes de repetir uma tarefa periódica que falhou
+SCHEDULER_RETRY_SECONDS = 15 * 60
+# Histórico de execuções mantido em job_runs
+JOB_RUN_RETENTION_DAYS = 30
+
+periodic_jobs = {}
+
+def periodic_job(name, interval, lease_seconds=3600):
+    """Registra uma tarefa periódica; lease_seconds deve cobrir a duração máxima de uma execução"""
+    def decorator(func):
+        periodic_jobs[name] = {'func': func, 'interval': interval, 'lease_seconds': lease_seconds}
+        return func
+    return decorator
+
+def acquire_lease(name, holder, seconds):
+    """Assume a trava se estiver livre ou expirada; o UPDATE condicional garante um único vencedor"""
+    now = datetime.utcnow()
+    if db.session.get(SchedulerLease, name) is None:
+        try:
+            db.session.add(SchedulerLease(name=name, expires_at=now))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # Outro processo criou a linha ao mesmo tempo
+
+    acquired = SchedulerLease.query.filter(
+        SchedulerLease.name == name,
+        SchedulerLease.expires_at <= now
+    ).update({
+        'holder': holder,
+        'acquired_at': now,
+        'expires_at': now + timedelta(seconds=seconds)
+    }, synchronize_session=False)
+    db.session.commit()
+    return acquired == 1
 
-    except Exception as e:
-        print(f"[ALERT] Erro na verificação de idade do veículo: {str(e)}")
+def release_lease(name, holder):
+    """Libera a trava (só se ainda pertencer a este processo)"""
+    SchedulerLease.query.filter_by(name=name, holder=holder).update(
+        {'expires_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
 
-    return alerts_created
+def periodic_job_due(name, now=None):
+    """Tarefa vencida: nunca executou, passou o intervalo ou falhou há mais de SCHEDULER_RETRY_SECONDS"""
+    now = now or datetime.utcnow()
+    last = JobRun.query.filter_by(job_name=name).order_by(JobRun.started_at.desc()).first()
+    if last is None:
+        return True
+    if last.status == 'failed':
+        return last.started_at <= now - timedelta(seconds=SCHEDULER_RETRY_SECONDS)
+    return last.started_at <= now - periodic_jobs[name]['interval']
+
+def run_exclusive(name, func, trigger='scheduler', lease_seconds=3600, only_if_due=False):
+    """Executa func com a trava da tarefa e registra a execução em job_runs; None se outro processo detém a trava"""
+    holder = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}'
+    lease_name = f'periodic:{name}'
+    if not acquire_lease(lease_name, holder, lease_seconds):
+        print(f"[SCHEDULER] {name} já em execução em outro processo, ignorando")
+        return None
 
-def send_fuel_anomaly_email(vehicle, deviation, recent_avg, historical_avg):
-    """Enviar email de alerta de anomalia de combustível usando sistema PF"""
     try:
-        # Determinar destinatário
-        if vehicle.fleet_id:
-            # Para frotas, enviar para administradores
-            admins = FleetMember.query.filter(
-                FleetMember.fleet_id == vehicle.fleet_id,
-                FleetMember.role.in_(['owner', 'admin']),
-                FleetMember.is_active == True
-            ).all()
-            
-            for admin in admins:
-                if admin.user.email:
-                    send_email(
-                        to=admin.user.email,
-                        subject=f"🚨 Alerta Crítico - Consumo Elevado: {vehicle.name}",
-                        template="emails/fuel_alert.html",
-                        vehicle_name=vehicle.name,
-                        deviation=deviation,
-                        recent_avg=recent_avg,
-                        historical_avg=historical_avg,
-                        user_name=admin.user.name or admin.user.username,
-                        is_fleet=True,
-                        fleet_name=vehicle.fleet.name if vehicle.fleet else '',
-                        current_year=datetime.utcnow().year
-                    )
-        else:
-            # Para usuários individuais
-            if vehicle.user and vehicle.user.email:
-                send_email(
-                    to=vehicle.user.email,
-                    subject=f"🚨 Alerta - Consumo Elevado: {vehicle.name}",
-                    template="emails/fuel_alert.html",
-                    vehicle_name=vehicle.name,
-                    deviation=deviation,
-                    recent_avg=recent_avg,
-                    historical_avg=historical_avg,
-                    user_name=vehicle.user.name or vehicle.user.username,
-                    is_fleet=False,
-                    current_year=datetime.utcnow().year
-                )
-        
-    except Exception as e:
-        print(f"[ALERT] ❌ Erro ao enviar email de anomalia: {str(e)}")
+        # Outro processo pode ter concluído a tarefa entre a verificação e a trava
+        if only_if_due and not periodic_job_due(name):
+            return None
 
-def send_maintenance_alert_email(vehicle, days_overdue, last_maintenance):
-    """Enviar email de alerta de manutenção vencida usando sistema PF"""
-    try:
-        # Determinar destinatário
-        if vehicle.fleet_id:
-            # Para frotas, enviar para administradores
-            admins = FleetMember.query.filter(
-                FleetMember.fleet_id == vehicle.fleet_id,
-                FleetMember.role.in_(['owner', 'admin']),
-                FleetMember.is_active == True
-            ).all()
-            
-            for admin in admins:
-                if admin.user.email:
-                    send_email(
-                        to=admin.user.email,
-                        subject=f"🔧 Manutenção Vencida: {vehicle.name}",
-                        template="emails/maintenance_alert.html",
-                        vehicle_name=vehicle.name,
-                        days_overdue=abs(days_overdue),
-                        last_maintenance_type=last_maintenance.service_type,
-                        last_maintenance_date=last_maintenance.date.strftime('%d/%m/%Y'),
-                        user_name=admin.user.name or admin.user.username,
-                        is_fleet=True,
-                        fleet_name=vehicle.fleet.name if vehicle.fleet else '',
-                        current_year=datetime.utcnow().year
-                    )
-        else:
-            # Para usuários individuais
-            if vehicle.user and vehicle.user.email:
-                send_email(
-                    to=vehicle.user.email,
-                    subject=f"🔧 Manutenção Vencida: {vehicle.name}",
-                    template="emails/maintenance_alert.html",
-                    vehicle_name=vehicle.name,
-                    days_overdue=abs(days_overdue),
-                    last_maintenance_type=last_maintenance.service_type,
-                    last_maintenance_date=last_maintenance.date.strftime('%d/%m/%Y'),
-                    user_name=vehicle.user.name or vehicle.user.username,
-                    is_fleet=False,
-                    current_year=datetime.utcnow().year
-                )
-        
-    except Exception as e:
-        print(f"[ALERT] ❌ Erro ao enviar email de manutenção: {str(e)}")
+        now = datetime.utcnow()
+        # Com a trava em mãos, execuções 'running' restantes são de processos que caíram
+        JobRun.query.filter_by(job_name=name, status='running').update({
+            'status': 'failed', 'finished_at': now, 'error': 'Processo interrompido durante a execução'
+        }, synchronize_session=False)
+        run = JobRun(job_name=name, trigger=trigger, worker=holder, started_at=now)
+        db.session.add(run)
+        db.session.commit()
+        run_id = run.id
 
-def run_daily_alert_checks():
-    """Executar verificações diárias de alertas"""
-    print("[ALERT] 🤖 Iniciando verificações diárias de alertas...")
-    
-    fuel_alerts = check_fuel_anomalies()
-    maintenance_alerts = check_maintenance_alerts()
-    
-    total_alerts = fuel_alerts + maintenance_alerts
-    print(f"[ALERT] ✅ Verificações concluídas. Total: {total_alerts} alertas criados")
-    
-    return total_alerts
+        print(f"[SCHEDULER] Iniciando {name} ({trigger})")
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            db.session.rollback()
+            run = db.session.get(JobRun, run_id)
+            run.status = 'failed'
+            run.error = f'{type(e).__name__}: {e}'
+            print(f"[SCHEDULER] ❌ {name} falhou: {run.error}")
+        else:
+            run = db.session.get(JobRun, run_id)
+            run.status = 'succeeded'
+            run.result = result
+        run.finished_at = datetime.utcnow()
+        run.duration_seconds = round(time.perf_counter() - started, 3)
+        db.session.commit()
+        print(f"[SCHEDULER] {name} {run.status} em {run.duration_seconds:.2f}s")
+        return run
+    finally:
+        release_lease(lease_name, holder)
+
+def run_due_periodic_jobs(trigger='scheduler', names=None):
+    """Executa as tarefas periódicas vencidas; seguro com vários workers e instâncias ao mesmo tempo"""
+    runs = []
+    for name in names or list(periodic_jobs):
+        if not periodic_job_due(name):
+            continue
+        job = periodic_jobs[name]
+        run = run_exclusive(name, job['func'], trigger=trigger, lease_seconds=job['lease_seconds'],
+                            only_if_due=True)
+        if run is not None:
+            runs.append(run)
+    return runs
+
+def alert_run_summary(full=False):
+    """Executa a verificação de alertas e devolve o resumo estruturado (gravado em job_runs)"""
+    stats = new_alert_run_stats()
+    alerts_created = run_daily_alert_checks(full=full, stats=stats, raise_errors=True)
+    return {'alerts_created': alerts_created, 'stats': stats}
+
+@periodic_job('daily_alerts', interval=timedelta(days=1), lease_seconds=2 * 3600)
+def daily_alerts_periodic():
+    """Verificação diária de alertas"""
+    return alert_run_summary()
+
+@periodic_job('cleanup', interval=timedelta(hours=1))
+def cleanup_periodic():
+    """Limpeza de jobs, histórico de execuções e cache do dashboard; conferência dos contadores de alertas e das frotas"""
+    queue_report = maintain_job_queue()
+    runs_deleted = JobRun.query.filter(
+        JobRun.started_at < datetime.utcnow() - timedelta(days=JOB_RUN_RETENTION_DAYS)
+    ).delete(synchronize_session=False)
+    cache_deleted = DashboardCache.query.filter(
+        DashboardCache.computed_on < datetime.now().date()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    counters_fixed = reconcile_unread_alert_counters()
+    fleet_counters_fixed = reconcile_fleet_counters()
+    return dict(queue_report, job_runs_deleted=runs_deleted, dashboard_cache_deleted=cache_deleted,
+                alert_counters_fixed=counters_fixed, fleet_counters_fixed=fleet_counters_fixed)
 
 # === DECORATORS DE PERMISSÃO ===
 
@@ -1836,11 +3330,9 @@ def register():
         db.session.add(user)
         db.session.commit()
         
-        # Enviar email de boas-vindas
-        if send_welcome_email(user):
-            flash('Usuario criado com sucesso! Verifique seu email.', 'success')
-        else:
-            flash('Usuario criado com sucesso!', 'success')
+        # Email de boas-vindas enviado pelo worker, sem bloquear o cadastro
+        enqueue_job('welcome_email', {'user_id': user.id}, priority=JOB_PRIORITY_EMAIL, user_id=user.id)
+        flash('Usuario criado com sucesso! Verifique seu email.', 'success')
         
         return redirect(url_for('login'))
     
@@ -1932,28 +3424,352 @@ def reset_password(token):
     
     return render_template('reset_password.html', token=token)
 
-@app.route('/app')
-@app.route('/dashboard')
-@login_required
-def dashboard():
-    """Dashboard principal"""
-    print(f"[DASHBOARD] Usuário autenticado: {current_user.is_authenticated}")
-    print(f"[DASHBOARD] ID do usuário: {current_user.get_id() if current_user.is_authenticated else 'None'}")
+# === ROLLUP DIÁRIO DAS FROTAS ===
 
-    # Verificar se usuário pertence a uma frota
-    fleet_membership = FleetMember.query.filter_by(
-        user_id=current_user.id,
-        is_active=True
-    ).first()
+# Períodos do dashboard da frota (dias)
+FLEET_DASHBOARD_PERIODS = (30, 90, 365)
 
-    # Processar filtros da URL
-    selected_vehicle = request.args.get('vehicle_id', type=int)
-    selected_days = request.args.get('days', type=int)
+def refresh_fleet_rollups(connection, keys=(), vehicle_ids=()):
+    """Recalcula as linhas do rollup diário afetadas por uma gravação
 
-    vehicles = Vehicle.query.filter_by(user_id=current_user.id, is_active=True).all()
-    
+    `keys` são pares (vehicle_id, dia) alterados; `vehicle_ids` recalcula todo
+    o histórico dos veículos (troca de frota, exclusão, backfill). Apaga as
+    linhas e as reinsere com um INSERT ... SELECT agrupado dos abastecimentos,
+    lendo apenas os dias afetados pelo índice (vehicle_id, date).
+    """
+    days_by_vehicle = {}
+    for vehicle_id, day in keys:
+        if vehicle_id is not None and day is not None and vehicle_id not in vehicle_ids:
+            days_by_vehicle.setdefault(vehicle_id, set()).add(day)
+    if not days_by_vehicle and not vehicle_ids:
+        return 0
+
+    rollups = FleetDailyRollup.__table__
+    records = FuelRecord.__table__
+    rollup_conditions, record_conditions = [], []
+    if vehicle_ids:
+        rollup_conditions.append(rollups.c.vehicle_id.in_(vehicle_ids))
+        record_conditions.append(records.c.vehicle_id.in_(vehicle_ids))
+    for vehicle_id, days in days_by_vehicle.items():
+        rollup_conditions.append(db.and_(rollups.c.vehicle_id == vehicle_id, rollups.c.day.in_(days)))
+        record_conditions.append(db.and_(records.c.vehicle_id == vehicle_id, records.c.date.in_(days)))
+
+    connection.execute(rollups.delete().where(db.or_(*rollup_conditions)))
+    vehicles = Vehicle.__table__
+    grouped = db.select(
+        vehicles.c.fleet_id,
+        records.c.vehicle_id,
+        records.c.fuel_type,
+        records.c.date,
+        db.func.coalesce(db.func.sum(records.c.total_cost), 0),
+        db.func.coalesce(db.func.sum(records.c.liters), 0),
+        db.func.coalesce(db.func.sum(records.c.kilometers), 0),
+        db.func.count(records.c.id)
+    ).select_from(
+        records.join(vehicles, vehicles.c.id == records.c.vehicle_id)
+    ).where(
+        vehicles.c.fleet_id.isnot(None),
+        db.or_(*record_conditions)
+    ).group_by(vehicles.c.fleet_id, records.c.vehicle_id, records.c.fuel_type, records.c.date)
+
+    result = connection.execute(rollups.insert().from_select(
+        ['fleet_id', 'vehicle_id', 'fuel_type', 'day', 'total_cost', 'liters', 'kilometers', 'fill_ups'],
+        grouped
+    ))
+    return result.rowcount
+
+def rebuild_fleet_rollups(vehicle_ids=None):
+    """Reconstrói o rollup diário de todos os veículos de frota (ou dos informados)"""
+    if vehicle_ids is None:
+        db.session.execute(FleetDailyRollup.__table__.delete())
+        vehicle_ids = [row[0] for row in db.session.query(Vehicle.id).filter(Vehicle.fleet_id.isnot(None))]
+    if vehicle_ids:
+        refresh_fleet_rollups(db.session.connection(), vehicle_ids=set(vehicle_ids))
+    db.session.commit()
+    return len(vehicle_ids)
+
+@event.listens_for(Session, 'after_flush')
+def refresh_fleet_rollups_after_flush(session, flush_context):
+    """Mantém o rollup diário na mesma transação da escrita dos abastecimentos"""
+    keys, vehicle_ids = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        model_name = type(obj).__name__
+        if model_name == 'FuelRecord':
+            keys.add((obj.vehicle_id, obj.date))
+            if obj in session.dirty:
+                # Data ou veículo alterados: o dia anterior também muda
+                state = db.inspect(obj)
+                old_vehicles = state.attrs.vehicle_id.history.deleted or [obj.vehicle_id]
+                old_days = state.attrs.date.history.deleted or [obj.date]
+                keys.update((vehicle_id, day) for vehicle_id in old_vehicles for day in old_days)
+        elif model_name == 'Vehicle' and obj not in session.new:
+            if obj in session.deleted or db.inspect(obj).attrs.fleet_id.history.deleted:
+                vehicle_ids.add(obj.id)
+
+    if keys or vehicle_ids:
+        refresh_fleet_rollups(session.connection(), keys, vehicle_ids)
+
+def fleet_rollup_totals(fleet_id, start_date, end_date=None, by_vehicle=False):
+    """Gasto, litros, km e abastecimentos da frota no intervalo, lidos do rollup diário
+
+    Lê no máximo uma linha por veículo, dia e combustível. Com by_vehicle=True
+    retorna {vehicle_id: totais}; senão, os totais da frota.
+    """
+    columns = [
+        db.func.sum(FleetDailyRollup.total_cost),
+        db.func.sum(FleetDailyRollup.liters),
+        db.func.sum(FleetDailyRollup.kilometers),
+        db.func.sum(FleetDailyRollup.fill_ups)
+    ]
+    query = db.session.query(FleetDailyRollup.vehicle_id, *columns) if by_vehicle else db.session.query(*columns)
+    query = query.filter(FleetDailyRollup.fleet_id == fleet_id, FleetDailyRollup.day >= start_date)
+    if end_date is not None:
+        query = query.filter(FleetDailyRollup.day <= end_date)
+
+    def totals(row):
+        return {
+            'total_spent': row[0] or 0,
+            'total_liters': row[1] or 0,
+            'total_km': row[2] or 0,
+            'total_records': row[3] or 0
+        }
+
+    if by_vehicle:
+        return {row[0]: totals(row[1:]) for row in query.group_by(FleetDailyRollup.vehicle_id)}
+    return totals(query.one())
+
+def fleet_period_comparison(fleet_id, period_days):
+    """Totais dos últimos period_days e do mesmo intervalo um ano antes, em um único SELECT"""
+    today = datetime.now().date()
+    start = today - timedelta(days=period_days)
+    previous_start, previous_end = start - timedelta(days=365), today - timedelta(days=365)
+    current = FleetDailyRollup.day >= start
+    previous = FleetDailyRollup.day.between(previous_start, previous_end)
+
+    row = db.session.query(*[
+        db.func.sum(column).filter(window)
+        for window in (current, previous)
+        for column in (FleetDailyRollup.total_cost, FleetDailyRollup.liters,
+                       FleetDailyRollup.kilometers, FleetDailyRollup.fill_ups)
+    ]).filter(FleetDailyRollup.fleet_id == fleet_id, db.or_(current, previous)).one()
+
+    keys = ('total_spent', 'total_liters', 'total_km', 'total_records')
+    totals = {key: row[index] or 0 for index, key in enumerate(keys)}
+    previous_year = {key: row[index + 4] or 0 for index, key in enumerate(keys)}
+    changes = {
+        key: round((totals[key] - previous_year[key]) / previous_year[key] * 100, 1) if previous_year[key] else None
+        for key in keys
+    }
+    return totals, dict(previous_year, change_pct=changes)
+
+# === CONTADORES DA FROTA ===
+
+# Coluna de fleets mantida para cada modelo contado
+FLEET_COUNTERS = {
+    'Vehicle': 'active_vehicles_count',
+    'FleetMember': 'active_members_count'
+}
+
+def fleet_counter_key(obj, before=False):
+    """(fleet_id, ativo) do veículo/membro depois (ou antes) da gravação; None se o valor anterior não foi carregado"""
+    state = db.inspect(obj)
+    values = []
+    for name in ('fleet_id', 'is_active'):
+        history = state.attrs[name].history
+        if not before:
+            value = state.dict.get(name, True if name == 'is_active' else None)
+        elif history.deleted or history.unchanged:
+            value = (history.deleted or history.unchanged)[0]
+        else:
+            return None
+        values.append(value)
+    return values[0], bool(values[1])
+
+def adjust_fleet_counters(connection, deltas):
+    """Soma as variações {(coluna, fleet_id): delta} nos contadores, com um UPDATE em lote por coluna"""
+    table = Fleet.__table__
+    by_column = {}
+    for (column, fleet_id), delta in deltas.items():
+        if fleet_id and delta:
+            by_column.setdefault(column, []).append({'fleet_id': fleet_id, 'delta': delta})
+
+    for column, params in by_column.items():
+        connection.execute(
+            table.update().where(table.c.id == db.bindparam('fleet_id')).values({
+                column: table.c[column] + db.bindparam('delta'),
+                'updated_at': table.c.updated_at  # Contador não é edição do cadastro
+            }),
+            params
+        )
+
+def actual_fleet_counts(column, fleet_ids=None):
+    """Contagem real de veículos/membros ativos por frota"""
+    model = Vehicle if column == 'active_vehicles_count' else FleetMember
+    query = db.session.query(model.fleet_id, db.func.count()).filter(
+        model.fleet_id.isnot(None), model.is_active == True
+    )
+    if fleet_ids is not None:
+        query = query.filter(model.fleet_id.in_(fleet_ids))
+    return dict(query.group_by(model.fleet_id).all())
+
+@event.listens_for(Session, 'after_flush')
+def update_fleet_counters_after_flush(session, flush_context):
+    """Mantém os contadores da frota na mesma transação da gravação de veículos e membros"""
+    deltas, recount = {}, set()
+
+    def add(column, key, delta):
+        if key is not None and key[0] and key[1]:
+            deltas[(column, key[0])] = deltas.get((column, key[0]), 0) + delta
+
+    for obj in session.new:
+        if type(obj).__name__ in FLEET_COUNTERS:
+            add(FLEET_COUNTERS[type(obj).__name__], fleet_counter_key(obj), 1)
+    for obj in session.deleted:
+        if type(obj).__name__ in FLEET_COUNTERS:
+            add(FLEET_COUNTERS[type(obj).__name__], fleet_counter_key(obj, before=True), -1)
+    for obj in session.dirty:
+        if type(obj).__name__ not in FLEET_COUNTERS:
+            continue
+        state = db.inspect(obj)
+        if not any(state.attrs[name].history.has_changes() for name in ('fleet_id', 'is_active')):
+            continue
+        column = FLEET_COUNTERS[type(obj).__name__]
+        before, after = fleet_counter_key(obj, before=True), fleet_counter_key(obj)
+        if before is None:
+            # Valor anterior não carregado: recontar a frota atual; a anterior fica para a conferência
+            recount.add((column, after[0]))
+        elif before != after:
+            add(column, before, -1)
+            add(column, after, 1)
+
+    connection = session.connection()
+    adjust_fleet_counters(connection, deltas)
+    table = Fleet.__table__
+    for column, fleet_id in recount:
+        if fleet_id:
+            count = actual_fleet_counts(column, [fleet_id]).get(fleet_id, 0)
+            connection.execute(table.update().where(table.c.id == fleet_id).values({
+                column: count, 'updated_at': table.c.updated_at
+            }))
+
+def reconcile_fleet_counters():
+    """Recalcula os contadores de veículos e membros ativos e corrige os que divergirem"""
+    fixed = 0
+    for column in ('active_vehicles_count', 'active_members_count'):
+        actual = actual_fleet_counts(column)
+        stored = db.session.query(Fleet.id, getattr(Fleet, column)).all()
+        deltas = {
+            (column, fleet_id): actual.get(fleet_id, 0) - (value or 0)
+            for fleet_id, value in stored
+            if actual.get(fleet_id, 0) != (value or 0)
+        }
+        adjust_fleet_counters(db.session.connection(), deltas)
+        fixed += len(deltas)
+    db.session.commit()
+    if fixed:
+        print(f"[FLEET] {fixed} contadores de frota corrigidos")
+    return fixed
+
+# === CACHE DO DASHBOARD ===
+
+# Contadores do processo atual (cada worker do gunicorn mantém os seus)
+dashboard_cache_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+
+# Modelos cujas escritas alteram os números do dashboard
+DASHBOARD_SOURCE_MODELS = ('FuelRecord', 'Vehicle', 'MaintenanceRecord', 'OilChange')
+
+def bump_user_data_versions(connection, user_ids=(), vehicle_ids=()):
+    """Incrementa users.data_version dos donos dos veículos/usuários informados"""
+    user_ids = set(user_ids)
+    vehicle_ids = set(vehicle_ids)
+    if vehicle_ids:
+        user_ids.update(connection.execute(
+            db.select(Vehicle.user_id).where(Vehicle.id.in_(vehicle_ids)).distinct()
+        ).scalars())
+    user_ids.discard(None)
+    if not user_ids:
+        return 0
+
+    connection.execute(
+        db.update(User.__table__)
+        .where(User.__table__.c.id.in_(user_ids))
+        .values(data_version=db.func.coalesce(User.__table__.c.data_version, 0) + 1)
+    )
+    return len(user_ids)
+
+@event.listens_for(Session, 'after_flush')
+def bump_data_version_after_flush(session, flush_context):
+    """Invalida o cache do dashboard na mesma transação da escrita"""
+    user_ids, vehicle_ids = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        model_name = type(obj).__name__
+        if model_name not in DASHBOARD_SOURCE_MODELS:
+            continue
+        if model_name == 'Vehicle':
+            user_ids.add(obj.user_id)
+        else:
+            vehicle_ids.add(obj.vehicle_id)
+
+    if user_ids or vehicle_ids:
+        bump_user_data_versions(session.connection(), user_ids, vehicle_ids)
+
+def dashboard_cache_key(selected_vehicle, selected_days):
+    """Chave do cache a partir dos filtros da URL"""
+    return f"vehicle={selected_vehicle or 'all'}&days={selected_days or 'all'}"
+
+def get_cached_dashboard_context(user_id, vehicles, selected_vehicle=None, selected_days=None):
+    """Retorna o contexto do dashboard do cache ou recalcula e armazena"""
+    if not app.config.get('DASHBOARD_CACHE_ENABLED', True):
+        return build_dashboard_context(user_id, vehicles, selected_vehicle, selected_days)
+
+    cache_key = dashboard_cache_key(selected_vehicle, selected_days)
+    today = datetime.now().date()
+
+    # Versão atual do usuário e entrada do cache em uma única consulta
+    current_version, entry = db.session.query(User.data_version, DashboardCache).outerjoin(
+        DashboardCache, db.and_(
+            DashboardCache.user_id == User.id,
+            DashboardCache.cache_key == cache_key
+        )
+    ).filter(User.id == user_id).one()
+    current_version = current_version or 0
+
+    if entry is not None and entry.data_version == current_version and entry.computed_on == today:
+        dashboard_cache_stats['hits'] += 1
+        return json.loads(entry.payload)
+
+    dashboard_cache_stats['misses'] += 1
+    context = build_dashboard_context(user_id, vehicles, selected_vehicle, selected_days)
+
+    # Gravação em conexão própria: não expira os objetos da sessão já usados pelo template
+    values = {
+        'data_version': current_version,
+        'computed_on': today,
+        'payload': json.dumps(context),
+        'created_at': datetime.utcnow()
+    }
+    try:
+        with db.engine.begin() as conn:
+            if entry is None:
+                conn.execute(db.insert(DashboardCache.__table__).values(
+                    user_id=user_id, cache_key=cache_key, **values
+                ))
+            else:
+                conn.execute(db.update(DashboardCache.__table__).where(
+                    DashboardCache.__table__.c.id == entry.id
+                ).values(**values))
+        dashboard_cache_stats['stores'] += 1
+    except Exception as e:
+        # Outro worker gravou a mesma chave ao mesmo tempo: basta seguir sem cache
+        dashboard_cache_stats['errors'] += 1
+        print(f"[CACHE] Não foi possível gravar o cache do dashboard: {e}")
+
+    return context
+
+def build_dashboard_context(user_id, vehicles, selected_vehicle=None, selected_days=None):
+    """Calcula os dados do dashboard (KPIs, consumo e gráficos) em formato serializável"""
     # Construir query base considerando filtros
-    base_query = FuelRecord.query.join(Vehicle).filter(Vehicle.user_id == current_user.id)
+    base_query = FuelRecord.query.join(Vehicle).filter(Vehicle.user_id == user_id)
     
     if selected_vehicle:
         base_query = base_query.filter(FuelRecord.vehicle_id == selected_vehicle)
@@ -1962,32 +3778,14 @@ def dashboard():
         cutoff_date = datetime.now() - timedelta(days=selected_days)
         base_query = base_query.filter(FuelRecord.date >= cutoff_date.date())
     
-    # Estatisticas gerais
-    total_vehicles = len(vehicles)
-    total_records = base_query.count()
-    
-    # Ultimos abastecimentos (considerando filtros)
-    recent_records = base_query.order_by(FuelRecord.date.desc()).limit(5).all()
-    
-    # Gastos (considerando filtros)
+    # Estatisticas gerais (um único SELECT com agregados condicionais)
     if selected_days:
         # Se há filtro de período, usar esse período
-        cutoff_date = datetime.now() - timedelta(days=selected_days)
-        monthly_expense = base_query.filter(FuelRecord.date >= cutoff_date.date()).with_entities(db.func.sum(FuelRecord.total_cost)).scalar() or 0
+        period_start = (datetime.now() - timedelta(days=selected_days)).date()
     else:
         # Senão, usar gasto do mês atual
-        current_month = datetime.now().replace(day=1)
-        monthly_query = base_query.filter(FuelRecord.date >= current_month)
-        monthly_expense = monthly_query.with_entities(db.func.sum(FuelRecord.total_cost)).scalar() or 0
-    
-    # Total gasto (considerando filtros)
-    total_spent = base_query.with_entities(db.func.sum(FuelRecord.total_cost)).scalar() or 0
-    
-    # Total de litros (considerando filtros)
-    total_liters = base_query.with_entities(db.func.sum(FuelRecord.liters)).scalar() or 0
-    
-    # Preço médio por litro (considerando filtros)
-    avg_price = base_query.with_entities(db.func.avg(FuelRecord.price_per_liter)).scalar() or 0
+        period_start = datetime.now().replace(day=1).date()
+    kpis = dashboard_kpis(base_query, period_start)
     
     # Posto favorito (considerando filtros)
     favorite_station_query = base_query.filter(
@@ -2000,83 +3798,60 @@ def dashboard():
     
     favorite_station = favorite_station_query[0] if favorite_station_query else "Nenhum"
     
-    # Métricas de consumo CORRIGIDAS
-    all_records = base_query.order_by(FuelRecord.vehicle_id, FuelRecord.date).all()
-    
-    total_km = 0
-    consumptions = []
-    km_last_30_days = 0
+    # Métricas de consumo (kernel compartilhado)
     thirty_days_ago = datetime.now() - timedelta(days=30)
-    
-    # Agrupar por veículo para calcular corretamente
-    vehicle_records = {}
-    for record in all_records:
-        if record.vehicle_id not in vehicle_records:
-            vehicle_records[record.vehicle_id] = []
-        vehicle_records[record.vehicle_id].append(record)
-    
-    # Calcular KM para cada veículo separadamente
-    for vehicle_id, records in vehicle_records.items():
-        if len(records) > 1:
-            # Ordenar por data para garantir sequência correta
-            records.sort(key=lambda x: x.date)
-            
-            for i in range(1, len(records)):
-                # Só calcular se tem odômetro válido
-                if records[i].odometer and records[i-1].odometer:
-                    distance = records[i].odometer - records[i-1].odometer
-                    
-                    # Validar distância (evitar valores absurdos)
-                    if 0 < distance <= 2000:  # Entre 0 e 2000 km por abastecimento
-                        total_km += distance
-                        
-                        # Calcular consumo se tiver litros
-                        if records[i].liters and records[i].liters > 0:
-                            consumption = distance / records[i].liters
-                            # Validar consumo (entre 3 e 25 km/l para ser realista)
-                            if 3 <= consumption <= 25:
-                                consumptions.append(consumption)
-                        
-                        # Verificar se é dos últimos 30 dias
-                        if records[i].date >= thirty_days_ago.date():
-                            km_last_30_days += distance
+    efficiency = summarize_efficiency(compute_efficiency_stats(
+        *fuel_record_columns(base_query), window_start=thirty_days_ago.date()
+    ))
+    total_km = efficiency['total_km']
+    km_last_30_days = efficiency['km_in_window']
     
     consumption_metrics = {
         'total_km': f"{total_km:,.0f} km" if total_km > 0 else "0 km",
-        'average_consumption': f"{sum(consumptions)/len(consumptions):.1f}" if consumptions else "N/A",
-        'best_consumption': f"{max(consumptions):.1f}" if consumptions else "N/A",
+        'average_consumption': f"{efficiency['average_consumption']:.1f}" if efficiency['has_data'] else "N/A",
+        'best_consumption': f"{efficiency['best_consumption']:.1f}" if efficiency['has_data'] else "N/A",
         'km_last_30_days': f"{km_last_30_days:,.0f} km" if km_last_30_days > 0 else "0 km"
     }
     
     # Preparar dados para graficos
-    chart_data = []
-    for vehicle in vehicles:
-        records = FuelRecord.query.filter_by(vehicle_id=vehicle.id).order_by(FuelRecord.date).all()
-        if records:
-            chart_data.append({
-                'vehicle': vehicle.name,
-                'data': [{'date': r.date.strftime('%Y-%m-%d'), 'consumption': r.consumption()} for r in records if r.consumption() > 0]
-            })
+    # (apenas as colunas necessárias, sem carregar os registros inteiros)
+    consumption_by_vehicle = {}
+    for vehicle_id, record_date, consumption in FuelRecord.query.join(Vehicle).filter(
+        Vehicle.user_id == user_id,
+        Vehicle.is_active == True
+    ).with_entities(
+        FuelRecord.vehicle_id, FuelRecord.date, FuelRecord.consumption
+    ).order_by(FuelRecord.date).all():
+        points = consumption_by_vehicle.setdefault(vehicle_id, [])
+        if consumption and consumption > 0:
+            points.append({'date': record_date.strftime('%Y-%m-%d'), 'consumption': consumption})
+
+    chart_data = [
+        {'vehicle': vehicle.name, 'data': consumption_by_vehicle[vehicle.id]}
+        for vehicle in vehicles if vehicle.id in consumption_by_vehicle
+    ]
     
     # Dados mensais para gráficos
     monthly_data = {}
     monthly_data_by_fuel = {}
     fuel_distribution = {}
     
-    # Calcular gastos mensais separados por combustível
+    # Gastos mensais por combustível e litros por combustível (um único GROUP BY)
+    month_bucket = time_bucket(FuelRecord.date, 'month')
     monthly_records = db.session.query(
-        db.func.to_char(FuelRecord.date, 'YYYY-MM').label('month'),
+        month_bucket.label('month'),
         FuelRecord.fuel_type,
-        db.func.sum(FuelRecord.total_cost).label('total')
+        db.func.sum(FuelRecord.total_cost).label('total'),
+        db.func.sum(FuelRecord.liters).label('total_liters')
     ).join(Vehicle).filter(
-        Vehicle.user_id == current_user.id
+        Vehicle.user_id == user_id
     ).group_by(
-        db.func.to_char(FuelRecord.date, 'YYYY-MM'),
+        month_bucket,
         FuelRecord.fuel_type
-    ).order_by(db.func.to_char(FuelRecord.date, 'YYYY-MM')).all()
+    ).order_by(month_bucket).all()
     
     # Organizar dados por mês e combustível
-    for month, fuel_type, total in monthly_records:
+    for month, fuel_type, total, total_liters in monthly_records:
         if month not in monthly_data_by_fuel:
             monthly_data_by_fuel[month] = {}
         monthly_data_by_fuel[month][fuel_type] = float(total or 0)
@@ -2085,37 +3860,65 @@ def dashboard():
         if month not in monthly_data:
             monthly_data[month] = 0
         monthly_data[month] += float(total or 0)
+        
+        # Distribuição de combustível (litros)
+        fuel_distribution[fuel_type] = fuel_distribution.get(fuel_type, 0) + float(total_liters or 0)
     
-    # Calcular distribuição de combustível
-    fuel_records = db.session.query(
-        FuelRecord.fuel_type,
-        db.func.sum(FuelRecord.liters).label('total_liters')
-    ).join(Vehicle).filter(
-        Vehicle.user_id == current_user.id
-    ).group_by(FuelRecord.fuel_type).all()
+    return {
+        'total_records': kpis['total_records'],
+        'monthly_expense': kpis['period_expense'],
+        'total_spent': kpis['total_spent'],
+        'total_liters': kpis['total_liters'],
+        'avg_price': kpis['avg_price'],
+        'favorite_station': favorite_station,
+        'consumption_metrics': consumption_metrics,
+        'chart_data': chart_data,
+        'monthly_data': monthly_data,
+        'monthly_data_by_fuel': monthly_data_by_fuel,
+        'fuel_distribution': fuel_distribution
+    }
+
+@app.route('/app')
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    """Dashboard principal"""
+    print(f"[DASHBOARD] Usuário autenticado: {current_user.is_authenticated}")
+    print(f"[DASHBOARD] ID do usuário: {current_user.get_id() if current_user.is_authenticated else 'None'}")
+
+    # Verificar se usuário pertence a uma frota
+    fleet_membership = FleetMember.query.filter_by(
+        user_id=current_user.id,
+        is_active=True
+    ).first()
+
+    # Processar filtros da URL
+    selected_vehicle = request.args.get('vehicle_id', type=int)
+    selected_days = request.args.get('days', type=int)
+
+    vehicles = Vehicle.query.filter_by(user_id=current_user.id, is_active=True).all()
+    
+    # Ultimos abastecimentos (considerando filtros)
+    recent_query = FuelRecord.query.join(Vehicle).filter(Vehicle.user_id == current_user.id)
+    if selected_vehicle:
+        recent_query = recent_query.filter(FuelRecord.vehicle_id == selected_vehicle)
+    if selected_days:
+        cutoff_date = datetime.now() - timedelta(days=selected_days)
+        recent_query = recent_query.filter(FuelRecord.date >= cutoff_date.date())
+    recent_records = recent_query.order_by(FuelRecord.date.desc()).limit(5).all()
     
-    for fuel_type, total_liters in fuel_records:
-        fuel_distribution[fuel_type] = float(total_liters or 0)
+    # KPIs e gráficos (cache por usuário e filtros, invalidado a cada escrita)
+    context = get_cached_dashboard_context(current_user.id, vehicles, selected_vehicle, selected_days)
     
     # Usar template original
     return render_template('dashboard.html',
                          vehicles=vehicles,
                          fleet_membership=fleet_membership,
-                         total_vehicles=total_vehicles,
-                         total_records=total_records,
+                         total_vehicles=len(vehicles),
                          recent_records=recent_records,
-                         monthly_expense=monthly_expense,
-                         total_spent=total_spent,
-                         total_liters=total_liters,
-                         avg_price=avg_price,
-                         favorite_station=favorite_station,
-                         consumption_metrics=consumption_metrics,
-                         chart_data=chart_data,
-                         monthly_data=monthly_data,
-                         monthly_data_by_fuel=monthly_data_by_fuel,
-                         fuel_distribution=fuel_distribution,
                          selected_vehicle=selected_vehicle,
-                         selected_days=selected_days)
+                         selected_days=selected_days,
+                         **context)
 
 @app.route('/vehicles')
 @login_required
@@ -2130,39 +3933,28 @@ def vehicles():
     # Calcular resumo da frota dos últimos 30 dias
     thirty_days_ago = datetime.now() - timedelta(days=30)
 
-    # Buscar registros dos últimos 30 dias (apenas veículos ativos)
-    recent_records = FuelRecord.query.join(Vehicle).filter(
+    # Registros dos últimos 30 dias (apenas veículos ativos)
+    recent_query = FuelRecord.query.join(Vehicle).filter(
         Vehicle.user_id == current_user.id,
         Vehicle.is_active == True,
         FuelRecord.date >= thirty_days_ago.date()
-    ).all()
+    )
+    efficiency_30d = summarize_efficiency(compute_efficiency_stats(*fuel_record_columns(recent_query)))
+    totals_30d = recent_query.with_entities(
+        db.func.count(FuelRecord.id),
+        db.func.sum(FuelRecord.total_cost),
+        db.func.sum(FuelRecord.liters)
+    ).one()
 
     # Calcular métricas dos últimos 30 dias
     fleet_summary = {
         'total_vehicles': len(vehicles),
-        'total_records_30d': len(recent_records),
-        'total_spent_30d': sum(record.total_cost for record in recent_records) if recent_records else 0,
-        'total_liters_30d': sum(record.liters for record in recent_records) if recent_records else 0,
-        'avg_consumption_30d': 0
+        'total_records_30d': totals_30d[0],
+        'total_spent_30d': totals_30d[1] or 0,
+        'total_liters_30d': totals_30d[2] or 0,
+        'avg_consumption_30d': efficiency_30d['average_consumption']
     }
 
-    # Calcular consumo médio dos últimos 30 dias
-    consumptions_30d = []
-    for vehicle in vehicles:
-        vehicle_records = [r for r in recent_records if r.vehicle_id == vehicle.id]
-        vehicle_records.sort(key=lambda x: x.date)
-
-        for i in range(1, len(vehicle_records)):
-            if vehicle_records[i].odometer and vehicle_records[i-1].odometer:
-                distance = vehicle_records[i].odometer - vehicle_records[i-1].odometer
-                if 0 < distance <= 2000 and vehicle_records[i].liters > 0:
-                    consumption = distance / vehicle_records[i].liters
-                    if 3 <= consumption <= 25:
-                        consumptions_30d.append(consumption)
-
-    if consumptions_30d:
-        fleet_summary['avg_consumption_30d'] = sum(consumptions_30d) / len(consumptions_30d)
-
     return render_template('vehicles.html',
                          vehicles=vehicles,
                          archived_vehicles=archived_vehicles,
@@ -2222,15 +4014,11 @@ def add_vehicle():
 def vehicle_detail(vehicle_id):
     """Detalhes do veiculo"""
     vehicle = Vehicle.query.filter_by(id=vehicle_id, user_id=current_user.id).first_or_404()
-    records = FuelRecord.query.filter_by(vehicle_id=vehicle_id).order_by(FuelRecord.date.desc()).all()
-    # Calcular estatisticas
-    efficiency = calculate_fuel_efficiency(vehicle_id)
-    # Ultimos 30 dias
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-    recent_expense = db.session.query(db.func.sum(FuelRecord.total_cost)).filter(
-        FuelRecord.vehicle_id == vehicle_id,
-        FuelRecord.date >= thirty_days_ago
-    ).scalar() or 0
+    # Primeira página do histórico (demais páginas via api_vehicle_fuel_records)
+    records, next_cursor = fuel_history_page(vehicle_id)
+    # Estatisticas e gasto dos últimos 30 dias em um único SELECT agregado
+    efficiency = vehicle_history_stats(vehicle_id)
+    recent_expense = efficiency['recent_expense']
 
     # Alerta de troca de óleo aprimorado
     last_oil = OilChange.query.filter_by(vehicle_id=vehicle_id).order_by(OilChange.date.desc()).first()
@@ -2264,10 +4052,41 @@ def vehicle_detail(vehicle_id):
     return render_template('vehicle_detail.html',
                          vehicle=vehicle,
                          records=records,
+                         next_cursor=next_cursor,
+                         total_records=efficiency['total_records'],
                          efficiency=efficiency,
                          recent_expense=recent_expense,
                          oil_alert=oil_alert)
 
+@app.route('/api/vehicle/<int:vehicle_id>/fuel_records')
+@login_required
+def api_vehicle_fuel_records(vehicle_id):
+    """API para carregar mais abastecimentos do histórico (paginação por cursor)"""
+    Vehicle.query.filter_by(id=vehicle_id, user_id=current_user.id).first_or_404()
+
+    try:
+        cursor = parse_fuel_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Cursor inválido'}), 400
+
+    limit = min(request.args.get('limit', FUEL_HISTORY_PAGE_SIZE, type=int), 100)
+    records, next_cursor = fuel_history_page(vehicle_id, cursor, max(limit, 1))
+
+    return jsonify({
+        'success': True,
+        'records': [{
+            'id': record.id,
+            'date': record.date.strftime('%d/%m/%Y'),
+            'odometer': record.odometer,
+            'liters': record.liters,
+            'price_per_liter': record.price_per_liter,
+            'total_cost': record.total_cost,
+            'consumption': record.consumption,
+            'edit_url': url_for('edit_fuel_record', record_id=record.id)
+        } for record in records],
+        'next_cursor': next_cursor
+    })
+
 @app.route('/api/vehicle/<int:vehicle_id>/fuel_count')
 @login_required
 def vehicle_fuel_count(vehicle_id):
@@ -2386,7 +4205,7 @@ def edit_vehicle(vehicle_id):
 def add_fuel():
     """Adicionar abastecimento - formulário manual"""
     # Buscar apenas veículos ativos (não arquivados)
-    vehicles = Vehicle.query.filter_by(user_id=current_user.id, is_archived=False).all()
+    vehicles = Vehicle.query.filter_by(user_id=current_user.id, is_active=True).all()
     
     if request.method == 'POST':
         # Criar registro de combustível
@@ -2399,8 +4218,7 @@ def add_fuel():
             total_cost=float(request.form['total_cost']),
             gas_station=request.form.get('gas_station', ''),
             fuel_type=request.form.get('fuel_type', 'Gasolina Comum'),
-            notes='',
-            full_tank=bool(request.form.get('full_tank'))
+            notes=''
         )
         
         # Se não foi informado price_per_liter, calcular
@@ -2416,6 +4234,8 @@ def add_fuel():
             record.liters = record.total_cost / record.price_per_liter
         
         db.session.add(record)
+        db.session.flush()
+        refresh_fuel_segments(record.vehicle_id, (record.odometer, record.id))
         db.session.commit()
         
         flash('Abastecimento adicionado com sucesso!', 'success')
@@ -2466,6 +4286,8 @@ def add_fuel_record(vehicle_id):
         )
         
         db.session.add(record)
+        db.session.flush()
+        refresh_fuel_segments(vehicle_id, (record.odometer, record.id))
         db.session.commit()
         
         flash('Registro adicionado com sucesso!', 'success')
@@ -2488,6 +4310,8 @@ def edit_fuel_record(record_id):
 
     if request.method == 'POST':
         try:
+            previous_odometer = record.odometer
+
             # Atualizar dados do registro
             record.date = datetime.strptime(request.form['date'], '%Y-%m-%d').date()
             record.odometer = float(request.form['odometer'])
@@ -2498,6 +4322,11 @@ def edit_fuel_record(record_id):
             record.fuel_type = request.form.get('fuel_type', vehicle.fuel_type)
             record.notes = request.form.get('notes', '')
 
+            refresh_fuel_segments(
+                vehicle.id,
+                (previous_odometer, record.id),
+                (record.odometer, record.id)
+            )
             db.session.commit()
 
             flash('Abastecimento atualizado com sucesso!', 'success')
@@ -2527,7 +4356,9 @@ def delete_fuel_record(record_id):
             if os.path.exists(file_path):
                 os.remove(file_path)
 
+        position = (record.odometer, record.id)
         db.session.delete(record)
+        refresh_fuel_segments(vehicle_id, position)
         db.session.commit()
 
         flash('Abastecimento excluído com sucesso!', 'success')
@@ -2544,38 +4375,38 @@ def analytics():
     """Pagina de analytics"""
     vehicles = Vehicle.query.filter_by(user_id=current_user.id, is_active=True).all()
     
-    # Dados para graficos
+    # Dados para graficos (uma consulta para todos os veículos)
     analytics_data = {}
+    records_query = FuelRecord.query.join(Vehicle).filter(
+        Vehicle.user_id == current_user.id,
+        Vehicle.is_active == True
+    )
+    columns = fuel_record_columns(records_query)
+    efficiency_by_vehicle = compute_efficiency_stats(*columns)
+    consumption_series = compute_consumption_series(*columns)
+
+    records_by_vehicle = {}
+    for record in records_query.order_by(FuelRecord.date).all():
+        records_by_vehicle.setdefault(record.vehicle_id, []).append(record)
     
     for vehicle in vehicles:
-        records = FuelRecord.query.filter_by(vehicle_id=vehicle.id).order_by(FuelRecord.date).all()
+        records = records_by_vehicle.get(vehicle.id)
         
         if records:
             # Consumo ao longo do tempo
-            consumption_data = []
-            cost_data = []
-            
-            for i in range(1, len(records)):
-                prev_record = records[i-1]
-                curr_record = records[i]
-                
-                distance = curr_record.odometer - prev_record.odometer
-                if distance > 0 and curr_record.liters > 0:
-                    consumption = distance / curr_record.liters
-                    consumption_data.append({
-                        'date': curr_record.date.strftime('%Y-%m-%d'),
-                        'consumption': round(consumption, 2)
-                    })
-                
-                cost_data.append({
-                    'date': curr_record.date.strftime('%Y-%m-%d'),
-                    'cost': curr_record.total_cost
-                })
+            consumption_data = [
+                {'date': day.strftime('%Y-%m-%d'), 'consumption': round(consumption, 2)}
+                for day, consumption in consumption_series.get(vehicle.id, [])
+            ]
+            cost_data = [
+                {'date': record.date.strftime('%Y-%m-%d'), 'cost': record.total_cost}
+                for record in records[1:]
+            ]
             
             analytics_data[vehicle.name] = {
                 'consumption': consumption_data,
                 'costs': cost_data,
-                'efficiency': calculate_fuel_efficiency(vehicle.id)
+                'efficiency': efficiency_by_vehicle.get(vehicle.id, empty_efficiency())
             }
     
     return render_template('analytics.html', vehicles=vehicles, analytics_data=analytics_data)
@@ -2651,7 +4482,7 @@ def export_data():
             record.total_cost,
             record.gas_station,
             record.fuel_type,
-            record.consumption(),
+            record.consumption or 0,
             record.notes
         ])
     
@@ -3028,50 +4859,45 @@ def fleet_dashboard():
     
     # KPIs da frota
     fleet_vehicles = Vehicle.query.filter_by(fleet_id=fleet.id, is_active=True).all()
+    total_vehicles = len(fleet_vehicles)
     
-    # Dados dos últimos 30 dias
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-    
-    # Total de registros de combustível
-    fleet_fuel_records = db.session.query(FuelRecord).join(Vehicle).filter(
-        Vehicle.fleet_id == fleet.id,
-        FuelRecord.date >= thirty_days_ago.date()
-    ).all()
+    # Período dos totais (30, 90 ou 365 dias) e comparação com o ano anterior, lidos do rollup diário
+    period_days = request.args.get('period', 30, type=int)
+    if period_days not in FLEET_DASHBOARD_PERIODS:
+        period_days = 30
+    period_totals, previous_year = fleet_period_comparison(fleet.id, period_days)
+    total_spent = period_totals['total_spent']
     
-    # Calcular KPIs
-    total_spent = sum(record.total_cost for record in fleet_fuel_records)
-    total_liters = sum(record.liters for record in fleet_fuel_records)
-    total_vehicles = len(fleet_vehicles)
+    # Eficiência por veículo em uma passada
+    vehicle_stats = fleet_vehicle_stats(fleet.id)
     
-    # Eficiência média da frota
+    # Eficiência média da frota e top veículos a partir do mesmo resultado
+    vehicle_efficiency = []
     consumptions = []
     for vehicle in fleet_vehicles:
-        efficiency = calculate_fuel_efficiency(vehicle.id)
+        efficiency = vehicle_stats.get(vehicle.id, empty_efficiency())
         if efficiency['has_data']:
             consumptions.append(efficiency['average_consumption'])
-    
-    avg_fleet_consumption = sum(consumptions) / len(consumptions) if consumptions else 0
-    
-    # Top veículos por eficiência
-    vehicle_efficiency = []
-    for vehicle in fleet_vehicles:
-        efficiency = calculate_fuel_efficiency(vehicle.id)
         vehicle_efficiency.append({
             'vehicle': vehicle,
             'efficiency': efficiency['average_consumption'] if efficiency['has_data'] else 0,
-            'total_records': efficiency.get('total_records', 0)
+            'total_records': efficiency['total_records']
         })
     
+    avg_fleet_consumption = sum(consumptions) / len(consumptions) if consumptions else 0
     vehicle_efficiency.sort(key=lambda x: x['efficiency'], reverse=True)
     
     # Estatísticas
     fleet_stats = {
         'total_vehicles': total_vehicles,
-        'total_spent_30d': total_spent,
-        'total_liters_30d': total_liters,
+        'period_days': period_days,
+        'total_spent': total_spent,
+        'total_liters': period_totals['total_liters'],
+        'total_km': period_totals['total_km'],
+        'total_records': period_totals['total_records'],
         'avg_consumption': avg_fleet_consumption,
-        'total_records_30d': len(fleet_fuel_records),
-        'cost_per_vehicle': total_spent / total_vehicles if total_vehicles > 0 else 0
+        'cost_per_vehicle': total_spent / total_vehicles if total_vehicles > 0 else 0,
+        'previous_year': previous_year
     }
     
     return render_template('fleet_dashboard.html', 
@@ -3176,36 +5002,29 @@ def send_fleet_invite():
             'user': 'Usuário'
         }
         
-        success = send_email(
-            to=email,
-            subject=f"🚛 Convite para frota: {fleet_membership.fleet.name} - Rodo Stats",
-            template="emails/fleet_invite.html",
-            invitee_email=email,
-            invitee_name=name or 'Colega',
-            fleet_name=fleet_membership.fleet.name,
-            inviter_name=current_user.name or current_user.username,
-            role=role,
-            role_display=role_mapping.get(role, 'Usuário'),
-            accept_url=accept_url,
-            message=message,
-            invite_date=datetime.utcnow().strftime('%d/%m/%Y às %H:%M'),
-            expiry_date=(datetime.utcnow() + timedelta(days=7)).strftime('%d/%m/%Y'),
-            current_year=datetime.utcnow().year
-        )
+        # Email enviado pelo worker (com novas tentativas); o convite fica 'failed' se todas falharem
+        enqueue_job('fleet_invite_email', {
+            'invite_id': invite.id,
+            'subject': f"🚛 Convite para frota: {fleet_membership.fleet.name} - Rodo Stats",
+            'context': {
+                'invitee_email': email,
+                'invitee_name': name or 'Colega',
+                'fleet_name': fleet_membership.fleet.name,
+                'inviter_name': current_user.name or current_user.username,
+                'role': role,
+                'role_display': role_mapping.get(role, 'Usuário'),
+                'accept_url': accept_url,
+                'message': message,
+                'invite_date': datetime.utcnow().strftime('%d/%m/%Y às %H:%M'),
+                'expiry_date': (datetime.utcnow() + timedelta(days=7)).strftime('%d/%m/%Y'),
+                'current_year': datetime.utcnow().year
+            }
+        }, priority=JOB_PRIORITY_EMAIL, user_id=current_user.id)
         
-        if success:
-            return jsonify({
-                'success': True, 
-                'message': f'Convite enviado com sucesso para {email}!'
-            })
-        else:
-            # Marcar convite como erro no envio
-            invite.status = 'failed'
-            db.session.commit()
-            return jsonify({
-                'success': False, 
-                'message': 'Erro ao enviar email. Verifique as configurações.'
-            }), 500
+        return jsonify({
+            'success': True, 
+            'message': f'Convite enviado com sucesso para {email}!'
+        })
             
     except Exception as e:
         db.session.rollback()
@@ -3360,6 +5179,38 @@ def generate_fleet_report():
         flash('Erro ao gerar relatório. Tente novamente.', 'error')
         return redirect(url_for('fleet_dashboard'))
 
+@app.route('/api/fleet/reports', methods=['POST'])
+@login_required
+def enqueue_fleet_report():
+    """Enfileirar a geração do relatório da frota; o download sai em /api/jobs/<id>/download"""
+    fleet_membership = FleetMember.query.filter_by(
+        user_id=current_user.id,
+        is_active=True
+    ).first()
+
+    if not fleet_membership or not fleet_membership.can_view_reports:
+        return jsonify({'success': False, 'error': 'Acesso negado'}), 403
+
+    data = request.get_json(silent=True) or request.form
+    report_type = 'excel' if data.get('type') == 'excel' else 'pdf'
+    try:
+        period_days = int(data.get('period', 30))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Período inválido'}), 400
+
+    job = enqueue_job('fleet_report', {
+        'fleet_id': fleet_membership.fleet_id,
+        'report_type': report_type,
+        'period': period_days
+    }, priority=JOB_PRIORITY_REPORT, user_id=current_user.id)
+
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('api_job_status', job_id=job.id)
+    }), 202
+
 @app.route('/api/fleet/report_preview')
 @login_required
 def fleet_report_preview():
@@ -3376,13 +5227,13 @@ def fleet_report_preview():
 
         period_days = int(request.args.get('period', 30))
 
-        # Importar função de geração
-        from report_generator import generate_fleet_reports
+        # Importar função das estatísticas
+        from report_generator import fleet_report_stats
 
         fleet = fleet_membership.fleet
 
-        # Gerar apenas as estatísticas (sem os arquivos)
-        _, _, fleet_stats = generate_fleet_reports(fleet, period_days)
+        # Apenas as estatísticas, sem gerar os arquivos
+        _, fleet_stats, _, _ = fleet_report_stats(fleet, period_days)
 
         return jsonify({
             'success': True,
@@ -3417,20 +5268,14 @@ def fleet_drivers():
     # Buscar motoristas da frota
     drivers = Driver.query.filter_by(fleet_id=fleet.id, is_active=True).all()
 
-    # Buscar veículos disponíveis (sem motorista fixo)
-    available_vehicles = Vehicle.query.filter_by(
-        fleet_id=fleet.id,
-        is_active=True,
-        driver_id=None
-    ).all()
-
-    # Buscar veículos por motorista
-    driver_vehicles = {}
-    for driver in drivers:
-        driver_vehicles[driver.id] = Vehicle.query.filter_by(
-            driver_id=driver.id,
-            is_active=True
-        ).all()
+    # Veículos ativos da frota em uma única consulta, agrupados por motorista em memória
+    available_vehicles = []
+    driver_vehicles = {driver.id: [] for driver in drivers}
+    for vehicle in Vehicle.query.filter_by(fleet_id=fleet.id, is_active=True).order_by(Vehicle.id):
+        if vehicle.driver_id is None:
+            available_vehicles.append(vehicle)  # Sem motorista fixo
+        elif vehicle.driver_id in driver_vehicles:
+            driver_vehicles[vehicle.driver_id].append(vehicle)
 
     return render_template('fleet_drivers.html',
                          fleet=fleet,
@@ -3502,7 +5347,7 @@ def add_fleet_driver():
 
 @app.route('/fleet/drivers/<int:driver_id>/assign_vehicle', methods=['POST'])
 @login_required
-def assign_vehicle_to_driver():
+def assign_vehicle_to_driver(driver_id):
     """Atribuir veículo a motorista"""
     try:
         # Verificar permissões
@@ -3514,7 +5359,6 @@ def assign_vehicle_to_driver():
         if not fleet_membership or not fleet_membership.can_manage_vehicles:
             return jsonify({'error': 'Acesso negado'}), 403
 
-        driver_id = request.view_args['driver_id']
         vehicle_id = request.form.get('vehicle_id')
 
         if not vehicle_id:
@@ -3553,18 +5397,103 @@ def assign_vehicle_to_driver():
         vehicle.driver_id = driver_id
         db.session.commit()
 
-        flash(f'Veículo {vehicle.brand} {vehicle.model} atribuído a {driver.name}!', 'success')
-        return redirect(url_for('fleet_drivers'))
+        flash(f'Veículo {vehicle.brand} {vehicle.model} atribuído a {driver.name}!', 'success')
+        return redirect(url_for('fleet_drivers'))
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ASSIGN_VEHICLE] Erro: {str(e)}")
+        flash('Erro ao atribuir veículo. Tente novamente.', 'error')
+        return redirect(url_for('fleet_drivers'))
+
+# Máximo de atribuições por chamada da API em lote
+DRIVER_ASSIGNMENT_BATCH_LIMIT = 500
+
+def bulk_assign_vehicles(fleet_id, assignments):
+    """Atribui ou remove motoristas de vários veículos da frota com um único UPDATE
+
+    `assignments` é {vehicle_id: driver_id ou None}. Veículos e motoristas são
+    validados contra a frota antes da gravação; levanta ValueError com a
+    mensagem para o usuário. Retorna o número de veículos atualizados.
+    """
+    vehicle_ids = set(assignments)
+    found_vehicles = {row[0] for row in db.session.query(Vehicle.id).filter(
+        Vehicle.id.in_(vehicle_ids),
+        Vehicle.fleet_id == fleet_id,
+        Vehicle.is_active == True
+    )}
+    missing = sorted(vehicle_ids - found_vehicles)
+    if missing:
+        raise ValueError(f"Veículos não encontrados na frota: {', '.join(map(str, missing))}")
+
+    driver_ids = {driver_id for driver_id in assignments.values() if driver_id is not None}
+    if driver_ids:
+        found_drivers = {row[0] for row in db.session.query(Driver.id).filter(
+            Driver.id.in_(driver_ids),
+            Driver.fleet_id == fleet_id,
+            Driver.is_active == True
+        )}
+        missing = sorted(driver_ids - found_drivers)
+        if missing:
+            raise ValueError(f"Motoristas não encontrados na frota: {', '.join(map(str, missing))}")
+
+    table = Vehicle.__table__
+    result = db.session.execute(
+        table.update()
+        .where(table.c.id.in_(vehicle_ids), table.c.fleet_id == fleet_id)
+        .values(driver_id=db.case(assignments, value=table.c.id))
+    )
+
+    # UPDATE em lote não passa pelo flush: invalidar o snapshot do ranking manualmente
+    bump_fleet_ranking_versions(db.session.connection(), fleet_ids=[fleet_id])
+    db.session.commit()
+    return result.rowcount
+
+@app.route('/api/fleet/drivers/assignments', methods=['POST'])
+@login_required
+def bulk_driver_assignments():
+    """Atribuição e remoção de motoristas em lote
+
+    Corpo: {"assignments": [{"vehicle_id": 1, "driver_id": 2}, {"vehicle_id": 3, "driver_id": null}]}
+    """
+    fleet_membership = FleetMember.query.filter_by(
+        user_id=current_user.id,
+        is_active=True
+    ).first()
+
+    if not fleet_membership or not fleet_membership.can_manage_vehicles:
+        return jsonify({'error': 'Acesso negado'}), 403
+
+    data = request.get_json(silent=True) or {}
+    items = data.get('assignments')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Informe a lista de atribuições'}), 400
+    if len(items) > DRIVER_ASSIGNMENT_BATCH_LIMIT:
+        return jsonify({'error': f'Máximo de {DRIVER_ASSIGNMENT_BATCH_LIMIT} atribuições por chamada'}), 400
+
+    assignments = {}
+    for item in items:
+        vehicle_id = item.get('vehicle_id') if isinstance(item, dict) else None
+        driver_id = item.get('driver_id') if isinstance(item, dict) else None
+        # type() e não isinstance(): true/false do JSON são bool, subclasse de int
+        if type(vehicle_id) is not int or (driver_id is not None and type(driver_id) is not int):
+            return jsonify({'error': 'Atribuição inválida: use vehicle_id e driver_id inteiros (ou null)'}), 400
+        if vehicle_id in assignments:
+            return jsonify({'error': f'Veículo {vehicle_id} repetido na lista'}), 400
+        assignments[vehicle_id] = driver_id
 
-    except Exception as e:
+    try:
+        updated = bulk_assign_vehicles(fleet_membership.fleet_id, assignments)
+    except ValueError as e:
         db.session.rollback()
-        print(f"[ASSIGN_VEHICLE] Erro: {str(e)}")
-        flash('Erro ao atribuir veículo. Tente novamente.', 'error')
-        return redirect(url_for('fleet_drivers'))
+        return jsonify({'error': str(e)}), 400
+
+    print(f"[ASSIGN_VEHICLE] {updated} atribuições em lote na frota {fleet_membership.fleet_id}")
+    return jsonify({'success': True, 'updated': updated})
 
 @app.route('/fleet/drivers/<int:driver_id>/remove_vehicle/<int:vehicle_id>', methods=['POST'])
 @login_required
-def remove_vehicle_from_driver():
+def remove_vehicle_from_driver(driver_id, vehicle_id):
     """Remover veículo de motorista"""
     try:
         # Verificar permissões
@@ -3576,9 +5505,6 @@ def remove_vehicle_from_driver():
         if not fleet_membership or not fleet_membership.can_manage_vehicles:
             return jsonify({'error': 'Acesso negado'}), 403
 
-        driver_id = request.view_args['driver_id']
-        vehicle_id = request.view_args['vehicle_id']
-
         # Verificar se veículo pertence ao motorista
         vehicle = Vehicle.query.filter_by(
             id=vehicle_id,
@@ -3607,7 +5533,7 @@ def remove_vehicle_from_driver():
 
 @app.route('/api/fleet/driver_stats/<int:driver_id>')
 @login_required
-def driver_stats():
+def driver_stats(driver_id):
     """Estatísticas de um motorista específico"""
     try:
         # Verificar permissões
@@ -3619,8 +5545,6 @@ def driver_stats():
         if not fleet_membership:
             return jsonify({'error': 'Acesso negado'}), 403
 
-        driver_id = request.view_args['driver_id']
-
         # Verificar se motorista pertence à frota
         driver = Driver.query.filter_by(
             id=driver_id,
@@ -3722,14 +5646,18 @@ def fleet_ranking_api():
 
         period_days = int(request.args.get('period', 30))
         metric = request.args.get('metric', 'efficiency')
+        limit = request.args.get('limit', type=int)
+        offset = max(request.args.get('offset', 0, type=int), 0)
 
-        ranking_data = generate_driver_ranking(fleet_membership.fleet_id, period_days, metric)
+        ranking_data = generate_driver_ranking(fleet_membership.fleet_id, period_days, metric,
+                                               limit=max(limit, 1) if limit else None, offset=offset)
 
         return jsonify({
             'success': True,
             'ranking': ranking_data,
             'period_days': period_days,
             'metric': metric,
+            'snapshot': ranking_data.get('snapshot'),
             'generated_at': datetime.now().isoformat()
         })
 
@@ -3737,146 +5665,174 @@ def fleet_ranking_api():
         print(f"[RANKING_API] Erro: {str(e)}")
         return jsonify({'error': 'Erro ao gerar ranking'}), 500
 
-def generate_driver_ranking(fleet_id, period_days=30, metric='efficiency'):
-    """Gerar ranking de motoristas por diferentes métricas"""
-    try:
-        # Período de análise
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=period_days)
+def generate_driver_ranking(fleet_id, period_days=30, metric='efficiency', limit=None, offset=0):
+    """Gerar ranking de motoristas por diferentes métricas
 
-        # Buscar motoristas da frota com veículos
-        drivers = db.session.query(Driver).filter(
-            Driver.fleet_id == fleet_id,
-            Driver.is_active == True
-        ).all()
+    Períodos padrão (RANKING_SNAPSHOT_PERIODS) são servidos do snapshot, já
+    ordenados e fatiados no banco; os demais são calculados na hora.
+    """
+    try:
+        if app.config.get('RANKING_SNAPSHOT_ENABLED', True) and period_days in RANKING_SNAPSHOT_PERIODS:
+            ranking = ranking_from_snapshot(fleet_id, period_days, metric, limit, offset)
+            if ranking is not None:
+                return ranking
 
+        # Totais do período por motorista em um único SELECT agrupado
+        vehicles_by_driver = {}
         ranking_list = []
+        totals = driver_period_totals(fleet_id, [period_days])[period_days]
+        if totals:
+            # Veículos ativos dos motoristas do ranking em uma única consulta
+            vehicles_by_driver = active_vehicles_by_driver([driver.id for driver, _ in totals])
 
-        for driver in drivers:
-            # Buscar veículos do motorista
-            vehicles = Vehicle.query.filter_by(
-                driver_id=driver.id,
-                is_active=True
-            ).all()
-
-            if not vehicles:
-                continue  # Pular motoristas sem veículos
+        for driver, metrics in totals:
+            ranking_list.append(driver_ranking_entry(driver, vehicles_by_driver.get(driver.id, []), metrics))
 
-            # Buscar registros de combustível do período
-            vehicle_ids = [v.id for v in vehicles]
-            fuel_records = FuelRecord.query.filter(
-                FuelRecord.vehicle_id.in_(vehicle_ids),
-                FuelRecord.date >= start_date,
-                FuelRecord.date <= end_date
-            ).all()
+        # Ordenar ranking baseado na métrica selecionada
+        if metric in RANKING_SORT_METRICS:
+            column, descending = RANKING_SORT_METRICS[metric]
+            ranking_list.sort(key=lambda x: x['metrics'][column], reverse=descending)
 
-            if len(fuel_records) < 2:
-                continue  # Precisa de pelo menos 2 registros
+        fleet_stats = driver_ranking_fleet_stats(ranking_list)
+        ranking_list = ranking_list[offset:offset + limit if limit else None]
 
-            # Calcular métricas
-            total_cost = sum(r.total_cost for r in fuel_records)
-            total_liters = sum(r.liters for r in fuel_records)
-            total_km = sum(r.kilometers for r in fuel_records if r.kilometers)
+        # Adicionar posições
+        for i, driver_data in enumerate(ranking_list, offset + 1):
+            driver_data['position'] = i
 
-            # Calcular consumo médio
-            avg_consumption = 0
-            consumption_records = [r for r in fuel_records if r.consumption and r.consumption > 0]
-            if consumption_records:
-                avg_consumption = sum(r.consumption for r in consumption_records) / len(consumption_records)
+        return {
+            'drivers': ranking_list,
+            'fleet_stats': fleet_stats,
+            'period_days': period_days,
+            'metric': metric,
+            'snapshot': None
+        }
 
-            # Calcular custo por km
-            cost_per_km = total_cost / total_km if total_km > 0 else 0
+    except Exception as e:
+        print(f"[RANKING] Erro ao gerar ranking: {str(e)}")
+        return {'drivers': [], 'fleet_stats': {}, 'period_days': period_days, 'metric': metric, 'snapshot': None}
 
-            # Calcular custo por litro médio
-            avg_price_per_liter = total_cost / total_liters if total_liters > 0 else 0
+def driver_period_totals(fleet_id, periods):
+    """Métricas de cada motorista ativo da frota em vários períodos com um único SELECT agrupado
 
-            # Calcular economia mensal projetada
-            days_in_period = period_days
-            monthly_projection = (total_cost / days_in_period) * 30 if days_in_period > 0 else 0
+    Junta motoristas ativos -> veículos ativos -> abastecimentos e usa agregados
+    condicionais (FILTER) por período. Retorna {período: [(motorista, métricas)]}
+    apenas com motoristas que têm pelo menos 2 registros no período.
+    """
+    end_date = datetime.now().date()
+    starts = {period: end_date - timedelta(days=period) for period in periods}
+
+    columns = []
+    for period in periods:
+        in_period = FuelRecord.date >= starts[period]
+        columns.extend([
+            db.func.count(FuelRecord.id).filter(in_period),
+            db.func.sum(FuelRecord.total_cost).filter(in_period),
+            db.func.sum(FuelRecord.liters).filter(in_period),
+            db.func.sum(FuelRecord.kilometers).filter(in_period),
+            db.func.avg(FuelRecord.consumption).filter(in_period, FuelRecord.consumption > 0)
+        ])
 
-            # Score de eficiência (baseado em múltiplos fatores)
-            efficiency_score = calculate_efficiency_score(
-                avg_consumption, cost_per_km, len(fuel_records), total_km
-            )
+    rows = db.session.query(Driver, *columns).join(
+        Vehicle, db.and_(Vehicle.driver_id == Driver.id, Vehicle.is_active == True)
+    ).join(
+        FuelRecord, FuelRecord.vehicle_id == Vehicle.id
+    ).filter(
+        Driver.fleet_id == fleet_id,
+        Driver.is_active == True,
+        FuelRecord.date >= min(starts.values()),
+        FuelRecord.date <= end_date
+    ).group_by(Driver.id).order_by(Driver.id).all()
+
+    totals = {period: [] for period in periods}
+    for row in rows:
+        driver = row[0]
+        for index, period in enumerate(periods):
+            records_count, total_cost, total_liters, total_km, avg_consumption = row[1 + index * 5:6 + index * 5]
+            if records_count < 2:
+                continue  # Precisa de pelo menos 2 registros
+            totals[period].append((driver, driver_ranking_metrics(
+                records_count, total_cost or 0, total_liters or 0, total_km or 0, avg_consumption or 0, period
+            )))
+    return totals
 
-            # Classificação de performance
-            performance_rating = get_performance_rating(avg_consumption, cost_per_km, efficiency_score)
-
-            driver_data = {
-                'driver': {
-                    'id': driver.id,
-                    'name': driver.name,
-                    'phone': driver.phone,
-                    'cnh_category': driver.cnh_category
-                },
-                'vehicles': [
-                    {
-                        'id': v.id,
-                        'name': f"{v.brand} {v.model}",
-                        'license_plate': v.license_plate,
-                        'vehicle_type': v.vehicle_type
-                    } for v in vehicles
-                ],
-                'metrics': {
-                    'total_cost': total_cost,
-                    'total_liters': total_liters,
-                    'total_km': total_km,
-                    'avg_consumption': avg_consumption,
-                    'cost_per_km': cost_per_km,
-                    'avg_price_per_liter': avg_price_per_liter,
-                    'fuel_records_count': len(fuel_records),
-                    'monthly_projection': monthly_projection,
-                    'efficiency_score': efficiency_score
-                },
-                'performance': performance_rating
-            }
+def driver_ranking_metrics(records_count, total_cost, total_liters, total_km, avg_consumption, period_days):
+    """Métricas derivadas do ranking a partir dos totais do motorista no período"""
+    # Calcular custo por km
+    cost_per_km = total_cost / total_km if total_km > 0 else 0
 
-            ranking_list.append(driver_data)
+    # Calcular custo por litro médio
+    avg_price_per_liter = total_cost / total_liters if total_liters > 0 else 0
 
-        # Ordenar ranking baseado na métrica selecionada
-        if metric == 'efficiency':
-            ranking_list.sort(key=lambda x: x['metrics']['avg_consumption'], reverse=True)
-        elif metric == 'cost':
-            ranking_list.sort(key=lambda x: x['metrics']['cost_per_km'])
-        elif metric == 'consumption':
-            ranking_list.sort(key=lambda x: x['metrics']['avg_consumption'], reverse=True)
-        elif metric == 'score':
-            ranking_list.sort(key=lambda x: x['metrics']['efficiency_score'], reverse=True)
+    # Calcular economia mensal projetada
+    monthly_projection = (total_cost / period_days) * 30 if period_days > 0 else 0
 
-        # Adicionar posições
-        for i, driver_data in enumerate(ranking_list, 1):
-            driver_data['position'] = i
+    return {
+        'total_cost': total_cost,
+        'total_liters': total_liters,
+        'total_km': total_km,
+        'avg_consumption': avg_consumption,
+        'cost_per_km': cost_per_km,
+        'avg_price_per_liter': avg_price_per_liter,
+        'fuel_records_count': records_count,
+        'monthly_projection': monthly_projection,
+        # Score de eficiência (baseado em múltiplos fatores)
+        'efficiency_score': calculate_efficiency_score(avg_consumption, cost_per_km, records_count, total_km)
+    }
 
-        # Calcular estatísticas da frota
-        if ranking_list:
-            fleet_stats = {
-                'total_drivers': len(ranking_list),
-                'avg_consumption': sum(d['metrics']['avg_consumption'] for d in ranking_list) / len(ranking_list),
-                'total_cost': sum(d['metrics']['total_cost'] for d in ranking_list),
-                'total_km': sum(d['metrics']['total_km'] for d in ranking_list),
-                'best_consumption': max(d['metrics']['avg_consumption'] for d in ranking_list),
-                'worst_consumption': min(d['metrics']['avg_consumption'] for d in ranking_list)
-            }
-        else:
-            fleet_stats = {
-                'total_drivers': 0,
-                'avg_consumption': 0,
-                'total_cost': 0,
-                'total_km': 0,
-                'best_consumption': 0,
-                'worst_consumption': 0
-            }
+def active_vehicles_by_driver(driver_ids):
+    """Veículos ativos de cada motorista, em uma única consulta"""
+    vehicles_by_driver = {}
+    for vehicle in Vehicle.query.filter(
+        Vehicle.driver_id.in_(driver_ids),
+        Vehicle.is_active == True
+    ).order_by(Vehicle.id):
+        vehicles_by_driver.setdefault(vehicle.driver_id, []).append(vehicle)
+    return vehicles_by_driver
+
+def driver_ranking_entry(driver, vehicles, metrics):
+    """Item do ranking no formato usado pela página e pela API"""
+    return {
+        'driver': {
+            'id': driver.id,
+            'name': driver.name,
+            'phone': driver.phone,
+            'cnh_category': driver.cnh_category
+        },
+        'vehicles': [
+            {
+                'id': v.id,
+                'name': f"{v.brand} {v.model}",
+                'license_plate': v.license_plate,
+                'vehicle_type': v.vehicle_type
+            } for v in vehicles
+        ],
+        'metrics': metrics,
+        # Classificação de performance
+        'performance': get_performance_rating(
+            metrics['avg_consumption'], metrics['cost_per_km'], metrics['efficiency_score']
+        )
+    }
 
+def driver_ranking_fleet_stats(ranking_list):
+    """Estatísticas da frota a partir dos itens do ranking"""
+    if not ranking_list:
         return {
-            'drivers': ranking_list,
-            'fleet_stats': fleet_stats,
-            'period_days': period_days,
-            'metric': metric
+            'total_drivers': 0,
+            'avg_consumption': 0,
+            'total_cost': 0,
+            'total_km': 0,
+            'best_consumption': 0,
+            'worst_consumption': 0
         }
-
-    except Exception as e:
-        print(f"[RANKING] Erro ao gerar ranking: {str(e)}")
-        return {'drivers': [], 'fleet_stats': {}, 'period_days': period_days, 'metric': metric}
+    return {
+        'total_drivers': len(ranking_list),
+        'avg_consumption': sum(d['metrics']['avg_consumption'] for d in ranking_list) / len(ranking_list),
+        'total_cost': sum(d['metrics']['total_cost'] for d in ranking_list),
+        'total_km': sum(d['metrics']['total_km'] for d in ranking_list),
+        'best_consumption': max(d['metrics']['avg_consumption'] for d in ranking_list),
+        'worst_consumption': min(d['metrics']['avg_consumption'] for d in ranking_list)
+    }
 
 def calculate_efficiency_score(consumption, cost_per_km, records_count, total_km):
     """Calcular score de eficiência baseado em múltiplos fatores"""
@@ -3953,6 +5909,185 @@ def get_performance_rating(consumption, cost_per_km, efficiency_score):
             'description': 'Performance não avaliada'
         }
 
+# === SNAPSHOT DO RANKING DE MOTORISTAS ===
+
+# Períodos padrão do ranking (dias), pré-calculados por frota
+RANKING_SNAPSHOT_PERIODS = (7, 30, 90, 365)
+
+# Ordenação de cada métrica do ranking: (coluna, decrescente)
+RANKING_SORT_METRICS = {
+    'efficiency': ('avg_consumption', True),
+    'consumption': ('avg_consumption', True),
+    'cost': ('cost_per_km', False),
+    'score': ('efficiency_score', True)
+}
+
+# Modelos cujas escritas alteram o ranking de motoristas
+RANKING_SOURCE_MODELS = ('FuelRecord', 'Vehicle', 'Driver')
+
+def bump_fleet_ranking_versions(connection, fleet_ids=(), vehicle_ids=()):
+    """Incrementa fleets.ranking_version das frotas dos veículos/frotas informados"""
+    fleet_ids = set(fleet_ids)
+    vehicle_ids = set(vehicle_ids)
+    if vehicle_ids:
+        fleet_ids.update(connection.execute(
+            db.select(Vehicle.fleet_id).where(Vehicle.id.in_(vehicle_ids)).distinct()
+        ).scalars())
+    fleet_ids.discard(None)
+    if not fleet_ids:
+        return 0
+
+    table = Fleet.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.id.in_(fleet_ids))
+        .values(ranking_version=db.func.coalesce(table.c.ranking_version, 0) + 1,
+                updated_at=table.c.updated_at)  # Versão não é edição do cadastro
+    )
+    return len(fleet_ids)
+
+@event.listens_for(Session, 'after_flush')
+def bump_ranking_version_after_flush(session, flush_context):
+    """Invalida o snapshot do ranking da frota na mesma transação da escrita"""
+    fleet_ids, vehicle_ids = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        model_name = type(obj).__name__
+        if model_name not in RANKING_SOURCE_MODELS:
+            continue
+        if model_name == 'FuelRecord':
+            vehicle_ids.add(obj.vehicle_id)
+            continue
+        fleet_ids.add(obj.fleet_id)
+        if model_name == 'Vehicle':
+            # Veículo trocado de frota também altera o ranking da frota anterior
+            fleet_ids.update(db.inspect(obj).attrs.fleet_id.history.deleted or ())
+
+    if fleet_ids or vehicle_ids:
+        bump_fleet_ranking_versions(session.connection(), fleet_ids, vehicle_ids)
+
+def refresh_ranking_snapshot(fleet_id):
+    """Recalcula todos os períodos padrão do ranking da frota e grava o snapshot
+
+    Um SELECT agrupado para todos os períodos; a gravação usa conexão própria,
+    como o cache do dashboard. Retorna o instante do cálculo (UTC).
+    """
+    version = db.session.query(Fleet.ranking_version).filter(Fleet.id == fleet_id).scalar() or 0
+    totals = driver_period_totals(fleet_id, RANKING_SNAPSHOT_PERIODS)
+    rows = [
+        dict(metrics, fleet_id=fleet_id, period_days=period, driver_id=driver.id)
+        for period, drivers in totals.items()
+        for driver, metrics in drivers
+    ]
+    computed_at = datetime.utcnow()
+    values = {'data_version': version, 'computed_on': datetime.now().date(), 'computed_at': computed_at}
+
+    rows_table = RankingSnapshotRow.__table__
+    snapshots = RankingSnapshot.__table__
+    with db.engine.begin() as conn:
+        conn.execute(rows_table.delete().where(rows_table.c.fleet_id == fleet_id))
+        if rows:
+            conn.execute(rows_table.insert(), rows)
+        updated = conn.execute(snapshots.update().where(snapshots.c.fleet_id == fleet_id).values(**values))
+        if not updated.rowcount:
+            conn.execute(snapshots.insert().values(fleet_id=fleet_id, **values))
+
+    print(f"[RANKING] Snapshot da frota {fleet_id} atualizado ({len(rows)} linhas)")
+    return computed_at
+
+def ranking_snapshot_is_fresh(snapshot, current_version):
+    """Snapshot calculado hoje e sem escritas na frota desde então"""
+    return (snapshot is not None and snapshot.data_version == (current_version or 0)
+            and snapshot.computed_on == datetime.now().date())
+
+def ranking_from_snapshot(fleet_id, period_days, metric='efficiency', limit=None, offset=0):
+    """Ranking servido do snapshot: ordenação e fatia feitas no banco
+
+    Atualiza o snapshot antes se estiver desatualizado. Retorna None quando
+    não é possível gravá-lo (o chamador calcula o ranking na hora).
+    """
+    current_version, snapshot = db.session.query(Fleet.ranking_version, RankingSnapshot).outerjoin(
+        RankingSnapshot, RankingSnapshot.fleet_id == Fleet.id
+    ).filter(Fleet.id == fleet_id).one()
+
+    if ranking_snapshot_is_fresh(snapshot, current_version):
+        computed_at = snapshot.computed_at
+    else:
+        try:
+            computed_at = refresh_ranking_snapshot(fleet_id)
+        except Exception as e:
+            # Outro worker atualizou a mesma frota ao mesmo tempo: calcular na hora
+            print(f"[RANKING] Não foi possível atualizar o snapshot da frota {fleet_id}: {e}")
+            return None
+
+    in_period = db.and_(RankingSnapshotRow.fleet_id == fleet_id, RankingSnapshotRow.period_days == period_days)
+    query = db.session.query(RankingSnapshotRow, Driver).join(
+        Driver, Driver.id == RankingSnapshotRow.driver_id
+    ).filter(in_period)
+    if metric in RANKING_SORT_METRICS:
+        column, descending = RANKING_SORT_METRICS[metric]
+        column = getattr(RankingSnapshotRow, column)
+        query = query.order_by(column.desc() if descending else column.asc(), RankingSnapshotRow.driver_id)
+    else:
+        query = query.order_by(RankingSnapshotRow.driver_id)
+    rows = query.offset(offset).limit(limit).all()
+
+    vehicles_by_driver = active_vehicles_by_driver([driver.id for _, driver in rows]) if rows else {}
+    drivers = []
+    for position, (row, driver) in enumerate(rows, offset + 1):
+        metrics = {key: getattr(row, key) for key in (
+            'total_cost', 'total_liters', 'total_km', 'avg_consumption', 'cost_per_km',
+            'avg_price_per_liter', 'fuel_records_count', 'monthly_projection', 'efficiency_score'
+        )}
+        entry = driver_ranking_entry(driver, vehicles_by_driver.get(driver.id, []), metrics)
+        entry['position'] = position
+        drivers.append(entry)
+
+    # Estatísticas da frota sobre todo o período, não só a fatia
+    stats = db.session.query(
+        db.func.count(RankingSnapshotRow.id),
+        db.func.avg(RankingSnapshotRow.avg_consumption),
+        db.func.sum(RankingSnapshotRow.total_cost),
+        db.func.sum(RankingSnapshotRow.total_km),
+        db.func.max(RankingSnapshotRow.avg_consumption),
+        db.func.min(RankingSnapshotRow.avg_consumption)
+    ).filter(in_period).one()
+
+    return {
+        'drivers': drivers,
+        'fleet_stats': {
+            'total_drivers': stats[0] or 0,
+            'avg_consumption': stats[1] or 0,
+            'total_cost': stats[2] or 0,
+            'total_km': stats[3] or 0,
+            'best_consumption': stats[4] or 0,
+            'worst_consumption': stats[5] or 0
+        },
+        'period_days': period_days,
+        'metric': metric,
+        'snapshot': {
+            'computed_at': computed_at.isoformat(),
+            'age_seconds': max(0, int((datetime.utcnow() - computed_at).total_seconds()))
+        }
+    }
+
+def refresh_stale_ranking_snapshots():
+    """Atualiza os snapshots das frotas ativas que estão desatualizados ou ainda não existem"""
+    fleets = db.session.query(Fleet.id, Fleet.ranking_version, RankingSnapshot).outerjoin(
+        RankingSnapshot, RankingSnapshot.fleet_id == Fleet.id
+    ).filter(Fleet.is_active == True).all()
+
+    refreshed = 0
+    for fleet_id, current_version, snapshot in fleets:
+        if not ranking_snapshot_is_fresh(snapshot, current_version):
+            refresh_ranking_snapshot(fleet_id)
+            refreshed += 1
+    return {'fleets': len(fleets), 'refreshed': refreshed}
+
+@periodic_job('ranking_snapshots', interval=timedelta(hours=1))
+def ranking_snapshots_periodic():
+    """Mantém os snapshots do ranking atualizados para a primeira visita do dia"""
+    return refresh_stale_ranking_snapshots()
+
 # === ROTAS ESPECIAIS ===
 
 @app.route('/fleet-demo')
@@ -4005,14 +6140,12 @@ def create_demo_user():
         db.session.add(fleet_member)
 
         # Criar alguns veículos demo
-        vehicles_data = [
-            {'name': 'Caminhão 01', 'brand': 'Mercedes-Benz', 'model': 'Actros 2646', 'year': 2021, 'license_plate': 'ABC-1234', 'fuel_type': 'diesel', 'vehicle_type': 'truck', 'tank_capacity': 400},
-            {'name': 'Caminhão 02', 'brand': 'Volvo', 'model': 'FH 460', 'year': 2020, 'license_plate': 'DEF-5678', 'fuel_type': 'diesel', 'vehicle_type': 'truck', 'tank_capacity': 350},
-            {'name': 'Caminhão 03', 'brand': 'Scania', 'model': 'R 450', 'year': 2022, 'license_plate': 'GHI-9012', 'fuel_type': 'diesel', 'vehicle_type': 'truck', 'tank_capacity': 380}
-        ]
+        from seed_data import (DEMO_FLEET_VEHICLES, DEMO_FLEET_CONSUMPTION, DEMO_FLEET_DRIVERS,
+                               generate_fuel_history)
+        from random import Random
 
         demo_vehicles = []
-        for vehicle_data in vehicles_data:
+        for vehicle_data in DEMO_FLEET_VEHICLES:
             vehicle = Vehicle(
                 user_id=demo_user.id,
                 fleet_id=demo_fleet.id,
@@ -4022,11 +6155,7 @@ def create_demo_user():
             demo_vehicles.append(vehicle)
 
         # Criar alguns motoristas demo
-        drivers_data = [
-            {'name': 'Carlos Santos', 'cpf': '12345678901', 'cnh': '123456789', 'cnh_category': 'E', 'phone': '(11) 98888-8888'},
-            {'name': 'José Silva', 'cpf': '09876543210', 'cnh': '987654321', 'cnh_category': 'D', 'phone': '(11) 97777-7777'},
-            {'name': 'Pedro Oliveira', 'cpf': '11122233344', 'cnh': '111222333', 'cnh_category': 'E', 'phone': '(11) 96666-6666'}
-        ]
+        drivers_data = DEMO_FLEET_DRIVERS
 
         for i, driver_data in enumerate(drivers_data):
             driver = Driver(
@@ -4040,45 +6169,26 @@ def create_demo_user():
             if i < len(demo_vehicles):
                 demo_vehicles[i].driver_id = driver.id
 
-        # Criar alguns registros de combustível demo
-        from random import uniform, randint
-        for i, vehicle in enumerate(demo_vehicles):
-            db.session.flush()  # Garantir que o veículo tem ID
-
-            for day in range(1, 31):  # Último mês
-                if randint(1, 3) == 1:  # 33% de chance de ter abastecimento no dia
-                    date_record = datetime.now().date() - timedelta(days=day)
-
-                    # Simular dados realistas
-                    liters = uniform(180, 300)  # 180-300L para caminhões
-                    price_per_liter = uniform(5.50, 6.20)  # Preço do diesel
-                    total_cost = liters * price_per_liter
-                    odometer = 50000 + (day * uniform(200, 400))  # Km crescente
-
-                    # Calcular consumo baseado no veículo
-                    if i == 0:  # Mercedes mais eficiente
-                        km_per_liter = uniform(2.8, 3.2)
-                    elif i == 1:  # Volvo médio
-                        km_per_liter = uniform(2.5, 2.9)
-                    else:  # Scania menos eficiente
-                        km_per_liter = uniform(2.2, 2.6)
-
-                    kilometers = liters * km_per_liter
-
-                    fuel_record = FuelRecord(
-                        vehicle_id=vehicle.id,
-                        date=date_record,
-                        odometer=odometer,
-                        liters=liters,
-                        price_per_liter=price_per_liter,
-                        total_cost=total_cost,
-                        fuel_type=vehicle.fuel_type,
-                        gas_station=f'Posto Demo {randint(1, 5)}',
-                        notes='Registro demo gerado automaticamente'
-                    )
-                    db.session.add(fuel_record)
+        # Criar registros de combustível demo do último mês (insert em lote)
+        rng = Random()
+        today = datetime.now().date()
+        fuel_rows = []
+        for vehicle, consumption_range in zip(demo_vehicles, DEMO_FLEET_CONSUMPTION):
+            fuel_rows.extend(generate_fuel_history(
+                vehicle.id, vehicle.vehicle_type, vehicle.fuel_type, vehicle.tank_capacity,
+                today - timedelta(days=30), today, rng,
+                start_odometer=50000, consumption_range=consumption_range
+            ))
+        for row in fuel_rows:
+            row['gas_station'] = f'Posto Demo {rng.randint(1, 5)}'
+            row['notes'] = 'Registro demo gerado automaticamente'
+        db.session.execute(db.insert(FuelRecord), fuel_rows)
 
         db.session.commit()
+        vehicle_ids = [vehicle.id for vehicle in demo_vehicles]
+        backfill_fuel_segments(vehicle_ids)
+        # Insert em lote não passa pelos eventos do ORM: agendar a reavaliação dos alertas
+        enqueue_alert_evaluation(vehicle_ids)
 
         return jsonify({
             'success': True,
@@ -4102,23 +6212,150 @@ def create_demo_user():
             'message': f'Erro ao criar usuário demo: {str(e)}'
         }), 500
 
-@app.route('/api/run_alerts')
+@app.route('/api/dashboard_cache/stats')
 @login_required
+def api_dashboard_cache_stats():
+    """Contadores de acerto/falha do cache do dashboard (worker atual)"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+
+    lookups = dashboard_cache_stats['hits'] + dashboard_cache_stats['misses']
+    return jsonify({
+        'success': True,
+        'worker_pid': os.getpid(),
+        'enabled': app.config.get('DASHBOARD_CACHE_ENABLED', True),
+        'hits': dashboard_cache_stats['hits'],
+        'misses': dashboard_cache_stats['misses'],
+        'stores': dashboard_cache_stats['stores'],
+        'errors': dashboard_cache_stats['errors'],
+        'hit_rate': round(dashboard_cache_stats['hits'] / lookups, 3) if lookups else 0,
+        'entries': DashboardCache.query.count()
+    })
+
+@app.route('/api/run_alerts', methods=['POST'])
+@admin_required
 def api_run_alerts():
-    """Executar verificações de alertas manualmente"""
+    """Enfileirar a varredura global de alertas (só administradores); o andamento é acompanhado em /api/jobs/<id>"""
     try:
-        total_alerts = run_daily_alert_checks()
+        # Uma varredura pendente do próprio usuário já cobre o pedido: não enfileirar outra.
+        # Jobs de outros usuários ou do agendador não são reaproveitados (o status só é visível ao dono)
+        job = BackgroundJob.query.filter(
+            BackgroundJob.job_type == 'run_alerts',
+            BackgroundJob.user_id == current_user.id,
+            BackgroundJob.status.in_(['queued', 'running'])
+        ).order_by(BackgroundJob.id).first()
+        if job is None:
+            job = enqueue_job('run_alerts', priority=JOB_PRIORITY_ALERTS, user_id=current_user.id)
+
+        # Resumo por regra da última verificação concluída (o da nova sai no resultado do job)
+        last_run = JobRun.query.filter_by(job_name='daily_alerts', status='succeeded')\
+            .order_by(JobRun.started_at.desc()).first()
         return jsonify({
             'success': True,
-            'alerts_created': total_alerts,
-            'message': f'{total_alerts} alertas verificados/criados com sucesso!'
-        })
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('api_job_status', job_id=job.id),
+            'last_run': last_run.to_dict() if last_run else None,
+            'message': 'Verificação de alertas agendada!'
+        }), 202
     except Exception as e:
         return jsonify({
             'success': False,
-            'message': f'Erro ao executar alertas: {str(e)}'
+            'message': f'Erro ao agendar alertas: {str(e)}'
         }), 500
 
+@app.route('/api/alerts')
+@login_required
+def api_alerts_inbox():
+    """Caixa de entrada de alertas com paginação por cursor (status: active, unread ou all)"""
+    status = request.args.get('status', 'active')
+    if status not in ('active', 'unread', 'all'):
+        return jsonify({'success': False, 'message': 'Status inválido'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', ALERT_INBOX_PAGE_SIZE)), 1), ALERT_INBOX_MAX_PAGE_SIZE)
+        alerts, next_cursor = alert_inbox_page(current_user.id, status, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'alerts': [alert.to_dict() for alert in alerts],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/alerts/bulk', methods=['POST'])
+@login_required
+def api_alerts_bulk():
+    """Marcar como lidos ou dispensar vários alertas (ids) ou todos (all: true) de uma vez"""
+    data = request.get_json(silent=True) or {}
+    alert_ids = None if data.get('all') else data.get('ids')
+    if alert_ids is not None and (not isinstance(alert_ids, list) or not all(type(i) is int for i in alert_ids)):
+        return jsonify({'success': False, 'message': 'Informe ids (lista de inteiros) ou all'}), 400
+    if alert_ids == []:
+        return jsonify({'success': True, 'updated': 0, 'unread_count': unread_alert_count(current_user)})
+
+    try:
+        updated = update_alerts(current_user.id, data.get('action'), alert_ids)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    db.session.refresh(current_user)
+    return jsonify({'success': True, 'updated': updated, 'unread_count': unread_alert_count(current_user)})
+
+@app.route('/api/alerts/unread_count')
+@login_required
+def api_alerts_unread_count():
+    """Contador de não lidos para o badge da navbar (sem COUNT sobre os alertas)"""
+    response = jsonify({'unread_count': unread_alert_count(current_user)})
+    response.headers['Cache-Control'] = 'private, max-age=15'
+    return response
+
+@app.route('/api/cron/periodic')
+def cron_periodic_jobs():
+    """Gatilho do cron da Vercel: executa as tarefas periódicas vencidas sob a trava entre instâncias
+
+    O cron do vercel.json dispara de hora em hora, o menor intervalo entre as tarefas periódicas;
+    cada tarefa só executa quando o próprio intervalo venceu.
+    """
+    cron_secret = os.environ.get('CRON_SECRET')
+    if not cron_secret or request.headers.get('Authorization') != f'Bearer {cron_secret}':
+        return jsonify({'success': False, 'message': 'Não autorizado'}), 401
+
+    runs = run_due_periodic_jobs(trigger='cron')
+    # Sem worker (Vercel): o gatilho também consome os jobs adiados e as novas tentativas
+    processed = run_worker(once=True, max_jobs=CRON_MAX_JOBS, worker_id='cron', schedule=False)
+    return jsonify({'success': True, 'runs': [run.to_dict() for run in runs], 'jobs_processed': processed})
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job_status(job_id):
+    """Status de um job em segundo plano (do próprio usuário ou qualquer um para admins)"""
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or (job.user_id != current_user.id and not current_user.is_admin()):
+        return jsonify({'success': False, 'message': 'Job não encontrado'}), 404
+
+    data = job.to_dict()
+    if job.status == 'succeeded' and job.result_file is not None:
+        data['download_url'] = url_for('api_job_download', job_id=job.id)
+    return jsonify({'success': True, 'job': data})
+
+@app.route('/api/jobs/<int:job_id>/download')
+@login_required
+def api_job_download(job_id):
+    """Arquivo gerado por um job concluído (relatórios)"""
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or (job.user_id != current_user.id and not current_user.is_admin()):
+        return jsonify({'success': False, 'message': 'Job não encontrado'}), 404
+    if job.status != 'succeeded' or job.result_file is None:
+        return jsonify({'success': False, 'message': 'Arquivo ainda não disponível'}), 409
+
+    return send_file(
+        io.BytesIO(job.result_file),
+        as_attachment=True,
+        download_name=job.result['filename'],
+        mimetype=job.result['mimetype']
+    )
+
 @app.route('/capture-lead', methods=['POST'])
 def capture_lead():
     """Captura leads do formulário da landing page"""
@@ -4836,7 +7073,7 @@ def api_ai_maintenance():
                 {
                     "date": record.date.isoformat(),
                     "odometer": record.odometer,
-                    "fuel_consumption": record.consumption() if hasattr(record, 'consumption') else None,
+                    "fuel_consumption": record.consumption,
                     "liters": float(record.liters),
                     "total_cost": float(record.total_cost)
                 }
@@ -5022,21 +7259,25 @@ def api_monthly_data():
             cutoff_date = datetime.now() - timedelta(days=days)
             query = query.filter(FuelRecord.date >= cutoff_date.date())
         
-        records = query.order_by(FuelRecord.date.desc()).all()
-        
-        # Agrupar por mês
-        monthly_data = {}
-        for record in records:
-            month_key = record.date.strftime("%Y-%m")
-            if month_key not in monthly_data:
-                monthly_data[month_key] = 0
-            monthly_data[month_key] += float(record.total_cost)
-        
-        # Converter para formato do gráfico (últimos 12 meses)
-        from datetime import datetime
+        # Agrupar por mês no banco (apenas os últimos 12 meses são exibidos)
         import calendar
         
         current_date = datetime.now()
+        first_month = current_date.month - 11
+        first_year = current_date.year
+        while first_month <= 0:
+            first_month += 12
+            first_year -= 1
+        
+        month_bucket = time_bucket(FuelRecord.date, 'month')
+        monthly_data = {
+            month_key: float(total or 0)
+            for month_key, total in query.filter(
+                FuelRecord.date >= datetime(first_year, first_month, 1).date()
+            ).with_entities(month_bucket, db.func.sum(FuelRecord.total_cost)).group_by(month_bucket).all()
+        }
+        
+        # Converter para formato do gráfico (últimos 12 meses)
         labels = []
         data = []
         
@@ -5050,7 +7291,7 @@ def api_monthly_data():
                 year -= 1
                 
             month_date = datetime(year, month, 1)
-            month_key = month_date.strftime("%Y-%m")
+            month_key = bucket_key(month_date, 'month')
             month_label = f"{calendar.month_abbr[month_date.month]}/{month_date.year}"
             
             labels.append(month_label)
@@ -5134,6 +7375,33 @@ def create_tables():
             # Migrar campos de admin se necessário
             migrate_user_admin_fields()
 
+            # Migrar segmentos de consumo dos abastecimentos
+            migrate_fuel_segment_fields()
+
+            # Calcular o estado incremental de consumo dos veículos
+            migrate_consumption_states()
+
+            # Migrar versão de dados usada pelo cache do dashboard
+            migrate_dashboard_cache_fields()
+
+            # Migrar chave de deduplicação dos alertas
+            migrate_alert_dedup_fields()
+
+            # Criar índices das consultas mais frequentes (inclui a chave única dos alertas)
+            migrate_performance_indexes()
+
+            # Contadores de alertas não lidos de usuários e frotas
+            migrate_alert_counter_fields()
+
+            # Versão das frotas usada pelo snapshot do ranking
+            migrate_ranking_snapshot_fields()
+
+            # Rollup diário dos abastecimentos das frotas
+            migrate_fleet_rollups()
+
+            # Contadores de veículos e membros ativos das frotas
+            migrate_fleet_counter_fields()
+
     except Exception as e:
         print(f"Erro ao criar tabelas: {e}")
 
@@ -5223,6 +7491,260 @@ def migrate_user_admin_fields():
         import traceback
         traceback.print_exc()
 
+def migrate_fuel_segment_fields():
+    """Adiciona as colunas de segmento em fuel_records e preenche o histórico"""
+    try:
+        print("Verificando colunas de segmento na tabela fuel_records...")
+
+        columns_to_add = [
+            ("kilometers", "FLOAT"),
+            ("consumption", "FLOAT"),
+            ("cost_per_km", "FLOAT")
+        ]
+
+        added_columns = 0
+        for column_name, column_definition in columns_to_add:
+            try:
+                with db.engine.connect() as conn:
+                    trans = conn.begin()
+                    try:
+                        conn.execute(db.text(f"ALTER TABLE fuel_records ADD COLUMN {column_name} {column_definition}"))
+                        trans.commit()
+                        added_columns += 1
+                        print(f"  + Coluna {column_name} adicionada")
+                    except Exception as e:
+                        trans.rollback()
+                        if "already exists" in str(e) or "duplicate column" in str(e).lower():
+                            print(f"  - {column_name} ja existe")
+                        else:
+                            print(f"  ! Erro ao adicionar {column_name}: {e}")
+            except Exception as e:
+                print(f"  ! Erro na conexao para {column_name}: {e}")
+
+        if added_columns:
+            updated = backfill_fuel_segments()
+            print(f"  + {updated} segmentos de abastecimento calculados")
+        else:
+            # Segmentos gravados antes do limite MAX_SEGMENT_KM valer também para os armazenados
+            vehicle_ids = [row[0] for row in db.session.query(FuelRecord.vehicle_id)
+                           .filter(FuelRecord.kilometers > MAX_SEGMENT_KM).distinct()]
+            if vehicle_ids:
+                updated = backfill_fuel_segments(vehicle_ids)
+                print(f"  + {updated} segmentos recalculados com o limite de {MAX_SEGMENT_KM} km")
+
+        print("Migracao de segmentos concluida!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro na migracao de segmentos: {e}")
+
+def migrate_consumption_states():
+    """Preenche vehicle_consumption_states em bancos que já tinham abastecimentos"""
+    try:
+        print("Verificando estado de consumo dos veículos...")
+        if VehicleConsumptionState.query.first() is None and FuelRecord.query.first() is not None:
+            updated = rebuild_consumption_states()
+            db.session.commit()
+            print(f"  + Estado de consumo calculado para {updated} veiculos")
+        else:
+            print("  - Estado de consumo ja calculado")
+
+        print("Migracao de estado de consumo concluida!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro na migracao de estado de consumo: {e}")
+
+def migrate_dashboard_cache_fields():
+    """Adiciona users.data_version, usada para invalidar o cache do dashboard"""
+    try:
+        print("Verificando coluna data_version na tabela users...")
+        try:
+            with db.engine.connect() as conn:
+                trans = conn.begin()
+                try:
+                    conn.execute(db.text("ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"))
+                    trans.commit()
+                    print("  + Coluna data_version adicionada")
+                except Exception as e:
+                    trans.rollback()
+                    if "already exists" in str(e) or "duplicate column" in str(e).lower():
+                        print("  - data_version ja existe")
+                    else:
+                        print(f"  ! Erro ao adicionar data_version: {e}")
+        except Exception as e:
+            print(f"  ! Erro na conexao para data_version: {e}")
+
+        print("Migracao do cache do dashboard concluida!")
+
+    except Exception as e:
+        print(f"Erro na migracao do cache do dashboard: {e}")
+
+def migrate_alert_dedup_fields():
+    """Adiciona alerts.dedup_bucket; o índice único é criado por migrate_performance_indexes"""
+    try:
+        print("Verificando coluna dedup_bucket na tabela alerts...")
+        try:
+            with db.engine.connect() as conn:
+                trans = conn.begin()
+                try:
+                    conn.execute(db.text("ALTER TABLE alerts ADD COLUMN dedup_bucket INTEGER"))
+                    trans.commit()
+                    print("  + Coluna dedup_bucket adicionada")
+                except Exception as e:
+                    trans.rollback()
+                    if "already exists" in str(e) or "duplicate column" in str(e).lower():
+                        print("  - dedup_bucket ja existe")
+                    else:
+                        print(f"  ! Erro ao adicionar dedup_bucket: {e}")
+        except Exception as e:
+            print(f"  ! Erro na conexao para dedup_bucket: {e}")
+
+        # Alertas dispensados saem da chave única (vehicle_id, alert_type, dedup_bucket)
+        released = db.session.execute(
+            db.update(Alert).where(Alert.is_active == False, Alert.dedup_bucket.isnot(None)).values(dedup_bucket=None)
+        ).rowcount
+        db.session.commit()
+        if released:
+            print(f"  + {released} alertas dispensados liberados da deduplicacao")
+
+        print("Migracao de deduplicacao de alertas concluida!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro na migracao de deduplicacao de alertas: {e}")
+
+def migrate_alert_counter_fields():
+    """Adiciona users/fleets.unread_alerts_count e calcula os valores a partir dos alertas"""
+    try:
+        print("Verificando contadores de alertas nao lidos...")
+        for table in ('users', 'fleets'):
+            try:
+                with db.engine.connect() as conn:
+                    trans = conn.begin()
+                    try:
+                        conn.execute(db.text(f"ALTER TABLE {table} ADD COLUMN unread_alerts_count INTEGER NOT NULL DEFAULT 0"))
+                        trans.commit()
+                        print(f"  + Coluna {table}.unread_alerts_count adicionada")
+                    except Exception as e:
+                        trans.rollback()
+                        if "already exists" in str(e) or "duplicate column" in str(e).lower():
+                            print(f"  - {table}.unread_alerts_count ja existe")
+                        else:
+                            print(f"  ! Erro ao adicionar {table}.unread_alerts_count: {e}")
+            except Exception as e:
+                print(f"  ! Erro na conexao para {table}.unread_alerts_count: {e}")
+
+        reconcile_unread_alert_counters()
+        print("Migracao dos contadores de alertas concluida!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro na migracao dos contadores de alertas: {e}")
+
+def migrate_ranking_snapshot_fields():
+    """Adiciona fleets.ranking_version, usada para invalidar o snapshot do ranking"""
+    try:
+        print("Verificando coluna ranking_version na tabela fleets...")
+        try:
+            with db.engine.connect() as conn:
+                trans = conn.begin()
+                try:
+                    conn.execute(db.text("ALTER TABLE fleets ADD COLUMN ranking_version INTEGER NOT NULL DEFAULT 0"))
+                    trans.commit()
+                    print("  + Coluna ranking_version adicionada")
+                except Exception as e:
+                    trans.rollback()
+                    if "already exists" in str(e) or "duplicate column" in str(e).lower():
+                        print("  - ranking_version ja existe")
+                    else:
+                        print(f"  ! Erro ao adicionar ranking_version: {e}")
+        except Exception as e:
+            print(f"  ! Erro na conexao para ranking_version: {e}")
+
+        print("Migracao do snapshot do ranking concluida!")
+
+    except Exception as e:
+        print(f"Erro na migracao do snapshot do ranking: {e}")
+
+def migrate_fleet_rollups():
+    """Preenche o rollup diário das frotas na primeira execução (tabela criada pelo create_all)"""
+    try:
+        print("Verificando rollup diario das frotas...")
+        if FleetDailyRollup.query.first() is not None:
+            print("  - Rollup ja preenchido")
+            return
+        vehicles = rebuild_fleet_rollups()
+        print(f"  + Rollup calculado para {vehicles} veiculos de frota")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro na migracao do rollup das frotas: {e}")
+
+def migrate_fleet_counter_fields():
+    """Adiciona fleets.active_vehicles_count/active_members_count e calcula os valores atuais"""
+    try:
+        print("Verificando contadores de veiculos e membros das frotas...")
+        for column in ('active_vehicles_count', 'active_members_count'):
+            try:
+                with db.engine.connect() as conn:
+                    trans = conn.begin()
+                    try:
+                        conn.execute(db.text(f"ALTER TABLE fleets ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+                        trans.commit()
+                        print(f"  + Coluna fleets.{column} adicionada")
+                    except Exception as e:
+                        trans.rollback()
+                        if "already exists" in str(e) or "duplicate column" in str(e).lower():
+                            print(f"  - fleets.{column} ja existe")
+                        else:
+                            print(f"  ! Erro ao adicionar fleets.{column}: {e}")
+            except Exception as e:
+                print(f"  ! Erro na conexao para fleets.{column}: {e}")
+
+        reconcile_fleet_counters()
+        print("Migracao dos contadores das frotas concluida!")
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro na migracao dos contadores das frotas: {e}")
+
+def create_index_online(index):
+    """Cria o índice se não existir sem travar escritas na tabela
+
+    No PostgreSQL usa CREATE INDEX CONCURRENTLY IF NOT EXISTS, que não pode rodar dentro de
+    transação (conexão em autocommit); nos demais bancos, o CREATE INDEX comum.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        index.create(bind=db.engine, checkfirst=True)
+        return
+
+    columns = ', '.join(column.name for column in index.columns)
+    unique = 'UNIQUE ' if index.unique else ''
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(db.text(
+            f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {index.table.name} ({columns})"
+        ))
+
+def migrate_performance_indexes():
+    """Cria em bancos existentes os índices compostos declarados nos modelos"""
+    try:
+        print("Verificando índices das tabelas principais...")
+
+        for model in (FuelRecord, Alert, Vehicle, FleetMember):
+            for index in model.__table__.indexes:
+                try:
+                    create_index_online(index)
+                    print(f"  + Indice {index.name} verificado")
+                except Exception as e:
+                    # CONCURRENTLY interrompido deixa o índice inválido: remover com DROP INDEX CONCURRENTLY
+                    print(f"  ! Erro ao criar indice {index.name}: {e}")
+
+        print("Migracao de indices concluida!")
+
+    except Exception as e:
+        print(f"Erro na migracao de indices: {e}")
+
 # === ENDPOINT DE RECONHECIMENTO DE VOZ ===
 
 @app.route('/api/ai/voice-command', methods=['POST'])
@@ -5250,10 +7772,10 @@ def api_voice_command():
         
         # Processar ação sugerida
         if result['acao_sugerida'] == 'salvar_abastecimento':
-            success = process_fuel_record_from_voice(result['dados_extraidos'], current_user.id)
+            success, message = process_fuel_record_from_voice(result['dados_extraidos'], current_user.id)
             return jsonify({
                 "success": success,
-                "message": result['mensagem_usuario'],
+                "message": result['mensagem_usuario'] if success else message,
                 "data": result['dados_extraidos'] if success else None,
                 "data_saved": success
             })
@@ -5291,16 +7813,20 @@ def api_voice_command():
 
 
 def process_fuel_record_from_voice(dados, user_id):
-    """Helper para salvar registro de combustível extraído da voz"""
+    """Helper para salvar registro de combustível extraído da voz; retorna (sucesso, mensagem)"""
     try:
         # Validar dados mínimos necessários
         if not dados.get('valor') or not dados.get('tipo_combustivel'):
-            return False
+            return False, "Informe o valor e o tipo de combustível"
+        
+        # Sem quilometragem o trecho até o próximo abastecimento seria calculado a partir do km 0
+        if not dados.get('quilometragem'):
+            return False, "Informe a quilometragem do veículo para registrar o abastecimento"
         
         # Obter veículo padrão do usuário (primeiro veículo)
         vehicle = Vehicle.query.filter_by(user_id=user_id).first()
         if not vehicle:
-            return False
+            return False, "Nenhum veículo encontrado"
         
         # Processar data
         data_abastecimento = datetime.now().date()
@@ -5337,18 +7863,20 @@ def process_fuel_record_from_voice(dados, user_id):
             price_per_liter=round(preco_por_litro, 3),
             total_cost=round(dados['valor'], 2),
             gas_station=dados.get('posto', 'Não informado'),
-            odometer_reading=dados.get('quilometragem'),
+            odometer=dados['quilometragem'],
             notes=f"Criado por comando de voz: {dados.get('descricao', '')}"
         )
         
         db.session.add(fuel_record)
+        db.session.flush()
+        refresh_fuel_segments(vehicle.id, (fuel_record.odometer, fuel_record.id))
         db.session.commit()
-        return True
+        return True, "Abastecimento registrado"
 
     except Exception as e:
         print(f"Erro ao salvar registro de voz: {e}")
         db.session.rollback()
-        return False
+        return False, "Erro ao salvar o abastecimento"
 
 # === ROTAS ADMINISTRATIVAS (SUPER ADMIN) ===
 
@@ -5395,6 +7923,17 @@ def admin_dashboard():
 
     return render_template('admin/dashboard.html', stats=stats)
 
+@app.route('/admin/job_runs')
+@admin_required
+def admin_job_runs():
+    """Últimas execuções das tarefas periódicas (JSON)"""
+    query = JobRun.query
+    if request.args.get('name'):
+        query = query.filter_by(job_name=request.args['name'])
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    runs = query.order_by(JobRun.started_at.desc()).limit(limit).all()
+    return jsonify({'success': True, 'runs': [run.to_dict() for run in runs]})
+
 @app.route('/admin/users')
 @login_required
 @super_admin_required
@@ -5690,7 +8229,7 @@ def admin_add_client():
             db.session.commit()
 
             # Enviar email de boas-vindas
-            send_welcome_email(email, name, temp_password, 'pf', account_plan)
+            send_client_welcome_email(email, name, temp_password, 'pf', account_plan)
 
             flash(f'Usuário PF {name} criado com sucesso! Email enviado para {email}', 'success')
 
@@ -5750,7 +8289,7 @@ def admin_add_client():
             db.session.commit()
 
             # Enviar email de boas-vindas
-            send_welcome_email(email, name, temp_password, 'frota', account_plan)
+            send_client_welcome_email(email, name, temp_password, 'frota', account_plan)
 
             flash(f'Frota {name} criada com sucesso! Email enviado para {email}', 'success')
 
@@ -5791,7 +8330,7 @@ def get_premium_features(account_plan):
             'custom_branding': False
         }
 
-def send_welcome_email(email, name, password, client_type, account_plan):
+def send_client_welcome_email(email, name, password, client_type, account_plan):
     """Enviar email de boas-vindas para novo cliente"""
     try:
         # Por enquanto, apenas simular o envio (log)
@@ -5883,6 +8422,67 @@ def create_super_admin():
             'message': f'Erro ao criar super admin: {str(e)}'
         })
 
+# === COMANDOS CLI ===
+
+@app.cli.command('seed')
+@click.option('--users', default=10, show_default=True, help='Usuários pessoais')
+@click.option('--fleets', default=1, show_default=True, help='Frotas empresariais')
+@click.option('--vehicles', default=10, show_default=True, help='Veículos por frota')
+@click.option('--user-vehicles', default=2, show_default=True, help='Carros por usuário pessoal')
+@click.option('--years', default=1, show_default=True, help='Anos de histórico por veículo')
+@click.option('--seed', default=None, type=int, help='Semente para dados reproduzíveis')
+@click.option('--batch-size', default=5000, show_default=True, help='Linhas por INSERT em lote')
+def seed_command(users, fleets, vehicles, user_vehicles, years, seed, batch_size):
+    """Popula o banco com dados sintéticos para testes de carga"""
+    from seed_data import seed_database
+
+    summary = seed_database(users=users, fleets=fleets, vehicles=vehicles, user_vehicles=user_vehicles,
+                            years=years, seed=seed, batch_size=batch_size)
+    print("[SEED] ✅ Dados sintéticos criados:")
+    for key in ('users', 'fleets', 'vehicles', 'fuel_records', 'maintenance_records', 'alerts'):
+        print(f"  {key}: {summary[key]}")
+    print(f"[SEED] Senha de todas as contas: {summary['password']}")
+    if summary['fleet_owner_usernames']:
+        print(f"[SEED] Dono da primeira frota: {summary['fleet_owner_usernames'][0]}")
+
+@app.cli.command('run-alerts')
+@click.option('--workers', default=None, type=int, help='Processos em paralelo (padrão: ALERT_WORKERS)')
+@click.option('--full', is_flag=True, help='Todas as regras, não só as de tempo (ex.: após importação em lote)')
+def run_alerts_command(workers, full):
+    """Executa a verificação diária de alertas, em shards paralelos se configurado"""
+    def run_checks():
+        started = time.perf_counter()
+        reports = run_sharded_alert_checks(workers, rules=daily_alert_rules(full))
+        print_shard_report(reports)
+        stats = merge_shard_stats(reports)
+        print_alert_stats(stats)
+        total = sum(report['alerts_created'] for report in reports)
+        print(f"[ALERT] ✅ {total} alertas criados em {len(reports)} shards ({time.perf_counter() - started:.2f}s)")
+        return {'alerts_created': total, 'stats': stats}
+
+    # Mesma trava da execução agendada: nunca duas verificações ao mesmo tempo
+    run_exclusive('daily_alerts', run_checks, trigger='cli',
+                  lease_seconds=periodic_jobs['daily_alerts']['lease_seconds'])
+
+@app.cli.command('run-periodic')
+@click.argument('names', nargs=-1)
+def run_periodic_command(names):
+    """Executa as tarefas periódicas vencidas (todas ou as informadas), ex.: a partir do cron"""
+    unknown = [name for name in names if name not in periodic_jobs]
+    if unknown:
+        raise click.BadParameter(f"Tarefas desconhecidas: {', '.join(unknown)}")
+    runs = run_due_periodic_jobs(trigger='cli', names=names or None)
+    print(f"[SCHEDULER] {len(runs)} tarefas executadas")
+
+@app.cli.command('worker')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Segundos entre consultas com a fila vazia')
+@click.option('--once', is_flag=True, help='Executa os jobs pendentes e sai')
+@click.option('--max-jobs', default=None, type=int, help='Sai após executar este número de jobs')
+@click.option('--no-schedule', is_flag=True, help='Não executa as tarefas periódicas (só a fila)')
+def worker_command(poll_interval, once, max_jobs, no_schedule):
+    """Executa os jobs em segundo plano (alertas, relatórios e emails) e as tarefas periódicas"""
+    run_worker(poll_interval=poll_interval, once=once, max_jobs=max_jobs, schedule=not no_schedule)
+
 # Para desenvolvimento local
 if __name__ == '__main__':
     create_tables()
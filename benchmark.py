@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de Desempenho - Rodo Stats
+Desenvolvido por InovaMente Labs
+
+Popula um banco dedicado com o seeder em vários tamanhos e mede as rotas e
+rotinas mais pesadas: tempo, número de consultas SQL e pico de memória.
+
+Uso:
+    python benchmark.py --sizes small,medium --output benchmark_results.json
+    python benchmark.py --sizes small --baseline benchmark_results.json
+
+ATENÇÃO: o banco informado em --database-url é apagado e recriado.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from query_counter import QueryCounter
+
+# Tamanhos de dados (parâmetros de seed_database)
+BENCHMARK_SIZES = {
+    'tiny': {'users': 2, 'fleets': 1, 'vehicles': 3, 'user_vehicles': 1, 'years': 1},
+    'small': {'users': 10, 'fleets': 1, 'vehicles': 10, 'user_vehicles': 2, 'years': 1},
+    'medium': {'users': 50, 'fleets': 2, 'vehicles': 40, 'user_vehicles': 2, 'years': 2},
+    'large': {'users': 200, 'fleets': 4, 'vehicles': 150, 'user_vehicles': 2, 'years': 3}
+}
+
+# Variação tolerada em relação ao baseline antes de apontar regressão
+DEFAULT_TOLERANCE = 0.25
+
+
+def measure(engine, target, func):
+    """Executa func medindo tempo, consultas e pico de memória"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    status = 'ok'
+    counter_count = None
+    try:
+        with QueryCounter(engine) as counter:
+            result = func()
+        if hasattr(result, 'status_code'):
+            status = str(result.status_code)
+    except Exception as e:
+        status = f'erro: {type(e).__name__}: {e}'
+    else:
+        counter_count = counter.count
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'target': target,
+        'status': status,
+        'seconds': round(elapsed, 4),
+        'queries': counter_count,
+        'peak_memory_kb': round(peak / 1024, 1)
+    }
+
+
+def run_size(size_name, params, seed=42, app=None):
+    """Recria o banco, popula com os parâmetros e mede todos os alvos"""
+    from app import db, Fleet, FleetMember, User, Vehicle, run_daily_alert_checks
+    from report_generator import generate_fleet_reports
+    from seed_data import seed_database
+
+    if app is None:
+        from app import app
+
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['ALERT_EMAIL_MODE'] = 'off'  # Usuários sintéticos não recebem emails
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        summary = seed_database(seed=seed, **params)
+        engine = db.engine
+
+        owner = User.query.filter_by(username=summary['fleet_owner_usernames'][0]).one()
+        fleet = FleetMember.query.filter_by(user_id=owner.id).one().fleet
+        fleet_id = fleet.id
+        vehicle_id = Vehicle.query.filter_by(fleet_id=fleet_id).order_by(Vehicle.id).first().id
+
+    client = app.test_client()
+    client.post('/login', data={'username': summary['fleet_owner_usernames'][0], 'password': summary['password']})
+
+    def generate_reports():
+        with app.app_context():
+            return generate_fleet_reports(db.session.get(Fleet, fleet_id), 30)
+
+    def alert_checks():
+        with app.app_context():
+            return run_daily_alert_checks()
+
+    targets = [
+        ('/dashboard', lambda: client.get('/dashboard')),
+        ('/dashboard (cache)', lambda: client.get('/dashboard')),
+        ('/vehicle/<id>', lambda: client.get(f'/vehicle/{vehicle_id}')),
+        ('/fleet/dashboard', lambda: client.get('/fleet/dashboard')),
+        ('/fleet/ranking', lambda: client.get('/fleet/ranking')),
+        ('/export_data', lambda: client.get('/export_data')),
+        ('generate_fleet_reports', generate_reports),
+        ('run_daily_alert_checks', alert_checks)
+    ]
+
+    results = []
+    for target, func in targets:
+        row = measure(engine, target, func)
+        row.update({
+            'size': size_name,
+            'fuel_records': summary['fuel_records'],
+            'vehicles': summary['vehicles']
+        })
+        results.append(row)
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Lista as medições que pioraram além da tolerância em relação ao baseline"""
+    previous = {(row['size'], row['target']): row for row in baseline}
+    regressions = []
+    for row in results:
+        old = previous.get((row['size'], row['target']))
+        if not old:
+            continue
+        if old.get('queries') is not None and row.get('queries') is not None and row['queries'] > old['queries']:
+            regressions.append(f"{row['size']} {row['target']}: consultas {old['queries']} -> {row['queries']}")
+        if old['seconds'] > 0 and row['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append(f"{row['size']} {row['target']}: tempo {old['seconds']}s -> {row['seconds']}s")
+        if old['status'] == 'ok' or old['status'].isdigit():
+            if row['status'] != old['status']:
+                regressions.append(f"{row['size']} {row['target']}: status {old['status']} -> {row['status']}")
+    return regressions
+
+
+def print_results(results):
+    """Imprime a tabela de resultados"""
+    print(f"{'tamanho':<8} {'alvo':<24} {'status':<8} {'tempo (s)':>10} {'consultas':>10} {'memória (KB)':>13}")
+    for row in results:
+        queries = row['queries'] if row['queries'] is not None else '-'
+        print(f"{row['size']:<8} {row['target']:<24} {row['status'][:8]:<8} "
+              f"{row['seconds']:>10.4f} {queries:>10} {row['peak_memory_kb']:>13.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark das rotas e rotinas mais pesadas do Rodo Stats')
+    parser.add_argument('--sizes', default='small', help=f"Tamanhos separados por vírgula: {', '.join(BENCHMARK_SIZES)}")
+    parser.add_argument('--database-url', default=None,
+                        help='Banco dedicado ao benchmark (padrão: SQLite temporário). SERÁ APAGADO.')
+    parser.add_argument('--output', default=None, help='Arquivo JSON para gravar os resultados')
+    parser.add_argument('--baseline', default=None, help='Resultados anteriores para detectar regressões')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Variação de tempo tolerada')
+    parser.add_argument('--seed', type=int, default=42, help='Semente do gerador de dados')
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in BENCHMARK_SIZES]
+    if unknown:
+        parser.error(f"Tamanhos desconhecidos: {', '.join(unknown)}")
+
+    # O app lê DATABASE_URL na importação: configurar antes de importar
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('SESSION_SECRET', 'benchmark-secret')
+    os.environ['DASHBOARD_CACHE_ENABLED'] = 'true'
+
+    results = []
+    for size in sizes:
+        print(f"[BENCHMARK] Tamanho {size}: {BENCHMARK_SIZES[size]}", file=sys.stderr)
+        results.extend(run_size(size, BENCHMARK_SIZES[size], seed=args.seed))
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"[BENCHMARK] Resultados gravados em {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("[BENCHMARK] ❌ Regressões encontradas:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print("[BENCHMARK] ✅ Nenhuma regressão em relação ao baseline")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Estatísticas de Eficiência de Combustível - Rodo Stats
+Desenvolvido por InovaMente Labs
+
+Kernel vetorizado (NumPy) compartilhado por todas as telas que calculam
+consumo: recebe as colunas dos abastecimentos e devolve as métricas de cada
+veículo em uma única passada.
+"""
+
+import math
+
+import numpy as np
+
+# Ordem dos trechos: (veículo, odômetro, id), a mesma dos segmentos armazenados em fuel_records.
+# Regras de validação de um trecho entre dois abastecimentos
+MAX_SEGMENT_KM = 2000       # Distância máxima aceita por abastecimento
+MIN_CONSUMPTION = 3         # km/L mínimo realista
+MAX_CONSUMPTION = 25        # km/L máximo realista
+TREND_SAMPLE = 3            # Abastecimentos comparados no início e no fim
+TREND_THRESHOLD = 0.05      # Variação mínima para indicar tendência
+
+# Médias móveis exponenciais do detector de anomalias
+CONSUMPTION_EWMA_ALPHA = 0.05  # Peso de cada abastecimento na média histórica (~20 abastecimentos)
+RECENT_EWMA_ALPHA = 0.5        # Peso na média recente (~3 últimos abastecimentos)
+
+
+def empty_efficiency():
+    """Métricas de um veículo sem dados suficientes"""
+    return {
+        'average_consumption': 0,
+        'best_consumption': 0,
+        'worst_consumption': 0,
+        'trend': 'stable',
+        'has_data': False,
+        'total_records': 0,
+        'consumption_count': 0,
+        'consumption_sum': 0.0,
+        'total_km': 0.0,
+        'km_in_window': 0.0,
+        'segment_cost': 0.0,
+        'cost_per_km': 0
+    }
+
+
+def valid_segment(odometer, previous_odometer):
+    """Trecho entre dois abastecimentos: odômetros informados e distância positiva até MAX_SEGMENT_KM
+
+    Aceita valores escalares ou arrays NumPy; é a regra usada tanto pelo kernel
+    quanto pelos segmentos armazenados (quilometragem e custo/km somam só estes trechos).
+    """
+    return ((odometer > 0) & (previous_odometer > 0) & (odometer > previous_odometer)
+            & (odometer - previous_odometer <= MAX_SEGMENT_KM))
+
+
+def consumption_in_range(kilometers, consumption):
+    """Trecho com distância e consumo dentro dos limites
+
+    Aceita arrays NumPy ou colunas SQLAlchemy (o mesmo predicado vira o filtro SQL).
+    """
+    return (kilometers <= MAX_SEGMENT_KM) & (consumption >= MIN_CONSUMPTION) & (consumption <= MAX_CONSUMPTION)
+
+
+def _segments(vehicle_ids, dates, odometers, liters, costs):
+    """Ordena as colunas por (veículo, odômetro) e calcula os trechos
+
+    A ordenação é estável: empates de odômetro mantêm a ordem de entrada
+    (fuel_record_columns entrega as linhas ordenadas por id).
+    """
+    vehicle_ids = np.asarray(vehicle_ids, dtype=np.int64)
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    odometers = np.asarray(odometers, dtype=np.float64)
+    liters = np.asarray(liters, dtype=np.float64)
+    costs = np.asarray(costs, dtype=np.float64)
+
+    order = np.lexsort((odometers, vehicle_ids))
+    vehicle_ids, dates = vehicle_ids[order], dates[order]
+    odometers, liters, costs = odometers[order], liters[order], costs[order]
+
+    # Trecho i: do abastecimento i-1 ao i, apenas dentro do mesmo veículo
+    same_vehicle = np.zeros(len(order), dtype=bool)
+    same_vehicle[1:] = vehicle_ids[1:] == vehicle_ids[:-1]
+
+    distance = np.zeros(len(order))
+    distance[1:] = odometers[1:] - odometers[:-1]
+
+    previous_odometer = np.zeros(len(order))
+    previous_odometer[1:] = odometers[:-1]
+
+    valid_distance = same_vehicle & valid_segment(odometers, previous_odometer)
+
+    consumption = np.zeros(len(order))
+    has_liters = valid_distance & (liters > 0)
+    consumption[has_liters] = distance[has_liters] / liters[has_liters]
+    valid_consumption = has_liters & consumption_in_range(distance, consumption)
+
+    return {
+        'order': order,
+        'vehicle_ids': vehicle_ids,
+        'dates': dates,
+        'costs': costs,
+        'distance': distance,
+        'consumption': consumption,
+        'valid_distance': valid_distance,
+        'valid_consumption': valid_consumption
+    }
+
+
+def compute_efficiency_stats(vehicle_ids, dates, odometers, liters, costs, window_start=None):
+    """Calcula as métricas de eficiência de cada veículo em uma única passada
+
+    As colunas são sequências paralelas (um item por abastecimento), em
+    qualquer ordem. Retorna {vehicle_id: métricas}; veículos sem nenhum
+    trecho válido recebem as métricas de empty_efficiency().
+    """
+    if len(vehicle_ids) == 0:
+        return {}
+
+    seg = _segments(vehicle_ids, dates, odometers, liters, costs)
+    unique_ids, group, record_counts = np.unique(seg['vehicle_ids'], return_inverse=True, return_counts=True)
+    n_groups = len(unique_ids)
+
+    distance = np.where(seg['valid_distance'], seg['distance'], 0.0)
+    total_km = np.bincount(group, weights=distance, minlength=n_groups)
+    segment_cost = np.bincount(group, weights=np.where(seg['valid_distance'], seg['costs'], 0.0),
+                               minlength=n_groups)
+
+    if window_start is not None:
+        in_window = seg['dates'] >= np.datetime64(window_start, 'D')
+        km_in_window = np.bincount(group, weights=np.where(in_window, distance, 0.0), minlength=n_groups)
+    else:
+        km_in_window = total_km
+
+    # Consumos válidos, ainda ordenados por veículo e odômetro
+    valid = seg['valid_consumption']
+    valid_group = group[valid]
+    valid_consumption = seg['consumption'][valid]
+    count = np.bincount(valid_group, minlength=n_groups)
+    consumption_sum = np.bincount(valid_group, weights=valid_consumption, minlength=n_groups)
+
+    best = np.zeros(n_groups)
+    worst = np.zeros(n_groups)
+    trend_first = np.zeros(n_groups)
+    trend_last = np.zeros(n_groups)
+    if len(valid_consumption):
+        starts = np.flatnonzero(np.r_[True, valid_group[1:] != valid_group[:-1]])
+        present = valid_group[starts]
+        best[present] = np.maximum.reduceat(valid_consumption, starts)
+        worst[present] = np.minimum.reduceat(valid_consumption, starts)
+
+        # Posição de cada consumo dentro do seu veículo
+        group_start = np.zeros(n_groups, dtype=np.int64)
+        group_start[present] = starts
+        rank = np.arange(len(valid_consumption)) - group_start[valid_group]
+        first = rank < TREND_SAMPLE
+        last = rank >= count[valid_group] - TREND_SAMPLE
+        trend_first = np.bincount(valid_group[first], weights=valid_consumption[first], minlength=n_groups)
+        trend_last = np.bincount(valid_group[last], weights=valid_consumption[last], minlength=n_groups)
+
+    stats = {}
+    for index, vehicle_id in enumerate(unique_ids.tolist()):
+        vehicle_stats = empty_efficiency()
+        vehicle_stats.update({
+            'total_records': int(record_counts[index]),
+            'total_km': float(total_km[index]),
+            'km_in_window': float(km_in_window[index]),
+            'segment_cost': float(segment_cost[index]),
+            'cost_per_km': float(segment_cost[index] / total_km[index]) if total_km[index] > 0 else 0
+        })
+
+        if count[index]:
+            trend = 'stable'
+            if count[index] >= 2 * TREND_SAMPLE:
+                first_avg = trend_first[index] / TREND_SAMPLE
+                last_avg = trend_last[index] / TREND_SAMPLE
+                if last_avg > first_avg * (1 + TREND_THRESHOLD):
+                    trend = 'improving'
+                elif last_avg < first_avg * (1 - TREND_THRESHOLD):
+                    trend = 'worsening'
+
+            vehicle_stats.update({
+                'average_consumption': float(consumption_sum[index] / count[index]),
+                'best_consumption': float(best[index]),
+                'worst_consumption': float(worst[index]),
+                'trend': trend,
+                'has_data': True,
+                'consumption_count': int(count[index]),
+                'consumption_sum': float(consumption_sum[index])
+            })
+
+        stats[vehicle_id] = vehicle_stats
+
+    return stats
+
+
+def compute_consumption_series(vehicle_ids, dates, odometers, liters, costs):
+    """Retorna {vehicle_id: [(data, km/L), ...]} com os consumos válidos em ordem cronológica"""
+    if len(vehicle_ids) == 0:
+        return {}
+
+    seg = _segments(vehicle_ids, dates, odometers, liters, costs)
+    valid = seg['valid_consumption']
+
+    series = {}
+    for vehicle_id, day, consumption in zip(seg['vehicle_ids'][valid].tolist(),
+                                            seg['dates'][valid].tolist(),
+                                            seg['consumption'][valid].tolist()):
+        series.setdefault(vehicle_id, []).append((day, consumption))
+    for points in series.values():
+        points.sort(key=lambda point: point[0])
+    return series
+
+
+def summarize_efficiency(stats):
+    """Consolida as métricas de vários veículos (média ponderada pelos trechos válidos)"""
+    summary = empty_efficiency()
+    vehicles = list(stats.values())
+    if not vehicles:
+        return summary
+
+    count = sum(v['consumption_count'] for v in vehicles)
+    consumption_sum = sum(v['consumption_sum'] for v in vehicles)
+    total_km = sum(v['total_km'] for v in vehicles)
+    segment_cost = sum(v['segment_cost'] for v in vehicles)
+
+    summary.update({
+        'total_records': sum(v['total_records'] for v in vehicles),
+        'total_km': total_km,
+        'km_in_window': sum(v['km_in_window'] for v in vehicles),
+        'segment_cost': segment_cost,
+        'cost_per_km': segment_cost / total_km if total_km > 0 else 0
+    })
+
+    with_data = [v for v in vehicles if v['has_data']]
+    if with_data:
+        summary.update({
+            'average_consumption': consumption_sum / count,
+            'best_consumption': max(v['best_consumption'] for v in with_data),
+            'worst_consumption': min(v['worst_consumption'] for v in with_data),
+            'has_data': True,
+            'consumption_count': count,
+            'consumption_sum': consumption_sum
+        })
+    return summary
+
+
+def is_valid_consumption(kilometers, consumption):
+    """Trecho armazenado dentro das regras de validação"""
+    return kilometers is not None and consumption is not None and bool(consumption_in_range(kilometers, consumption))
+
+
+def ewma_update(count, mean, variance, recent, value):
+    """Um passo O(1) das médias móveis exponenciais de consumo
+
+    Devolve (count, mean, variance, recent, zscore); o z-score compara o novo
+    valor com a média e o desvio anteriores (0 enquanto não há variância).
+    """
+    if not count:
+        return 1, value, 0.0, value, 0.0
+
+    deviation = value - mean
+    zscore = deviation / math.sqrt(variance) if variance > 0 else 0.0
+    increment = CONSUMPTION_EWMA_ALPHA * deviation
+    mean += increment
+    variance = (1 - CONSUMPTION_EWMA_ALPHA) * (variance + deviation * increment)
+    recent += RECENT_EWMA_ALPHA * (value - recent)
+    return count + 1, mean, variance, recent, zscore
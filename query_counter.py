@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Contador de Consultas SQL - Rodo Stats
+Desenvolvido por InovaMente Labs
+
+Registra os comandos executados em um engine do SQLAlchemy. Usado pelos
+testes e pelo benchmark.py; não importa o app nem altera o ambiente.
+"""
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """Registra os comandos SQL executados dentro do bloco
+
+    `bind` é um engine do SQLAlchemy ou um app Flask (usa o engine do Flask-SQLAlchemy).
+    """
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.engine = None
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        if hasattr(self.bind, 'app_context'):
+            with self.bind.app_context():
+                self.engine = self.bind.extensions['sqlalchemy'].engine
+        else:
+            self.engine = self.bind
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
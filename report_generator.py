@@ -21,6 +21,7 @@ from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.chart import LineChart, Reference
+from openpyxl.utils import get_column_letter
 
 class ReportGenerator:
     """Gerador de relatórios PDF e Excel para frotas"""
@@ -28,8 +29,10 @@ class ReportGenerator:
     def __init__(self, app_context=None):
         self.app_context = app_context
 
-    def generate_fleet_report_pdf(self, fleet, fleet_stats, vehicles, fuel_records, period_days=30):
+    def generate_fleet_report_pdf(self, fleet, fleet_stats, vehicles, fuel_records, period_days=30,
+                                  vehicle_stats=None):
         """Gera relatório executivo da frota em PDF"""
+        vehicle_stats = vehicle_stats or {}
 
         # Criar arquivo temporário
         buffer = BytesIO()
@@ -116,15 +119,12 @@ class ReportGenerator:
         vehicles_heading = Paragraph("🚗 RANKING DE EFICIÊNCIA POR VEÍCULO", heading_style)
         story.append(vehicles_heading)
 
-        # Calcular eficiência por veículo
+        # Eficiência por veículo (kernel compartilhado)
         vehicle_efficiency = []
         for vehicle in vehicles:
-            vehicle_records = [r for r in fuel_records if r.vehicle_id == vehicle.id]
-            if len(vehicle_records) >= 2:
-                total_km = sum(r.kilometers for r in vehicle_records if r.kilometers)
-                total_liters = sum(r.liters for r in vehicle_records)
-                avg_consumption = total_km / total_liters if total_liters > 0 else 0
-                vehicle_efficiency.append((vehicle, avg_consumption, len(vehicle_records)))
+            stats = vehicle_stats.get(vehicle.id)
+            if stats and stats['has_data']:
+                vehicle_efficiency.append((vehicle, stats['average_consumption'], stats['total_records']))
 
         # Ordenar por eficiência
         vehicle_efficiency.sort(key=lambda x: x[1], reverse=True)
@@ -198,8 +198,18 @@ class ReportGenerator:
 
         return pdf_data
 
-    def generate_fleet_report_excel(self, fleet, fleet_stats, vehicles, fuel_records, period_days=30):
+    def generate_fleet_report_excel(self, fleet, fleet_stats, vehicles, fuel_records, period_days=30,
+                                    vehicle_stats=None, vehicle_totals=None):
         """Gera relatório da frota em Excel com múltiplas abas"""
+        vehicle_stats = vehicle_stats or {}
+        if vehicle_totals is None:
+            vehicle_totals = {}
+            for record in fuel_records:
+                totals = vehicle_totals.setdefault(
+                    record.vehicle_id, {'total_spent': 0, 'total_liters': 0, 'total_records': 0})
+                totals['total_spent'] += record.total_cost
+                totals['total_liters'] += record.liters
+                totals['total_records'] += 1
 
         # Criar workbook
         wb = Workbook()
@@ -256,19 +266,17 @@ class ReportGenerator:
 
         # Dados por veículo
         for row, vehicle in enumerate(vehicles, 2):
-            vehicle_records = [r for r in fuel_records if r.vehicle_id == vehicle.id]
-
-            total_km = sum(r.kilometers for r in vehicle_records if r.kilometers)
-            total_liters = sum(r.liters for r in vehicle_records)
-            total_cost = sum(r.total_cost for r in vehicle_records)
-            avg_consumption = total_km / total_liters if total_liters > 0 else 0
+            totals = vehicle_totals.get(vehicle.id, {})
+            total_liters = totals.get('total_liters', 0)
+            total_cost = totals.get('total_spent', 0)
+            avg_consumption = vehicle_stats.get(vehicle.id, {}).get('average_consumption', 0)
 
             ws_vehicles.cell(row=row, column=1, value=f"{vehicle.brand} {vehicle.model}")
             ws_vehicles.cell(row=row, column=2, value=vehicle.license_plate)
             ws_vehicles.cell(row=row, column=3, value=f"{avg_consumption:.1f}")
             ws_vehicles.cell(row=row, column=4, value=total_cost)
             ws_vehicles.cell(row=row, column=5, value=total_liters)
-            ws_vehicles.cell(row=row, column=6, value=len(vehicle_records))
+            ws_vehicles.cell(row=row, column=6, value=totals.get('total_records', 0))
 
         # === ABA 3: HISTÓRICO DE ABASTECIMENTOS ===
         ws_fuel = wb.create_sheet("Histórico Abastecimentos")
@@ -299,7 +307,8 @@ class ReportGenerator:
         for ws in [ws_summary, ws_vehicles, ws_fuel]:
             for column in ws.columns:
                 max_length = 0
-                column_letter = column[0].column_letter
+                # Células mescladas (títulos) não têm column_letter
+                column_letter = get_column_letter(column[0].column)
                 for cell in column:
                     try:
                         if len(str(cell.value)) > max_length:
@@ -331,52 +340,73 @@ class ReportGenerator:
 
         return file_path
 
-def generate_fleet_reports(fleet, period_days=30):
-    """Função utilitária para gerar todos os relatórios de uma frota"""
+def fleet_period_query(fleet, period_days=30):
+    """Consulta dos abastecimentos da frota no período do relatório"""
     from app import db, Vehicle, FuelRecord
 
-    # Buscar dados
-    vehicles = Vehicle.query.filter_by(fleet_id=fleet.id, is_active=True).all()
-
-    # Período de análise
     end_date = datetime.now()
     start_date = end_date - timedelta(days=period_days)
-
-    fuel_records = db.session.query(FuelRecord).join(Vehicle).filter(
+    return db.session.query(FuelRecord).join(Vehicle).filter(
         Vehicle.fleet_id == fleet.id,
         FuelRecord.date >= start_date,
         FuelRecord.date <= end_date
-    ).all()
+    )
+
+def fleet_report_stats(fleet, period_days=30):
+    """Estatísticas do relatório sem carregar os abastecimentos
+
+    Totais da frota e por veículo vêm do rollup diário; a eficiência, do
+    kernel sobre as colunas do período. Retorna (vehicles, fleet_stats,
+    vehicle_stats, vehicle_totals).
+    """
+    from app import Vehicle, fuel_record_columns, fleet_rollup_totals
+    from fuel_stats import compute_efficiency_stats
+
+    vehicles = Vehicle.query.filter_by(fleet_id=fleet.id, is_active=True).all()
+    vehicle_stats = compute_efficiency_stats(*fuel_record_columns(fleet_period_query(fleet, period_days)))
+
+    # Totais da frota e por veículo lidos do rollup diário
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=period_days)
+    fleet_totals = fleet_rollup_totals(fleet.id, start_date, end_date)
+    vehicle_totals = fleet_rollup_totals(fleet.id, start_date, end_date, by_vehicle=True)
 
     # Calcular estatísticas
     fleet_stats = {
         'total_vehicles': len(vehicles),
-        'total_spent': sum(r.total_cost for r in fuel_records),
-        'total_liters': sum(r.liters for r in fuel_records),
-        'total_records_30d': len(fuel_records)
+        'total_spent': fleet_totals['total_spent'],
+        'total_liters': fleet_totals['total_liters'],
+        'total_km': fleet_totals['total_km'],
+        'total_records_30d': fleet_totals['total_records']
     }
 
-    # Calcular consumo médio da frota
-    consumptions = []
-    for vehicle in vehicles:
-        vehicle_records = [r for r in fuel_records if r.vehicle_id == vehicle.id]
-        if len(vehicle_records) >= 2:
-            total_km = sum(r.kilometers for r in vehicle_records if r.kilometers)
-            total_liters = sum(r.liters for r in vehicle_records)
-            if total_liters > 0:
-                consumptions.append(total_km / total_liters)
+    # Calcular consumo médio da frota (média dos veículos com dados)
+    consumptions = [
+        vehicle_stats[vehicle.id]['average_consumption']
+        for vehicle in vehicles
+        if vehicle.id in vehicle_stats and vehicle_stats[vehicle.id]['has_data']
+    ]
 
     fleet_stats['avg_consumption'] = sum(consumptions) / len(consumptions) if consumptions else 0
 
+    return vehicles, fleet_stats, vehicle_stats, vehicle_totals
+
+def generate_fleet_reports(fleet, period_days=30):
+    """Função utilitária para gerar todos os relatórios de uma frota"""
+    vehicles, fleet_stats, vehicle_stats, vehicle_totals = fleet_report_stats(fleet, period_days)
+
+    # Histórico do período para a aba de abastecimentos
+    fuel_records = fleet_period_query(fleet, period_days).all()
+
     # Gerar relatórios
     generator = ReportGenerator()
 
     pdf_data = generator.generate_fleet_report_pdf(
-        fleet, fleet_stats, vehicles, fuel_records, period_days
+        fleet, fleet_stats, vehicles, fuel_records, period_days, vehicle_stats
     )
 
     excel_data = generator.generate_fleet_report_excel(
-        fleet, fleet_stats, vehicles, fuel_records, period_days
+        fleet, fleet_stats, vehicles, fuel_records, period_days, vehicle_stats, vehicle_totals
     )
 
-    return pdf_data, excel_data, fleet_stats
\ No newline at end of file
+    return pdf_data, excel_data, fleet_stats
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Gerador de Dados Sintéticos - Rodo Stats
+Desenvolvido por InovaMente Labs
+
+Popula o banco com usuários, frotas, motoristas, veículos e históricos de
+vários anos (abastecimentos, manutenções e alertas) usando inserts em lote.
+Usado pelo usuário demo, pelo comando `flask seed` e pelo benchmark.
+"""
+
+import random
+import secrets
+from datetime import datetime, timedelta
+
+# Frota do usuário demo (também usada como modelo pelo seeder)
+DEMO_FLEET_VEHICLES = [
+    {'name': 'Caminhão 01', 'brand': 'Mercedes-Benz', 'model': 'Actros 2646', 'year': 2021, 'license_plate': 'ABC-1234', 'fuel_type': 'diesel', 'vehicle_type': 'truck', 'tank_capacity': 400},
+    {'name': 'Caminhão 02', 'brand': 'Volvo', 'model': 'FH 460', 'year': 2020, 'license_plate': 'DEF-5678', 'fuel_type': 'diesel', 'vehicle_type': 'truck', 'tank_capacity': 350},
+    {'name': 'Caminhão 03', 'brand': 'Scania', 'model': 'R 450', 'year': 2022, 'license_plate': 'GHI-9012', 'fuel_type': 'diesel', 'vehicle_type': 'truck', 'tank_capacity': 380}
+]
+
+# Consumo (km/L) de cada caminhão demo: Mercedes mais eficiente, Scania menos
+DEMO_FLEET_CONSUMPTION = [(2.8, 3.2), (2.5, 2.9), (2.2, 2.6)]
+
+DEMO_FLEET_DRIVERS = [
+    {'name': 'Carlos Santos', 'cpf': '12345678901', 'cnh': '123456789', 'cnh_category': 'E', 'phone': '(11) 98888-8888'},
+    {'name': 'José Silva', 'cpf': '09876543210', 'cnh': '987654321', 'cnh_category': 'D', 'phone': '(11) 97777-7777'},
+    {'name': 'Pedro Oliveira', 'cpf': '11122233344', 'cnh': '111222333', 'cnh_category': 'E', 'phone': '(11) 96666-6666'}
+]
+
+# Modelos usados pelo seeder
+CAR_MODELS = [
+    ('Fiat', 'Argo', 'gasoline', 48), ('Volkswagen', 'Gol', 'gasoline', 55),
+    ('Chevrolet', 'Onix', 'ethanol', 44), ('Hyundai', 'HB20', 'gasoline', 50),
+    ('Toyota', 'Corolla', 'gasoline', 50), ('Renault', 'Kwid', 'ethanol', 38)
+]
+FLEET_MODELS = [
+    ('Mercedes-Benz', 'Actros 2646', 'truck', 400), ('Volvo', 'FH 460', 'truck', 350),
+    ('Scania', 'R 450', 'truck', 380), ('Fiat', 'Ducato', 'van', 90),
+    ('Renault', 'Master', 'van', 100), ('Iveco', 'Daily', 'van', 100)
+]
+DRIVER_FIRST_NAMES = ['Carlos', 'José', 'Pedro', 'Ana', 'Marcos', 'Luiz', 'Fernanda', 'Paulo', 'Rita', 'João']
+DRIVER_LAST_NAMES = ['Santos', 'Silva', 'Oliveira', 'Souza', 'Lima', 'Costa', 'Pereira', 'Almeida']
+GAS_STATIONS = ['Posto Shell Centro', 'Posto Ipiranga Rodovia', 'Posto BR Marginal', 'Posto Ale Norte', 'Posto Petrobras Sul']
+
+# Faixas realistas por tipo de veículo
+CONSUMPTION_RANGES = {'car': (9.0, 14.0), 'van': (7.0, 10.0), 'truck': (2.2, 3.2)}
+FILL_UP_INTERVAL_DAYS = {'car': (4, 12), 'van': (2, 6), 'truck': (1, 4)}
+FUEL_PRICE_RANGES = {'gasoline': (5.40, 6.30), 'ethanol': (3.60, 4.40), 'diesel': (5.50, 6.20)}
+MAINTENANCE_INTERVALS_KM = {
+    'oil': {'car': 10000, 'van': 15000, 'truck': 20000},
+    'tires': {'car': 40000, 'van': 50000, 'truck': 80000},
+    'brakes': {'car': 30000, 'van': 35000, 'truck': 50000}
+}
+MAINTENANCE_COSTS = {'oil': (180, 450), 'tires': (1200, 6000), 'brakes': (400, 2500)}
+
+# Senha de todas as contas geradas (hash calculado uma única vez)
+SEED_PASSWORD = 'Seed123!'
+
+
+def generate_fuel_history(vehicle_id, vehicle_type, fuel_type, tank_capacity, start_date, end_date,
+                          rng, start_odometer=None, consumption_range=None):
+    """Gera abastecimentos entre as datas, com odômetro crescente coerente com o consumo"""
+    interval = FILL_UP_INTERVAL_DAYS.get(vehicle_type, FILL_UP_INTERVAL_DAYS['car'])
+    consumption_range = consumption_range or CONSUMPTION_RANGES.get(vehicle_type, CONSUMPTION_RANGES['car'])
+    price_range = FUEL_PRICE_RANGES.get(fuel_type, FUEL_PRICE_RANGES['gasoline'])
+    odometer = start_odometer if start_odometer is not None else rng.uniform(5000, 80000)
+    created_at = datetime.utcnow()
+
+    rows = []
+    day = start_date
+    while day <= end_date:
+        liters = tank_capacity * rng.uniform(0.55, 0.95)
+        odometer += liters * rng.uniform(*consumption_range)
+        price_per_liter = rng.uniform(*price_range)
+        rows.append({
+            'vehicle_id': vehicle_id,
+            'date': day,
+            'odometer': round(odometer, 1),
+            'liters': round(liters, 2),
+            'price_per_liter': round(price_per_liter, 3),
+            'total_cost': round(liters * price_per_liter, 2),
+            'gas_station': rng.choice(GAS_STATIONS),
+            'fuel_type': fuel_type,
+            'notes': None,
+            'created_at': created_at
+        })
+        day += timedelta(days=rng.randint(*interval))
+    return rows
+
+
+def generate_maintenance_history(vehicle_id, vehicle_type, fuel_rows, rng):
+    """Gera trocas de óleo, pneus e freios sempre que o odômetro cruza o intervalo"""
+    rows = []
+    if not fuel_rows:
+        return rows
+
+    created_at = datetime.utcnow()
+    for maintenance_type, intervals in MAINTENANCE_INTERVALS_KM.items():
+        interval_km = intervals.get(vehicle_type, intervals['car'])
+        next_km = fuel_rows[0]['odometer'] + interval_km * rng.uniform(0.3, 1.0)
+        for fuel_row in fuel_rows:
+            if fuel_row['odometer'] < next_km:
+                continue
+            km_at_service = int(fuel_row['odometer'])
+            rows.append({
+                'vehicle_id': vehicle_id,
+                'date': fuel_row['date'],
+                'maintenance_type': maintenance_type,
+                'description': f'Manutenção programada ({maintenance_type})',
+                'cost': round(rng.uniform(*MAINTENANCE_COSTS[maintenance_type]), 2),
+                'km_at_service': km_at_service,
+                'service_provider': 'Oficina Parceira',
+                'service_interval_km': interval_km,
+                'next_service_km': km_at_service + interval_km,
+                'created_by_voice': False,
+                'created_at': created_at,
+                'updated_at': created_at
+            })
+            next_km = km_at_service + interval_km
+    return rows
+
+
+def generate_alert_history(vehicle_id, user_id, fleet_id, fuel_rows, rng, rate=0.03):
+    """Gera alertas antigos de consumo para uma fração dos abastecimentos"""
+    rows = []
+    for fuel_row in fuel_rows:
+        if rng.random() >= rate:
+            continue
+        created_at = datetime.combine(fuel_row['date'], datetime.min.time()) + timedelta(hours=6)
+        rows.append({
+            'user_id': user_id,
+            'fleet_id': fleet_id,
+            'vehicle_id': vehicle_id,
+            'alert_type': 'fuel_anomaly',
+            'severity': 'warning',
+            'title': 'Consumo acima do normal',
+            'message': f"Consumo fora do padrão no abastecimento de {fuel_row['date'].strftime('%d/%m/%Y')}.",
+            'alert_data': {},
+            'is_active': rng.random() < 0.2,
+            'is_read': rng.random() < 0.7,
+            'created_at': created_at
+        })
+    return rows
+
+
+class BulkWriter:
+    """Acumula linhas por modelo e grava em lotes com INSERT executemany"""
+
+    def __init__(self, batch_size=5000):
+        from app import db
+        self.db = db
+        self.batch_size = batch_size
+        self.pending = {}
+        self.counts = {}
+
+    def add(self, model, rows):
+        buffer = self.pending.setdefault(model, [])
+        buffer.extend(rows)
+        if len(buffer) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model=None):
+        models = [model] if model is not None else list(self.pending)
+        for current in models:
+            rows = self.pending.get(current)
+            if not rows:
+                continue
+            self.db.session.execute(self.db.insert(current), rows)
+            name = current.__tablename__
+            self.counts[name] = self.counts.get(name, 0) + len(rows)
+            self.pending[current] = []
+
+
+def seed_database(users=10, fleets=1, vehicles=10, user_vehicles=2, years=1, seed=None, batch_size=5000):
+    """Popula o banco com dados sintéticos
+
+    Cria `users` usuários pessoais (cada um com `user_vehicles` carros) e
+    `fleets` frotas, cada uma com um dono, `vehicles` veículos e um motorista
+    por veículo. Cada veículo recebe `years` anos de abastecimentos,
+    manutenções e alertas. Retorna um resumo com as quantidades geradas e as
+    credenciais de acesso.
+    """
+    from app import (db, User, Fleet, FleetMember, Driver, Vehicle, FuelRecord, MaintenanceRecord, Alert,
+                     backfill_fuel_segments, reconcile_unread_alert_counters, enqueue_alert_evaluation)
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    tag = secrets.token_hex(3) if seed is None else f's{seed}'
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=365 * years)
+    writer = BulkWriter(batch_size)
+
+    def add_history(vehicle, user_id, fleet_id):
+        history_start = start_date + timedelta(days=rng.randint(0, 20))
+        fuel_rows = generate_fuel_history(
+            vehicle.id, vehicle.vehicle_type, vehicle.fuel_type, vehicle.tank_capacity,
+            history_start, end_date, rng
+        )
+        writer.add(FuelRecord, fuel_rows)
+        writer.add(MaintenanceRecord, generate_maintenance_history(vehicle.id, vehicle.vehicle_type, fuel_rows, rng))
+        writer.add(Alert, generate_alert_history(vehicle.id, user_id, fleet_id, fuel_rows, rng))
+
+    vehicle_ids = []
+    personal_usernames = []
+    fleet_owner_usernames = []
+
+    # Usuários pessoais com carros
+    for user_index in range(users):
+        user = User(username=f'seed_{tag}_user{user_index}', email=f'seed_{tag}_user{user_index}@example.com',
+                    password_hash=password_hash)
+        db.session.add(user)
+        db.session.flush()
+        personal_usernames.append(user.username)
+
+        for vehicle_index in range(user_vehicles):
+            brand, model, fuel_type, tank_capacity = rng.choice(CAR_MODELS)
+            vehicle = Vehicle(user_id=user.id, name=f'{model} {vehicle_index + 1}', brand=brand, model=model,
+                              year=rng.randint(2012, 2024), fuel_type=fuel_type, vehicle_type='car',
+                              tank_capacity=tank_capacity)
+            db.session.add(vehicle)
+            db.session.flush()
+            vehicle_ids.append(vehicle.id)
+            add_history(vehicle, user.id, None)
+
+    # Frotas com dono, motoristas e veículos pesados
+    for fleet_index in range(fleets):
+        owner = User(username=f'seed_{tag}_fleet{fleet_index}', email=f'seed_{tag}_fleet{fleet_index}@example.com',
+                     password_hash=password_hash, account_type='enterprise')
+        db.session.add(owner)
+        db.session.flush()
+        fleet_owner_usernames.append(owner.username)
+
+        fleet = Fleet(name=f'Transportes Seed {fleet_index + 1}', company_name=f'Transportes Seed {fleet_index + 1} Ltda',
+                      email=owner.email, subscription_plan='enterprise', max_vehicles=max(vehicles, 10),
+                      max_users=10)
+        db.session.add(fleet)
+        db.session.flush()
+        db.session.add(FleetMember(fleet_id=fleet.id, user_id=owner.id, role='owner'))
+
+        for vehicle_index in range(vehicles):
+            driver = Driver(
+                fleet_id=fleet.id,
+                name=f'{rng.choice(DRIVER_FIRST_NAMES)} {rng.choice(DRIVER_LAST_NAMES)}',
+                cnh_category=rng.choice(['C', 'D', 'E']),
+                hired_at=start_date
+            )
+            db.session.add(driver)
+            db.session.flush()
+
+            brand, model, vehicle_type, tank_capacity = rng.choice(FLEET_MODELS)
+            vehicle = Vehicle(user_id=owner.id, fleet_id=fleet.id, driver_id=driver.id,
+                              name=f'{vehicle_type.title()} {vehicle_index + 1:03d}', brand=brand, model=model,
+                              year=rng.randint(2015, 2024), fuel_type='diesel', vehicle_type=vehicle_type,
+                              tank_capacity=tank_capacity)
+            db.session.add(vehicle)
+            db.session.flush()
+            vehicle_ids.append(vehicle.id)
+            add_history(vehicle, owner.id, fleet.id)
+
+    writer.flush()
+    db.session.commit()
+
+    # Segmentos de consumo em lote (também invalida o cache do dashboard)
+    backfill_fuel_segments(vehicle_ids)
+
+    # Alertas inseridos em lote: contadores de não lidos calculados de uma vez
+    reconcile_unread_alert_counters()
+
+    # Abastecimentos em lote não passam pelos eventos do ORM: agendar a reavaliação incremental
+    enqueue_alert_evaluation(vehicle_ids)
+
+    return {
+        'users': users + fleets,
+        'fleets': fleets,
+        'vehicles': len(vehicle_ids),
+        'fuel_records': writer.counts.get('fuel_records', 0),
+        'maintenance_records': writer.counts.get('maintenance_records', 0),
+        'alerts': writer.counts.get('alerts', 0),
+        'password': SEED_PASSWORD,
+        'personal_usernames': personal_usernames,
+        'fleet_owner_usernames': fleet_owner_usernames
+    }
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Configuração Compartilhada dos Testes - RodoStats
+Ambiente de teste e cliente com banco em memória
+"""
+
+import pytest
+import os
+import sys
+
+# Adicionar diretório raiz ao path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Configurar variáveis de ambiente para teste
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SESSION_SECRET'] = 'test-secret-key-for-testing-only'
+os.environ['FLASK_ENV'] = 'testing'
+
+from app import app, db
+
+
+@pytest.fixture
+def client():
+    """Fixture para criar cliente de teste"""
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+        yield client
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Testes da Caixa de Entrada de Alertas - RodoStats
+Paginação por cursor, atualização em lote e contadores de não lidos
+"""
+
+import pytest
+from datetime import datetime, timedelta
+
+from app import (app, db, User, Fleet, FleetMember, create_alert, insert_alerts_ignoring_duplicates,
+                 reconcile_unread_alert_counters)
+from query_counter import QueryCounter
+
+
+@pytest.fixture
+def inbox(client):
+    """Usuário de frota com alertas pessoais e da frota, mais alertas de outro usuário"""
+    with app.app_context():
+        users = []
+        for username in ('gestor', 'outro'):
+            user = User(username=username, email=f'{username}@example.com')
+            user.set_password('Senha123!')
+            db.session.add(user)
+            users.append(user)
+        fleet = Fleet(name='Frota', company_name='Frota LTDA', email='frota@example.com')
+        db.session.add(fleet)
+        db.session.flush()
+        db.session.add(FleetMember(fleet_id=fleet.id, user_id=users[0].id, role='owner'))
+        db.session.commit()
+
+        # Mesmo created_at em vários alertas: o id desempata a ordem
+        start = datetime.utcnow() - timedelta(days=30)
+        for index in range(25):
+            owner = {'user_id': users[0].id} if index % 2 else {'fleet_id': fleet.id}
+            alert = create_alert(alert_type='system', title=f'Alerta {index}', message='-', **owner)
+            alert.created_at = start + timedelta(hours=index // 3)
+        create_alert(user_id=users[1].id, alert_type='system', title='De outro usuário', message='-')
+        db.session.commit()
+        ids = {'user_id': users[0].id, 'other_id': users[1].id, 'fleet_id': fleet.id}
+
+    client.post('/login', data={'username': 'gestor', 'password': 'Senha123!'})
+    return ids
+
+
+def unread_count(client):
+    return client.get('/api/alerts/unread_count').get_json()['unread_count']
+
+
+class TestAlertInbox:
+    """Listagem com paginação por cursor"""
+
+    def test_cursor_pagination_walks_all_alerts(self, client, inbox):
+        """Páginas seguem (created_at, id) decrescente, sem repetir nem pular alertas"""
+        seen, cursor = [], None
+        while True:
+            url = '/api/alerts?limit=10' + (f'&cursor={cursor}' if cursor else '')
+            data = client.get(url).get_json()
+            assert len(data['alerts']) <= 10
+            seen.extend(data['alerts'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        assert len(seen) == len({alert['id'] for alert in seen}) == 25
+        keys = [(alert['created_at'], alert['id']) for alert in seen]
+        assert keys == sorted(keys, reverse=True)
+        assert 'De outro usuário' not in {alert['title'] for alert in seen}
+
+    def test_status_filter_and_invalid_cursor(self, client, inbox):
+        """Filtro de não lidos e cursor inválido"""
+        client.post('/api/alerts/bulk', json={'action': 'read', 'ids': [1, 2, 3]})
+        data = client.get('/api/alerts?status=unread&limit=100').get_json()
+        assert len(data['alerts']) == 22
+        assert client.get('/api/alerts?cursor=invalido').status_code == 400
+
+
+class TestAlertBulkUpdate:
+    """Marcar como lido e dispensar em um único UPDATE"""
+
+    def test_bulk_read_and_dismiss_update_counters(self, client, inbox):
+        """Contador acompanha leituras e dispensas, contando cada alerta uma vez"""
+        assert unread_count(client) == 25
+
+        response = client.post('/api/alerts/bulk', json={'action': 'read', 'ids': [1, 2, 3]})
+        assert response.get_json()['updated'] == 3
+        assert response.get_json()['unread_count'] == 22
+
+        # Já lidos não contam de novo; dispensar lido não altera o contador
+        assert client.post('/api/alerts/bulk', json={'action': 'read', 'ids': [1, 2]}).get_json()['updated'] == 0
+        assert client.post('/api/alerts/bulk', json={'action': 'dismiss', 'ids': [1]}).get_json()['unread_count'] == 22
+        assert client.post('/api/alerts/bulk', json={'action': 'dismiss', 'ids': [4, 5]}).get_json()['unread_count'] == 20
+
+        # Alerta de outro usuário não é alterado
+        assert client.post('/api/alerts/bulk', json={'action': 'read', 'ids': [26]}).get_json()['updated'] == 0
+
+        assert client.post('/api/alerts/bulk', json={'action': 'read', 'all': True}).get_json()['unread_count'] == 0
+        with app.app_context():
+            assert reconcile_unread_alert_counters() == 0
+            assert db.session.get(User, inbox['other_id']).unread_alerts_count == 1
+
+    def test_single_update_statement(self, client, inbox):
+        """Atualização em lote emite um único UPDATE na tabela de alertas"""
+        with QueryCounter(app) as counter:
+            client.post('/api/alerts/bulk', json={'action': 'dismiss', 'ids': list(range(1, 21))})
+
+        assert len([s for s in counter.statements if s.lstrip().upper().startswith('UPDATE ALERTS')]) == 1
+
+    def test_invalid_requests(self, client, inbox):
+        """Ação desconhecida ou ids inválidos são recusados"""
+        assert client.post('/api/alerts/bulk', json={'action': 'apagar', 'ids': [1]}).status_code == 400
+        assert client.post('/api/alerts/bulk', json={'action': 'read', 'ids': 'todos'}).status_code == 400
+        assert client.post('/api/alerts/bulk', json={'action': 'read', 'ids': [True]}).status_code == 400
+
+
+class TestUnreadCounters:
+    """Contadores mantidos em vez de COUNT(*)"""
+
+    def test_unread_count_does_not_read_alerts(self, client, inbox):
+        """Badge da navbar não consulta a tabela de alertas"""
+        with QueryCounter(app) as counter:
+            assert unread_count(client) == 25
+
+        assert not [s for s in counter.statements if 'FROM alerts' in s]
+
+    def test_engine_inserts_and_reconcile(self, client, inbox):
+        """Inserção em lote incrementa o contador e a conferência corrige desvios"""
+        with app.app_context():
+            inserted = insert_alerts_ignoring_duplicates([
+                {'fleet_id': inbox['fleet_id'], 'vehicle_id': None, 'alert_type': 'system', 'title': 'Lote',
+                 'message': '-', 'dedup_bucket': None}
+            ])
+            db.session.commit()
+            assert len(inserted) == 1
+            assert db.session.get(Fleet, inbox['fleet_id']).unread_alerts_count == 14
+
+            Fleet.query.update({'unread_alerts_count': 99})
+            db.session.commit()
+            assert reconcile_unread_alert_counters() == 1
+            assert db.session.get(Fleet, inbox['fleet_id']).unread_alerts_count == 14
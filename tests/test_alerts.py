@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+"""
+Testes do Motor de Alertas - RodoStats
+Regras avaliadas em memória sobre entradas carregadas em lote
+"""
+
+import pytest
+from datetime import date, timedelta
+
+import app as app_module
+from app import (app, db, mail, User, Fleet, FleetMember, Vehicle, FuelRecord, MaintenanceRecord, Alert, VehicleConsumptionState,
+                 BackgroundJob, run_worker,
+                 backfill_fuel_segments, run_daily_alert_checks, run_alert_rules, MAINTENANCE_ALERT_RULES,
+                 insert_alerts_ignoring_duplicates, partition_alert_shards, shard_vehicle_filter,
+                 run_sharded_alert_checks, alert_vehicle_queue, rebuild_consumption_states,
+                 CONSUMPTION_STATE_FIELDS, FUEL_ALERT_RULES, new_alert_run_stats, update_alerts,
+                 check_fuel_anomalies)
+from seed_data import seed_database
+from query_counter import QueryCounter
+
+
+@pytest.fixture
+def client(client):
+    """Cliente de teste sem reavaliação incremental e sem envio de emails"""
+    # Os testes do motor populam o banco sem disparar a reavaliação incremental
+    incremental_mode = app.config['ALERT_INCREMENTAL_MODE']
+    app.config['ALERT_INCREMENTAL_MODE'] = 'off'
+    # Emails dos alertas nunca saem durante os testes
+    mail_state = app.extensions['mail']
+    suppress = mail_state.suppress
+    mail_state.suppress = True
+
+    yield client
+
+    app.config['ALERT_INCREMENTAL_MODE'] = incremental_mode
+    mail_state.suppress = suppress
+
+
+def add_vehicle_with_history(user_id, index, maintenance=True):
+    """Veículo antigo, com troca de óleo vencida e consumo piorando nos últimos 30 dias"""
+    vehicle = Vehicle(
+        user_id=user_id, name=f'Carro {index}', brand='Fiat', model='Uno',
+        year=date.today().year - 12, fuel_type='gasoline', tank_capacity=50
+    )
+    db.session.add(vehicle)
+    db.session.flush()
+
+    odometer = 20000
+    for day in range(85, -1, -5):
+        odometer += 500
+        km_per_liter = 8 if day < 30 else 12
+        db.session.add(FuelRecord(
+            vehicle_id=vehicle.id, date=date.today() - timedelta(days=day), odometer=odometer,
+            liters=500 / km_per_liter, price_per_liter=5.5, total_cost=500 / km_per_liter * 5.5,
+            fuel_type='gasoline'
+        ))
+
+    if maintenance:
+        db.session.add(MaintenanceRecord(
+            vehicle_id=vehicle.id, date=date.today() - timedelta(days=120), maintenance_type='oil',
+            description='Troca de óleo', km_at_service=10000
+        ))
+    return vehicle
+
+
+def seed_user_vehicles(count, maintenance=True):
+    """Usuário com veículos e histórico completo"""
+    with app.app_context():
+        user = User(username=f'motorista{count}', email=f'motorista{count}@example.com')
+        user.set_password('Senha123!')
+        db.session.add(user)
+        db.session.flush()
+        vehicle_ids = [add_vehicle_with_history(user.id, index, maintenance).id for index in range(count)]
+        db.session.commit()
+        backfill_fuel_segments()
+        return vehicle_ids
+
+
+class TestAlertRules:
+    """Regras de alerta avaliadas sobre as entradas pré-carregadas"""
+
+    def test_daily_run_creates_expected_alerts(self, client):
+        """Cada regra deve disparar uma vez por veículo, usando os campos reais da manutenção"""
+        vehicle_ids = seed_user_vehicles(2)
+
+        with app.app_context():
+            assert run_daily_alert_checks() == 2 * 4
+            alerts = Alert.query.filter_by(vehicle_id=vehicle_ids[0]).all()
+            by_type = {alert.alert_type: alert for alert in alerts}
+
+            assert sorted(by_type) == ['consumption_anomaly', 'fuel_anomaly', 'maintenance', 'vehicle_age']
+            maintenance = by_type['maintenance']
+            assert maintenance.severity == 'critical'
+            assert maintenance.alert_data['maintenance_type'] == 'oil'
+            assert maintenance.alert_data['days_overdue'] == 30
+            assert by_type['fuel_anomaly'].alert_data['deviation_percentage'] > 20
+            assert by_type['consumption_anomaly'].alert_data['recent_records_count'] == 7
+            assert by_type['vehicle_age'].alert_data['vehicle_age'] == 12
+
+    def test_second_run_is_deduplicated(self, client):
+        """Alertas dentro da janela de deduplicação não são repetidos"""
+        seed_user_vehicles(2, maintenance=False)
+
+        with app.app_context():
+            assert run_daily_alert_checks() > 0
+            first_run = Alert.query.count()
+            assert run_daily_alert_checks() == 0
+            assert Alert.query.count() == first_run
+            reasons = [alert.alert_data.get('reason') for alert in Alert.query.filter_by(alert_type='maintenance')]
+            assert reasons == ['no_maintenance_history'] * 2
+
+    def test_mileage_rule_uses_latest_odometer(self, client):
+        """Manutenção recente por tempo mas vencida por km gera alerta de quilometragem"""
+        vehicle_id = seed_user_vehicles(1)[0]
+
+        with app.app_context():
+            MaintenanceRecord.query.filter_by(vehicle_id=vehicle_id).update({'date': date.today() - timedelta(days=10)})
+            db.session.commit()
+
+            assert run_alert_rules(MAINTENANCE_ALERT_RULES) == 3
+            alert = Alert.query.filter_by(vehicle_id=vehicle_id, alert_type='maintenance').one()
+            assert alert.alert_data['current_mileage'] == 29000
+            assert alert.alert_data['km_since_maintenance'] == 19000
+            assert alert.severity == 'critical'
+
+
+class TestAlertDeduplication:
+    """Chave única (vehicle_id, alert_type, dedup_bucket) no banco"""
+
+    def test_concurrent_runs_do_not_duplicate(self, client, monkeypatch):
+        """Execuções que não enxergam os alertas uma da outra não geram duplicatas"""
+        seed_user_vehicles(2)
+        monkeypatch.setattr(app_module, 'recent_alerts_by_vehicle', lambda vehicle_ids, now: {})
+
+        with app.app_context():
+            assert run_daily_alert_checks() == 2 * 4
+            assert run_daily_alert_checks() == 0
+            assert Alert.query.count() == 2 * 4
+            assert Alert.query.filter(Alert.dedup_bucket.is_(None)).count() == 0
+
+    def test_insert_returns_only_new_rows(self, client):
+        """Linhas em conflito são ignoradas e não retornadas; alertas manuais (sem janela) não conflitam"""
+        vehicle_id = seed_user_vehicles(1, maintenance=False)[0]
+        row = {'vehicle_id': vehicle_id, 'alert_type': 'vehicle_age', 'title': 'Antigo',
+               'message': 'Veículo antigo', 'dedup_bucket': 100}
+
+        with app.app_context():
+            assert insert_alerts_ignoring_duplicates([row]) == [row]
+            assert insert_alerts_ignoring_duplicates([dict(row)]) == []
+            assert insert_alerts_ignoring_duplicates([dict(row, dedup_bucket=101)]) != []
+            db.session.add_all([Alert(vehicle_id=vehicle_id, alert_type='vehicle_age', title='Manual', message='-')
+                                for _ in range(2)])
+            db.session.commit()
+            assert Alert.query.count() == 4
+
+    def test_dismissed_anomaly_can_be_raised_again(self, client):
+        """Alerta de consumo dispensado libera a chave única: a regra volta a alertar na mesma janela"""
+        seed_user_vehicles(1, maintenance=False)
+
+        with app.app_context():
+            assert run_alert_rules(FUEL_ALERT_RULES) == 1
+            alert = Alert.query.filter_by(alert_type='fuel_anomaly').one()
+            alert.dismiss(alert.user_id)
+            assert alert.dedup_bucket is None
+            assert run_alert_rules(FUEL_ALERT_RULES) == 1
+
+            # Dispensa em lote também libera a janela
+            user_id = alert.user_id
+            assert update_alerts(user_id, 'dismiss') == 1
+            assert run_alert_rules(FUEL_ALERT_RULES) == 1
+            assert Alert.query.filter_by(alert_type='fuel_anomaly', is_active=True).count() == 1
+            assert Alert.query.filter_by(alert_type='fuel_anomaly').count() == 3
+
+
+class TestShardedRun:
+    """Execução particionada por frota/usuário"""
+
+    def test_shards_cover_active_vehicles_once(self, client):
+        """Cada veículo ativo pertence a exatamente um shard e nenhum dono é dividido"""
+        with app.app_context():
+            seed_database(users=5, fleets=3, vehicles=4, user_vehicles=1, years=1, seed=5)
+            Vehicle.query.filter_by(id=1).update({'is_active': False})
+            db.session.commit()
+
+            shards = partition_alert_shards(4)
+            assert len(shards) > 1
+            seen = []
+            for shard in shards:
+                vehicles = Vehicle.query.filter(Vehicle.is_active == True, shard_vehicle_filter(shard)).all()
+                assert len(vehicles) == shard['vehicles']
+                seen.extend(vehicle.id for vehicle in vehicles)
+            active = [vehicle.id for vehicle in Vehicle.query.filter_by(is_active=True)]
+            assert sorted(seen) == sorted(active)
+
+            fleets = [(shard['first_id'], shard['last_id']) for shard in shards if shard['kind'] == 'fleet']
+            assert all(previous[1] < current[0] for previous, current in zip(fleets, fleets[1:]))
+
+    def test_sharded_run_matches_single_pass(self, client):
+        """Rodar em shards gera os mesmos alertas e um relatório por shard"""
+        with app.app_context():
+            seed_database(users=4, fleets=2, vehicles=3, user_vehicles=1, years=1, seed=9)
+            db.session.execute(db.delete(Alert))
+            db.session.commit()
+
+            reports = run_sharded_alert_checks(workers=3)
+            created = sum(report['alerts_created'] for report in reports)
+            assert len(reports) > 1
+            assert all(report['seconds'] >= 0 and report['pid'] for report in reports)
+            assert created == Alert.query.count() > 0
+
+            db.session.execute(db.delete(Alert))
+            db.session.commit()
+            assert run_daily_alert_checks(workers=1) == created
+
+
+class TestIncrementalAlerts:
+    """Reavaliação do veículo ao gravar abastecimentos e manutenções"""
+
+    def test_fuel_write_evaluates_only_that_vehicle(self, client):
+        """Novo abastecimento reavalia as regras de dados do veículo; a varredura diária fica só com as de tempo"""
+        vehicle_ids = seed_user_vehicles(2)
+        app.config['ALERT_INCREMENTAL_MODE'] = 'sync'
+        client.post('/login', data={'username': 'motorista2', 'password': 'Senha123!'})
+
+        response = client.post(f'/add_fuel_record/{vehicle_ids[0]}', data={
+            'date': date.today().isoformat(), 'odometer': '29500', 'liters': '80',
+            'price_per_liter': '5.5', 'total_cost': '440', 'fuel_type': 'gasoline'
+        })
+        assert response.status_code == 302
+
+        with app.app_context():
+            types = sorted(alert.alert_type for alert in Alert.query.filter_by(vehicle_id=vehicle_ids[0]))
+            assert types == ['consumption_anomaly', 'fuel_anomaly', 'maintenance']
+            assert Alert.query.filter_by(vehicle_id=vehicle_ids[1]).count() == 0
+
+            # Só idade (2 veículos) e manutenção por tempo do veículo ainda não avaliado
+            assert run_daily_alert_checks() == 3
+            assert run_daily_alert_checks(full=True) == 2
+
+    def test_rollback_and_queue_modes(self, client, monkeypatch):
+        """Gravação desfeita não reavalia; no modo 'thread' os veículos vão para a fila"""
+        vehicle_id = seed_user_vehicles(1)[0]
+        app.config['ALERT_INCREMENTAL_MODE'] = 'sync'
+
+        with app.app_context():
+            record = FuelRecord.query.filter_by(vehicle_id=vehicle_id).first()
+            record.notes = 'corrigido'
+            db.session.flush()
+            db.session.rollback()
+            db.session.commit()
+            assert Alert.query.count() == 0
+
+            monkeypatch.setattr(app_module, 'ensure_alert_worker', lambda: None)
+            app.config['ALERT_INCREMENTAL_MODE'] = 'thread'
+            MaintenanceRecord.query.filter_by(vehicle_id=vehicle_id).one().notes = 'revisado'
+            db.session.commit()
+            assert alert_vehicle_queue.get_nowait() == vehicle_id
+            assert Alert.query.count() == 0
+
+    def test_job_mode_defers_evaluation(self, client):
+        """No modo 'job' o request só enfileira; o worker avalia, inclusive veículos inseridos em lote"""
+        vehicle_ids = seed_user_vehicles(2)
+        job_mode = app.config['JOB_EXECUTION_MODE']
+        app.config['ALERT_INCREMENTAL_MODE'] = 'job'
+        app.config['JOB_EXECUTION_MODE'] = 'inline'  # Mesmo sem worker, nada roda no request
+        client.post('/login', data={'username': 'motorista2', 'password': 'Senha123!'})
+
+        try:
+            response = client.post(f'/add_fuel_record/{vehicle_ids[0]}', data={
+                'date': date.today().isoformat(), 'odometer': '29500', 'liters': '80',
+                'price_per_liter': '5.5', 'total_cost': '440', 'fuel_type': 'gasoline'
+            })
+            assert response.status_code == 302
+
+            with app.app_context():
+                assert Alert.query.count() == 0
+                job = BackgroundJob.query.filter_by(job_type='vehicle_alerts').one()
+                assert (job.status, job.payload) == ('queued', {'vehicle_ids': [vehicle_ids[0]]})
+
+                seed_database(users=1, fleets=0, user_vehicles=1, years=1, seed=3)
+                seeded = BackgroundJob.query.filter_by(job_type='vehicle_alerts').order_by(BackgroundJob.id.desc()).first()
+                assert len(seeded.payload['vehicle_ids']) == 1
+
+                assert run_worker(once=True, schedule=False) == 2
+                assert Alert.query.filter_by(vehicle_id=vehicle_ids[0]).count() == 3
+        finally:
+            app.config['JOB_EXECUTION_MODE'] = job_mode
+
+
+class TestConsumptionState:
+    """Estado EWMA de consumo mantido a cada abastecimento"""
+
+    def post_fuel(self, client, vehicle_id, odometer, liters):
+        return client.post(f'/add_fuel_record/{vehicle_id}', data={
+            'date': date.today().isoformat(), 'odometer': str(odometer), 'liters': str(liters),
+            'price_per_liter': '5.5', 'total_cost': str(liters * 5.5), 'fuel_type': 'gasoline'
+        })
+
+    def snapshot(self, vehicle_id):
+        state = db.session.get(VehicleConsumptionState, vehicle_id)
+        return {field: getattr(state, field) for field in CONSUMPTION_STATE_FIELDS}
+
+    def test_new_fill_up_updates_state_in_constant_time(self, client, monkeypatch):
+        """Abastecimento no fim do histórico atualiza o estado sem reler o histórico"""
+        vehicle_id = seed_user_vehicles(1)[0]
+        client.post('/login', data={'username': 'motorista1', 'password': 'Senha123!'})
+
+        def no_rebuild(vehicle_ids=None):
+            raise AssertionError('histórico relido')
+
+        monkeypatch.setattr(app_module, 'rebuild_consumption_states', no_rebuild)
+        assert self.post_fuel(client, vehicle_id, 29500, 50).status_code == 302
+        monkeypatch.undo()
+
+        with app.app_context():
+            incremental = self.snapshot(vehicle_id)
+            assert incremental['sample_count'] == 18
+            assert incremental['last_consumption'] == pytest.approx(10)
+            assert incremental['last_odometer'] == 29500
+
+            rebuild_consumption_states([vehicle_id])
+            rebuilt = self.snapshot(vehicle_id)
+            assert rebuilt == pytest.approx(incremental)
+
+    def test_backdated_and_deleted_records_rebuild_state(self, client):
+        """Registro retroativo e exclusão reconstroem o estado a partir dos segmentos"""
+        vehicle_id = seed_user_vehicles(1)[0]
+        client.post('/login', data={'username': 'motorista1', 'password': 'Senha123!'})
+
+        assert self.post_fuel(client, vehicle_id, 20250, 25).status_code == 302
+        with app.app_context():
+            assert self.snapshot(vehicle_id)['last_odometer'] == 29000
+            last_id = self.snapshot(vehicle_id)['last_record_id']
+
+        assert client.post(f'/fuel_record/{last_id}/delete').status_code == 302
+        with app.app_context():
+            state = self.snapshot(vehicle_id)
+            assert state['last_odometer'] == 28500
+            assert state['sample_count'] == 17
+            assert state['last_consumption'] == pytest.approx(8)
+
+    def test_anomaly_decision_uses_state(self, client):
+        """A decisão vem do estado: média recente 20% pior e fora do desvio normal"""
+        vehicle_id = seed_user_vehicles(1, maintenance=False)[0]
+
+        with app.app_context():
+            state = db.session.get(VehicleConsumptionState, vehicle_id)
+            state.mean_consumption, state.recent_consumption = 12.0, 9.0
+            state.variance_consumption = 4.0  # desvio de 2 km/L: queda de 3 km/L é 1,5 desvio
+            db.session.commit()
+
+            assert check_fuel_anomalies() == 1
+            alert = Alert.query.filter_by(alert_type='fuel_anomaly').one()
+            assert alert.alert_data['deviation_percentage'] == pytest.approx(25)
+            assert alert.alert_data['zscore'] == pytest.approx(1.5)
+
+            db.session.delete(alert)
+            state.variance_consumption = 9.0  # veículo irregular: queda de 3 km/L é 1 desvio
+            db.session.commit()
+            assert check_fuel_anomalies() == 0
+
+
+class TestAlertDigests:
+    """Um resumo por destinatário por execução, entregue em uma única conexão SMTP"""
+
+    def seed_fleet(self):
+        """Frota com dono, administrador e motorista; três veículos com troca de óleo vencida"""
+        with app.app_context():
+            fleet = Fleet(name='Transportes Teste', company_name='Transportes Teste LTDA', email='frota@example.com')
+            db.session.add(fleet)
+            db.session.flush()
+            for role in ('owner', 'admin', 'user'):
+                user = User(username=f'{role}_frota', email=f'{role}@example.com')
+                user.set_password('Senha123!')
+                db.session.add(user)
+                db.session.flush()
+                db.session.add(FleetMember(fleet_id=fleet.id, user_id=user.id, role=role))
+                if role == 'owner':
+                    owner_id = user.id
+            for index in range(3):
+                add_vehicle_with_history(owner_id, index).fleet_id = fleet.id
+            db.session.commit()
+            backfill_fuel_segments()
+
+    def test_one_digest_per_admin(self, client, monkeypatch):
+        """Dono e administrador recebem um email cada, com todos os alertas; motorista não recebe"""
+        self.seed_fleet()
+        seed_user_vehicles(1)
+        app.config['ALERT_EMAIL_MODE'] = 'sync'
+        connections = []
+        original_connect = mail.connect
+        monkeypatch.setattr(mail, 'connect', lambda: connections.append(1) or original_connect())
+
+        try:
+            with mail.record_messages() as outbox, app.app_context():
+                assert run_daily_alert_checks() == 4 * 4
+        finally:
+            app.config['ALERT_EMAIL_MODE'] = 'thread'
+
+        assert len(connections) == 1
+        recipients = sorted(message.recipients[0] for message in outbox)
+        assert recipients == ['admin@example.com', 'motorista1@example.com', 'owner@example.com']
+        fleet_digest = next(message for message in outbox if message.recipients == ['admin@example.com'])
+        # Só a manutenção vencida vai por email (a piora de consumo fica abaixo de 30%)
+        assert fleet_digest.subject == '🚨 Rodo Stats: 3 alertas exigindo atenção'
+        assert fleet_digest.html.count('class="alert-box') == 3
+        assert 'Transportes Teste' in fleet_digest.html
+
+    def test_email_mode_off(self, client):
+        """Com ALERT_EMAIL_MODE=off nenhum email é montado"""
+        seed_user_vehicles(1)
+        app.config['ALERT_EMAIL_MODE'] = 'off'
+        try:
+            with mail.record_messages() as outbox, app.app_context():
+                assert run_daily_alert_checks() == 4
+        finally:
+            app.config['ALERT_EMAIL_MODE'] = 'thread'
+        assert outbox == []
+
+
+class TestAlertEngineQueries:
+    """O número de consultas não deve crescer com o número de veículos"""
+
+    def test_query_count_is_constant(self, client):
+        """Dobrar a frota não deve aumentar as consultas da verificação diária"""
+        seed_user_vehicles(3)
+        with app.app_context(), QueryCounter(app) as small:
+            run_alert_rules(MAINTENANCE_ALERT_RULES)
+
+        with app.app_context():
+            Alert.query.delete()
+            db.session.commit()
+        seed_user_vehicles(6)
+        with app.app_context(), QueryCounter(app) as large:
+            created = run_alert_rules(MAINTENANCE_ALERT_RULES)
+
+        assert created == 9 * 3
+        assert large.count == small.count
+        assert large.count <= 10
+
+    def test_batches_are_loaded_independently(self, client):
+        """Lotes menores mantêm o resultado e custam um número fixo de consultas por lote"""
+        seed_user_vehicles(4)
+        with app.app_context(), QueryCounter(app) as counter:
+            created = run_alert_rules(MAINTENANCE_ALERT_RULES, batch_size=2)
+
+        assert created == 4 * 3
+        # Por lote: entradas, gravação e o UPDATE em lote dos contadores de não lidos
+        assert counter.count <= 2 * 9 + 1
+
+
+class TestAlertStats:
+    """Resumo da execução por regra: veículos, alertas, duplicados, consultas e tempo"""
+
+    def test_stats_per_rule(self, client):
+        """Cada regra reporta os veículos avaliados e os alertas que gerou"""
+        seed_user_vehicles(2)
+
+        with app.app_context():
+            stats = new_alert_run_stats()
+            assert run_daily_alert_checks(stats=stats) == 8
+
+        rule_names = {rule.__name__ for rule in FUEL_ALERT_RULES + MAINTENANCE_ALERT_RULES}
+        assert set(stats['rules']) == rule_names
+        assert all(entry['vehicles_evaluated'] == 2 for entry in stats['rules'].values())
+        assert sum(entry['alerts_created'] for entry in stats['rules'].values()) == stats['alerts_created'] == 8
+        assert stats['rules']['check_vehicle_age_alerts']['alerts_created'] == 2
+
+        # Regras rodam em memória: as consultas ficam na carga das entradas e na gravação
+        assert all(entry['queries'] == 0 for entry in stats['rules'].values())
+        assert stats['stages']['load_inputs']['queries'] > 0
+        assert stats['stages']['insert']['queries'] > 0
+        assert stats['queries'] >= stats['stages']['load_inputs']['queries'] + stats['stages']['insert']['queries']
+        assert stats['vehicles'] == 2 and stats['batches'] == 1
+
+    def test_stats_count_duplicates(self, client):
+        """Na segunda execução os alertas aparecem como duplicados suprimidos"""
+        seed_user_vehicles(2)
+
+        with app.app_context():
+            run_daily_alert_checks()
+            stats = new_alert_run_stats()
+            assert run_daily_alert_checks(stats=stats) == 0
+
+        assert stats['alerts_created'] == 0
+        assert stats['rules']['check_vehicle_age_alerts']['duplicates_suppressed'] == 2
+        assert stats['duplicates_suppressed'] >= 8
+
+    def test_api_returns_last_run_summary(self, client):
+        """A API de alertas devolve o resumo por regra da última verificação"""
+        seed_user_vehicles(1)
+        with app.app_context():
+            User.query.filter_by(username='motorista1').update({'user_role': 'admin'})
+            db.session.commit()
+        client.post('/login', data={'username': 'motorista1', 'password': 'Senha123!'})
+
+        assert client.post('/api/run_alerts').get_json()['last_run'] is None
+        with app.app_context():
+            app_module.run_worker(once=True, schedule=False)
+
+        last_run = client.post('/api/run_alerts').get_json()['last_run']
+        assert last_run['status'] == 'succeeded'
+        assert last_run['result']['alerts_created'] == 4
+        assert last_run['result']['stats']['rules']['check_vehicle_age_alerts']['alerts_created'] == 1
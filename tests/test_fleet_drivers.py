@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de Motoristas da Frota - RodoStats
+Carregamento da página em lote e atribuição de veículos em massa
+"""
+
+import pytest
+
+from app import app, db, User, Fleet, FleetMember, Driver, Vehicle, reconcile_fleet_counters
+from query_counter import QueryCounter
+
+
+def add_drivers_and_vehicles(fleet_id, user_id, count):
+    """Cria `count` motoristas, cada um com um veículo, e um veículo livre"""
+    driver_ids, vehicle_ids = [], []
+    for index in range(count + 1):
+        driver_id = None
+        if index < count:
+            driver = Driver(fleet_id=fleet_id, name=f'Motorista {index}')
+            db.session.add(driver)
+            db.session.flush()
+            driver_id = driver.id
+            driver_ids.append(driver_id)
+        vehicle = Vehicle(user_id=user_id, name=f'Caminhão {index}', brand='Volvo', model='FH', year=2020,
+                          fuel_type='diesel', tank_capacity=400, fleet_id=fleet_id, driver_id=driver_id)
+        db.session.add(vehicle)
+        db.session.flush()
+        vehicle_ids.append(vehicle.id)
+    db.session.commit()
+    return driver_ids, vehicle_ids
+
+
+@pytest.fixture
+def fleet(client):
+    """Frota com dois motoristas, cada um com um veículo, e um veículo livre"""
+    with app.app_context():
+        owner = User(username='gestor', email='gestor@example.com')
+        owner.set_password('Senha123!')
+        db.session.add(owner)
+        fleet = Fleet(name='Frota', company_name='Frota LTDA', email='frota@example.com')
+        db.session.add(fleet)
+        db.session.flush()
+        db.session.add(FleetMember(fleet_id=fleet.id, user_id=owner.id, role='owner'))
+        driver_ids, vehicle_ids = add_drivers_and_vehicles(fleet.id, owner.id, 2)
+        ids = {'fleet_id': fleet.id, 'user_id': owner.id, 'driver_ids': driver_ids, 'vehicle_ids': vehicle_ids}
+
+    client.post('/login', data={'username': 'gestor', 'password': 'Senha123!'})
+    return ids
+
+
+class TestDriversPage:
+    """Página de motoristas carrega os veículos em uma consulta"""
+
+    def test_query_count_independent_of_drivers(self, client, fleet):
+        """Mais motoristas não aumentam o número de consultas"""
+        with QueryCounter(app) as counter:
+            response = client.get('/fleet/drivers')
+        assert response.status_code == 200
+        assert 'Motorista 1' in response.get_data(as_text=True)
+        baseline = counter.count
+
+        with app.app_context():
+            add_drivers_and_vehicles(fleet['fleet_id'], fleet['user_id'], 10)
+
+        with QueryCounter(app) as counter:
+            response = client.get('/fleet/drivers')
+        assert response.status_code == 200
+        assert counter.count == baseline
+
+
+class TestBulkAssignments:
+    """Atribuição e remoção em massa"""
+
+    def test_reshuffle_in_one_update(self, client, fleet):
+        """Troca, atribuição e remoção saem de um único UPDATE"""
+        first, second = fleet['driver_ids']
+        vehicle_a, vehicle_b, free = fleet['vehicle_ids']
+        payload = {'assignments': [
+            {'vehicle_id': vehicle_a, 'driver_id': second},
+            {'vehicle_id': vehicle_b, 'driver_id': None},
+            {'vehicle_id': free, 'driver_id': first}
+        ]}
+
+        with QueryCounter(app) as counter:
+            response = client.post('/api/fleet/drivers/assignments', json=payload)
+        assert response.status_code == 200
+        assert response.get_json()['updated'] == 3
+        assert len([s for s in counter.statements if s.lstrip().upper().startswith('UPDATE VEHICLES')]) == 1
+
+        with app.app_context():
+            assignments = dict(db.session.query(Vehicle.id, Vehicle.driver_id))
+            assert assignments == {vehicle_a: second, vehicle_b: None, free: first}
+            assert db.session.get(Fleet, fleet['fleet_id']).ranking_version > 0
+
+    def test_rejects_foreign_and_invalid_items(self, client, fleet):
+        """Veículos ou motoristas de outra frota e listas inválidas não alteram nada"""
+        vehicle_id = fleet['vehicle_ids'][0]
+        url = '/api/fleet/drivers/assignments'
+        assert client.post(url, json={'assignments': [{'vehicle_id': 999, 'driver_id': None}]}).status_code == 400
+        assert client.post(url, json={'assignments': [{'vehicle_id': vehicle_id, 'driver_id': 999}]}).status_code == 400
+        assert client.post(url, json={'assignments': [{'vehicle_id': vehicle_id}] * 2}).status_code == 400
+        assert client.post(url, json={'assignments': [{'vehicle_id': 'a'}]}).status_code == 400
+        assert client.post(url, json={'assignments': [{'vehicle_id': True}]}).status_code == 400
+        assert client.post(url, json={'assignments': [{'vehicle_id': vehicle_id, 'driver_id': True}]}).status_code == 400
+        assert client.post(url, json={}).status_code == 400
+
+        with app.app_context():
+            assert db.session.get(Vehicle, vehicle_id).driver_id == fleet['driver_ids'][0]
+
+
+class TestFleetCounters:
+    """Contadores de veículos e membros mantidos a cada gravação"""
+
+    def test_counters_follow_insert_archive_and_delete(self, client, fleet):
+        """Inclusão, arquivamento, troca de frota e exclusão ajustam os contadores"""
+        with app.app_context():
+            current = db.session.get(Fleet, fleet['fleet_id'])
+            assert (current.vehicles_count, current.members_count) == (3, 1)
+
+            other = Fleet(name='Outra', company_name='Outra LTDA', email='outra@example.com')
+            member = User(username='membro', email='membro@example.com')
+            member.set_password('Senha123!')
+            db.session.add_all([other, member])
+            db.session.flush()
+            db.session.add(FleetMember(fleet_id=fleet['fleet_id'], user_id=member.id, role='viewer'))
+            first, second, free = fleet['vehicle_ids']
+            db.session.get(Vehicle, first).is_active = False
+            db.session.get(Vehicle, second).fleet_id = other.id
+            db.session.delete(db.session.get(Vehicle, free))
+            db.session.commit()
+
+            db.session.expire_all()
+            current, other = db.session.get(Fleet, fleet['fleet_id']), db.session.get(Fleet, other.id)
+            assert (current.vehicles_count, current.members_count) == (0, 2)
+            assert other.vehicles_count == 1
+
+            db.session.get(Vehicle, first).is_active = True
+            db.session.commit()
+            assert db.session.get(Fleet, fleet['fleet_id']).vehicles_count == 1
+            assert reconcile_fleet_counters() == 0
+
+    def test_plan_limit_check_reads_no_rows(self, client, fleet):
+        """Checar o limite do plano não consulta veículos nem membros"""
+        with app.app_context():
+            current = db.session.get(Fleet, fleet['fleet_id'])
+            with QueryCounter(app) as counter:
+                can_add_vehicle, can_add_member = current.can_add_vehicle(), current.can_add_member()
+            assert counter.count == 0
+            assert can_add_vehicle == (3 < current.max_vehicles)
+
+    def test_reconcile_fixes_drift(self, client, fleet):
+        """Escritas em lote sem flush são corrigidas pela conferência"""
+        with app.app_context():
+            Fleet.query.update({'active_vehicles_count': 99, 'active_members_count': 0})
+            db.session.commit()
+            assert reconcile_fleet_counters() == 2
+            current = db.session.get(Fleet, fleet['fleet_id'])
+            assert (current.vehicles_count, current.members_count) == (3, 1)
@@ -0,0 +1,535 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de Métricas de Combustível - RodoStats
+Consumo por abastecimento, estatísticas e dashboard
+"""
+
+import pytest
+from datetime import date, timedelta
+
+from app import (app, db, User, Vehicle, FuelRecord, Fleet, FleetMember, compute_fuel_segments,
+                 backfill_fuel_segments, dashboard_kpis, fleet_vehicle_stats, calculate_fuel_efficiency,
+                 FleetDailyRollup, rebuild_fleet_rollups, fleet_rollup_totals, time_bucket, bucket_key,
+                 process_fuel_record_from_voice, vehicle_history_stats)
+from query_counter import QueryCounter
+
+
+@pytest.fixture
+def user_with_history(client):
+    """Usuário logado com dois veículos e histórico de abastecimentos"""
+    with app.app_context():
+        user = User(username='motorista', email='motorista@example.com')
+        user.set_password('Senha123!')
+        db.session.add(user)
+        db.session.flush()
+
+        vehicle_ids = []
+        for index in range(2):
+            vehicle = Vehicle(
+                user_id=user.id, name=f'Carro {index}', brand='Fiat', model='Uno',
+                year=2018, fuel_type='gasoline', tank_capacity=50
+            )
+            db.session.add(vehicle)
+            db.session.flush()
+            vehicle_ids.append(vehicle.id)
+
+            start = date.today() - timedelta(days=60)
+            for day in range(8):
+                db.session.add(FuelRecord(
+                    vehicle_id=vehicle.id,
+                    date=start + timedelta(days=day * 7),
+                    odometer=10000 + day * (400 + index * 50),
+                    liters=35 + day,
+                    price_per_liter=5.5,
+                    total_cost=(35 + day) * 5.5,
+                    gas_station='Posto Centro',
+                    fuel_type='gasoline'
+                ))
+        db.session.commit()
+        backfill_fuel_segments()
+        user_id = user.id
+
+    client.post('/login', data={'username': 'motorista', 'password': 'Senha123!'})
+    return {'user_id': user_id, 'vehicle_ids': vehicle_ids}
+
+
+def assert_segments_consistent():
+    """Segmentos armazenados devem coincidir com o recálculo completo"""
+    segments = compute_fuel_segments()
+    for record in FuelRecord.query.all():
+        kilometers, consumption, cost_per_km = segments[record.id]
+        assert record.kilometers == pytest.approx(kilometers)
+        assert record.consumption == pytest.approx(consumption)
+        assert record.cost_per_km == pytest.approx(cost_per_km)
+
+
+class TestConsumptionEngine:
+    """Testes do cálculo de consumo em lote"""
+
+    def test_segments_scoped_by_user_and_vehicle(self, user_with_history):
+        """Cálculo em lote deve respeitar o escopo e ignorar o primeiro abastecimento"""
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        with app.app_context():
+            user_segments = compute_fuel_segments(user_id=user_with_history['user_id'])
+            vehicle_segments = compute_fuel_segments(vehicle_ids=[vehicle_id])
+
+            assert len(user_segments) == FuelRecord.query.count()
+            assert set(vehicle_segments) == {r.id for r in FuelRecord.query.filter_by(vehicle_id=vehicle_id)}
+            assert sum(1 for segment in vehicle_segments.values() if segment[0] is None) == 1
+            assert compute_fuel_segments(vehicle_ids=[]) == {}
+
+    def test_backfill_stores_segments(self, user_with_history):
+        """Backfill deve persistir distância, consumo e custo por km"""
+        with app.app_context():
+            assert_segments_consistent()
+            record = FuelRecord.query.filter(FuelRecord.kilometers.isnot(None)).first()
+            assert record.consumption == pytest.approx(record.kilometers / record.liters)
+
+    def test_vehicle_detail_and_export(self, client, user_with_history):
+        """Páginas que exibem consumo por abastecimento devem carregar"""
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        response = client.get(f'/vehicle/{vehicle_id}')
+        assert response.status_code == 200
+        assert b'km/L' in response.data
+
+        response = client.get('/export_data')
+        assert response.status_code == 200
+        assert response.data.count(b'\n') == 17
+
+    def test_efficiency_pages_use_kernel(self, client, user_with_history):
+        """Estatísticas do kernel devem bater com os segmentos armazenados"""
+        from app import calculate_fuel_efficiency
+
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        with app.app_context():
+            stored = [r.consumption for r in FuelRecord.query.filter_by(vehicle_id=vehicle_id)
+                      if r.consumption]
+            efficiency = calculate_fuel_efficiency(vehicle_id)
+            assert efficiency['has_data']
+            assert efficiency['average_consumption'] == pytest.approx(sum(stored) / len(stored))
+
+        assert client.get('/vehicles').status_code == 200
+        assert client.get('/analytics').status_code == 200
+
+
+class TestSegmentMaintenance:
+    """Testes da atualização incremental dos segmentos"""
+
+    def test_insert_between_records(self, client, user_with_history):
+        """Inserir abastecimento intermediário recalcula o sucessor"""
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        response = client.post(f'/add_fuel_record/{vehicle_id}', data={
+            'date': date.today().strftime('%Y-%m-%d'),
+            'odometer': '10600',
+            'liters': '30',
+            'price_per_liter': '5.5',
+            'total_cost': '165'
+        })
+        assert response.status_code == 302
+        with app.app_context():
+            assert_segments_consistent()
+
+    def test_edit_and_delete(self, client, user_with_history):
+        """Editar odômetro e excluir abastecimento mantêm os vizinhos corretos"""
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        with app.app_context():
+            records = FuelRecord.query.filter_by(vehicle_id=vehicle_id).order_by(FuelRecord.odometer).all()
+            moved, removed = records[2], records[5]
+            moved_data = {
+                'date': moved.date.strftime('%Y-%m-%d'),
+                'odometer': str(records[6].odometer + 100),
+                'liters': str(moved.liters),
+                'price_per_liter': str(moved.price_per_liter),
+                'total_cost': str(moved.total_cost)
+            }
+            moved_id, removed_id = moved.id, removed.id
+
+        assert client.post(f'/fuel_record/{moved_id}/edit', data=moved_data).status_code == 302
+        with app.app_context():
+            assert_segments_consistent()
+
+        assert client.post(f'/fuel_record/{removed_id}/delete').status_code == 302
+        with app.app_context():
+            assert db.session.get(FuelRecord, removed_id) is None
+            assert_segments_consistent()
+
+    def test_kernel_and_stored_segments_agree(self, user_with_history):
+        """Datas fora da ordem do odômetro e odômetro zerado dão a mesma média no kernel e no SQL"""
+        with app.app_context():
+            vehicle = Vehicle(user_id=user_with_history['user_id'], name='Carro 2', brand='Fiat', model='Uno',
+                              year=2018, fuel_type='gasoline', tank_capacity=50)
+            db.session.add(vehicle)
+            db.session.flush()
+            start = date.today() - timedelta(days=30)
+            # (dia, odômetro, litros): o abastecimento do dia 4 tem odômetro menor que o do dia 3
+            for day, odometer, liters in [(0, 0, 30), (1, 400, 35), (2, 800, 40), (4, 1200, 30),
+                                          (3, 1600, 50), (5, 2000, 35)]:
+                db.session.add(FuelRecord(vehicle_id=vehicle.id, date=start + timedelta(days=day), odometer=odometer,
+                                          liters=liters, price_per_liter=5.5, total_cost=liters * 5.5,
+                                          fuel_type='gasoline'))
+            db.session.commit()
+            backfill_fuel_segments([vehicle.id])
+            vehicle_id = vehicle.id
+
+        fleet_id = make_fleet(user_with_history['user_id'])
+        with app.app_context():
+            expected = (400 / 40 + 400 / 30 + 400 / 50 + 400 / 35) / 4
+            assert calculate_fuel_efficiency(vehicle_id)['average_consumption'] == pytest.approx(expected)
+            assert vehicle_history_stats(vehicle_id)['average_consumption'] == pytest.approx(expected)
+            assert fleet_vehicle_stats(fleet_id)[vehicle_id]['average_consumption'] == pytest.approx(expected)
+
+    def test_segment_over_max_distance_is_not_summed(self, user_with_history):
+        """Lacuna acima de MAX_SEGMENT_KM fica fora da quilometragem no kernel, nos segmentos e no rollup"""
+        with app.app_context():
+            vehicle = Vehicle(user_id=user_with_history['user_id'], name='Carro 2', brand='Fiat', model='Uno',
+                              year=2018, fuel_type='gasoline', tank_capacity=50)
+            db.session.add(vehicle)
+            db.session.flush()
+            start = date.today() - timedelta(days=10)
+            # O terceiro abastecimento vem 3000 km depois do anterior (registro esquecido)
+            for day, odometer in enumerate([10000, 10400, 13400, 13800]):
+                db.session.add(FuelRecord(vehicle_id=vehicle.id, date=start + timedelta(days=day), odometer=odometer,
+                                          liters=35, price_per_liter=5.5, total_cost=35 * 5.5, fuel_type='gasoline'))
+            db.session.commit()
+            backfill_fuel_segments([vehicle.id])
+            vehicle_id = vehicle.id
+
+        make_fleet(user_with_history['user_id'])
+        with app.app_context():
+            assert calculate_fuel_efficiency(vehicle_id)['total_km'] == pytest.approx(800)
+            stored = db.session.query(db.func.sum(FuelRecord.kilometers)).filter_by(vehicle_id=vehicle_id).scalar()
+            rollup = db.session.query(db.func.sum(FleetDailyRollup.kilometers))\
+                .filter_by(vehicle_id=vehicle_id).scalar()
+            assert stored == pytest.approx(800) and rollup == pytest.approx(800)
+            assert_segments_consistent()
+
+    def test_voice_record_requires_odometer(self, user_with_history):
+        """Comando de voz sem quilometragem não grava abastecimento no km 0"""
+        with app.app_context():
+            total = FuelRecord.query.count()
+            success, message = process_fuel_record_from_voice(
+                {'valor': 200, 'tipo_combustivel': 'gasolina', 'litros': 36}, user_with_history['user_id']
+            )
+            assert not success and 'quilometragem' in message
+            assert FuelRecord.query.count() == total
+
+            success, _ = process_fuel_record_from_voice(
+                {'valor': 200, 'tipo_combustivel': 'gasolina', 'litros': 36, 'quilometragem': 14000},
+                user_with_history['user_id']
+            )
+            assert success
+            assert_segments_consistent()
+
+
+def add_vehicles_with_history(user_id, count):
+    """Adiciona veículos extras com alguns abastecimentos"""
+    with app.app_context():
+        for index in range(count):
+            vehicle = Vehicle(user_id=user_id, name=f'Extra {index}', brand='VW', model='Gol',
+                              year=2020, fuel_type='gasoline', tank_capacity=55)
+            db.session.add(vehicle)
+            db.session.flush()
+            for day in range(4):
+                db.session.add(FuelRecord(
+                    vehicle_id=vehicle.id, date=date.today() - timedelta(days=day * 10),
+                    odometer=20000 - day * 450, liters=40, price_per_liter=6.0, total_cost=240,
+                    gas_station='Posto Norte', fuel_type='gasoline'
+                ))
+        db.session.commit()
+        backfill_fuel_segments()
+
+
+def make_fleet(user_id):
+    """Coloca todos os veículos em uma frota do usuário e recalcula o rollup diário"""
+    with app.app_context():
+        fleet = Fleet(name='Frota', company_name='Frota LTDA', email='frota@example.com')
+        db.session.add(fleet)
+        db.session.flush()
+        db.session.add(FleetMember(fleet_id=fleet.id, user_id=user_id, role='owner'))
+        Vehicle.query.update({'fleet_id': fleet.id})  # UPDATE em lote: rollup recalculado abaixo
+        db.session.commit()
+        rebuild_fleet_rollups()
+        return fleet.id
+
+
+def assert_rollup_consistent(fleet_id):
+    """Rollup mantido incrementalmente deve coincidir com a soma dos abastecimentos"""
+    rows = {(r.vehicle_id, r.day, r.fuel_type): r for r in FleetDailyRollup.query.all()}
+    expected = {}
+    for record in FuelRecord.query.all():
+        totals = expected.setdefault((record.vehicle_id, record.date, record.fuel_type), [0, 0, 0, 0])
+        totals[0] += record.total_cost
+        totals[1] += record.liters
+        totals[2] += record.kilometers or 0
+        totals[3] += 1
+    assert set(rows) == set(expected)
+    for key, (cost, liters, kilometers, fill_ups) in expected.items():
+        assert rows[key].fleet_id == fleet_id
+        assert (rows[key].total_cost, rows[key].liters, rows[key].fill_ups) == (
+            pytest.approx(cost), pytest.approx(liters), fill_ups)
+        assert rows[key].kilometers == pytest.approx(kilometers)
+
+
+class TestDashboardQueries:
+    """Testes do número de consultas do dashboard"""
+
+    def test_kpis_in_single_statement(self, user_with_history):
+        """Indicadores do dashboard devem sair de um único SELECT"""
+        with app.app_context():
+            base_query = FuelRecord.query.join(Vehicle).filter(Vehicle.user_id == user_with_history['user_id'])
+            period_start = date.today() - timedelta(days=20)
+
+            with QueryCounter(app) as counter:
+                kpis = dashboard_kpis(base_query, period_start)
+
+            records = base_query.all()
+            assert counter.count == 1
+            assert kpis['total_records'] == len(records)
+            assert kpis['total_spent'] == pytest.approx(sum(r.total_cost for r in records))
+            assert kpis['total_liters'] == pytest.approx(sum(r.liters for r in records))
+            assert kpis['avg_price'] == pytest.approx(5.5)
+            assert kpis['period_expense'] == pytest.approx(
+                sum(r.total_cost for r in records if r.date >= period_start))
+
+    def test_dashboard_query_budget(self, client, user_with_history):
+        """Número de consultas do dashboard não deve crescer com a quantidade de veículos"""
+        with QueryCounter(app) as counter:
+            assert client.get('/dashboard').status_code == 200
+        baseline = counter.count
+
+        add_vehicles_with_history(user_with_history['user_id'], 5)
+
+        with QueryCounter(app) as counter:
+            assert client.get('/dashboard').status_code == 200
+        assert counter.count == baseline
+        assert counter.count <= 12
+
+        # Sem escritas, a próxima visita vem do cache
+        with QueryCounter(app) as cached:
+            assert client.get('/dashboard').status_code == 200
+        assert cached.count < baseline
+
+    def test_fleet_dashboard_single_pass(self, client, user_with_history):
+        """Dashboard da frota calcula a eficiência de todos os veículos sem consultas por veículo"""
+        fleet_id = make_fleet(user_with_history['user_id'])
+        with app.app_context():
+            vehicles = fleet_vehicle_stats(fleet_id)
+            for vehicle_id in user_with_history['vehicle_ids']:
+                efficiency = calculate_fuel_efficiency(vehicle_id)
+                assert vehicles[vehicle_id]['average_consumption'] == pytest.approx(efficiency['average_consumption'])
+                assert vehicles[vehicle_id]['total_records'] == 8
+
+        with QueryCounter(app) as counter:
+            assert client.get('/fleet/dashboard').status_code == 200
+        baseline = counter.count
+
+        add_vehicles_with_history(user_with_history['user_id'], 5)
+        with app.app_context():
+            Vehicle.query.update({'fleet_id': fleet_id})
+            db.session.commit()
+            rebuild_fleet_rollups()
+
+        with QueryCounter(app) as counter:
+            assert client.get('/fleet/dashboard').status_code == 200
+        assert counter.count == baseline
+
+
+class TestFleetRollup:
+    """Rollup diário por veículo e combustível das frotas"""
+
+    def test_rollup_follows_writes(self, client, user_with_history):
+        """Inclusão, edição de data e exclusão atualizam só os dias afetados"""
+        fleet_id = make_fleet(user_with_history['user_id'])
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        with app.app_context():
+            assert_rollup_consistent(fleet_id)
+            record = FuelRecord.query.filter_by(vehicle_id=vehicle_id).order_by(FuelRecord.odometer).all()[3]
+            record_id, old_date = record.id, record.date
+
+        # Abastecimento intermediário: o segmento do sucessor (outro dia) também muda
+        assert client.post(f'/add_fuel_record/{vehicle_id}', data={
+            'date': date.today().strftime('%Y-%m-%d'), 'odometer': '10600',
+            'liters': '30', 'price_per_liter': '6.0', 'total_cost': '180', 'fuel_type': 'ethanol'
+        }).status_code == 302
+        with app.app_context():
+            record = db.session.get(FuelRecord, record_id)
+            record.date = old_date + timedelta(days=2)
+            db.session.commit()
+            assert_rollup_consistent(fleet_id)
+
+        assert client.post(f'/fuel_record/{record_id}/delete').status_code == 302
+        with app.app_context():
+            assert_rollup_consistent(fleet_id)
+
+    def test_periods_and_previous_year(self, client, user_with_history):
+        """Dashboard escolhe o período e compara com o mesmo intervalo do ano anterior"""
+        fleet_id = make_fleet(user_with_history['user_id'])
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        with app.app_context():
+            db.session.add(FuelRecord(
+                vehicle_id=vehicle_id, date=date.today() - timedelta(days=370), odometer=5000, liters=30,
+                price_per_liter=5.0, total_cost=150, gas_station='Posto Centro', fuel_type='gasoline'
+            ))
+            db.session.commit()
+
+            today = date.today()
+            totals = fleet_rollup_totals(fleet_id, today - timedelta(days=90), today)
+            recent = FuelRecord.query.filter(FuelRecord.date >= today - timedelta(days=90)).all()
+            assert totals['total_records'] == len(recent)
+            assert totals['total_spent'] == pytest.approx(sum(r.total_cost for r in recent))
+            assert fleet_rollup_totals(fleet_id, today - timedelta(days=365 * 2), by_vehicle=True)[vehicle_id][
+                'total_records'] == 9
+
+        response = client.get('/fleet/dashboard?period=90')
+        assert response.status_code == 200
+        page = response.get_data(as_text=True)
+        assert 'Gasto (90 dias)' in page
+        assert '(1 no ano anterior)' in page
+
+        # Período fora da lista volta para 30 dias
+        assert 'Gasto (30 dias)' in client.get('/fleet/dashboard?period=45').get_data(as_text=True)
+
+
+class TestDashboardCache:
+    """Testes do cache do dashboard e da invalidação por versão"""
+
+    def test_writes_bump_data_version(self, client, user_with_history):
+        """Escritas em abastecimentos e veículos incrementam a versão do dono"""
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        with app.app_context():
+            user = db.session.get(User, user_with_history['user_id'])
+            version = user.data_version
+
+            record = FuelRecord.query.filter_by(vehicle_id=vehicle_id).first()
+            record.notes = 'Conferido'
+            db.session.commit()
+            db.session.refresh(user)
+            assert user.data_version == version + 1
+
+            vehicle = db.session.get(Vehicle, vehicle_id)
+            vehicle.color = 'Prata'
+            db.session.commit()
+            db.session.refresh(user)
+            assert user.data_version == version + 2
+
+    def test_hit_miss_and_invalidation(self, client, user_with_history, monkeypatch):
+        """Segunda leitura vem do cache; uma escrita força o recálculo"""
+        import app as app_module
+        calls = []
+
+        def fake_build(user_id, vehicles, selected_vehicle=None, selected_days=None):
+            calls.append((user_id, selected_vehicle, selected_days))
+            return {'total_records': len(calls)}
+
+        monkeypatch.setattr(app_module, 'build_dashboard_context', fake_build)
+        user_id = user_with_history['user_id']
+        vehicle_id = user_with_history['vehicle_ids'][0]
+
+        with app.app_context():
+            hits = app_module.dashboard_cache_stats['hits']
+            assert app_module.get_cached_dashboard_context(user_id, [])['total_records'] == 1
+            assert app_module.get_cached_dashboard_context(user_id, [])['total_records'] == 1
+            assert app_module.dashboard_cache_stats['hits'] == hits + 1
+
+            # Filtros diferentes usam outra entrada
+            assert app_module.get_cached_dashboard_context(user_id, [], vehicle_id, 30)['total_records'] == 2
+
+            db.session.add(FuelRecord(
+                vehicle_id=vehicle_id, date=date.today(), odometer=15000, liters=30,
+                price_per_liter=5.5, total_cost=165, fuel_type='gasoline'
+            ))
+            db.session.commit()
+
+            assert app_module.get_cached_dashboard_context(user_id, [])['total_records'] == 3
+            assert len(calls) == 3
+
+
+class TestTimeBuckets:
+    """Testes do agrupamento por período no banco"""
+
+    @pytest.mark.parametrize('unit', ['day', 'week', 'month', 'year'])
+    def test_bucket_matches_python_key(self, user_with_history, unit):
+        """Chave gerada pelo banco deve coincidir com bucket_key"""
+        with app.app_context():
+            bucket = time_bucket(FuelRecord.date, unit)
+            rows = db.session.query(FuelRecord.date, bucket).all()
+            assert rows
+            for record_date, key in rows:
+                assert key == bucket_key(record_date, unit)
+
+            grouped = db.session.query(bucket, db.func.count(FuelRecord.id)).group_by(bucket).all()
+            assert sum(count for _, count in grouped) == len(rows)
+
+    def test_invalid_unit(self, client):
+        """Período desconhecido deve ser rejeitado"""
+        with app.app_context():
+            with pytest.raises(ValueError):
+                time_bucket(FuelRecord.date, 'quarter')
+
+    def test_monthly_data_api(self, client, user_with_history):
+        """API mensal deve somar os gastos dos últimos 12 meses por mês"""
+        response = client.get('/api/monthly_data?days=365')
+        assert response.status_code == 200
+        payload = response.get_json()
+        assert len(payload['labels']) == 12
+        with app.app_context():
+            assert sum(payload['data']) == pytest.approx(
+                sum(r.total_cost for r in FuelRecord.query.all()))
+
+    def test_dashboard_renders_monthly_charts(self, client, user_with_history):
+        """Dashboard deve carregar no SQLite com os gráficos mensais"""
+        response = client.get('/dashboard')
+        assert response.status_code == 200
+        assert bucket_key(date.today(), 'month').encode() in response.data
+
+
+class TestFuelHistoryPagination:
+    """Testes da paginação por cursor do histórico do veículo"""
+
+    def test_load_more_walks_full_history(self, client, user_with_history):
+        """Páginas encadeadas devem cobrir o histórico sem repetir registros"""
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        with app.app_context():
+            # Dois abastecimentos no mesmo dia exercitam o desempate por id
+            db.session.add(FuelRecord(
+                vehicle_id=vehicle_id, date=date.today() - timedelta(days=60), odometer=10100,
+                liters=10, price_per_liter=5.5, total_cost=55, fuel_type='gasoline'
+            ))
+            db.session.commit()
+            expected = [r.id for r in FuelRecord.query.filter_by(vehicle_id=vehicle_id)
+                        .order_by(FuelRecord.date.desc(), FuelRecord.id.desc())]
+
+        seen, cursor = [], ''
+        while True:
+            response = client.get(f'/api/vehicle/{vehicle_id}/fuel_records?limit=3&cursor={cursor}')
+            assert response.status_code == 200
+            payload = response.get_json()
+            assert len(payload['records']) <= 3
+            seen.extend(record['id'] for record in payload['records'])
+            cursor = payload['next_cursor']
+            if not cursor:
+                break
+
+        assert seen == expected
+
+    def test_invalid_cursor_and_foreign_vehicle(self, client, user_with_history):
+        """Cursor malformado e veículo de outro usuário devem ser rejeitados"""
+        vehicle_id = user_with_history['vehicle_ids'][0]
+        assert client.get(f'/api/vehicle/{vehicle_id}/fuel_records?cursor=abc').status_code == 400
+        assert client.get('/api/vehicle/9999/fuel_records').status_code == 404
+
+    def test_header_stats_from_aggregates(self, client, user_with_history):
+        """Estatísticas do cabeçalho devem coincidir com o kernel"""
+        from app import vehicle_history_stats, calculate_fuel_efficiency
+
+        vehicle_id = user_with_history['vehicle_ids'][1]
+        with app.app_context():
+            stats = vehicle_history_stats(vehicle_id)
+            efficiency = calculate_fuel_efficiency(vehicle_id)
+            assert stats['total_records'] == 8
+            for key in ('average_consumption', 'best_consumption', 'worst_consumption'):
+                assert stats[key] == pytest.approx(efficiency[key])
+
+        response = client.get(f'/vehicle/{vehicle_id}')
+        assert response.status_code == 200
+        assert b'data-cursor=' not in response.data
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Testes do Kernel de Estatísticas - RodoStats
+Cálculos vetorizados de eficiência por veículo
+"""
+
+import pytest
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+# Adicionar diretório raiz ao path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fuel_stats import (compute_efficiency_stats, compute_consumption_series, summarize_efficiency, ewma_update,
+                        CONSUMPTION_EWMA_ALPHA)
+
+
+def reference_consumptions(records):
+    """Cálculo de referência em Python puro (regras do dashboard)"""
+    records = sorted(records, key=lambda r: (r[1], r[2]))
+    consumptions, total_km = [], 0
+    for previous, current in zip(records, records[1:]):
+        distance = current[2] - previous[2]
+        if previous[2] > 0 and current[2] > 0 and 0 < distance <= 2000:
+            total_km += distance
+            if current[3] > 0 and 3 <= distance / current[3] <= 25:
+                consumptions.append(distance / current[3])
+    return consumptions, total_km
+
+
+class TestEfficiencyKernel:
+    """Testes do kernel de eficiência"""
+
+    def test_matches_reference_loop(self):
+        """Kernel deve produzir os mesmos números do laço original"""
+        start = date(2025, 1, 1)
+        records = []
+        for vehicle_id, step in ((1, 400), (2, 520), (3, 3000)):
+            for i in range(10):
+                records.append((vehicle_id, start + timedelta(days=i * 5), 1000 + i * step, 40 - i, 200.0))
+        records.append((1, start + timedelta(days=100), 0, 30, 150.0))  # odômetro ausente
+
+        stats = compute_efficiency_stats(*zip(*records))
+
+        for vehicle_id in (1, 2):
+            consumptions, total_km = reference_consumptions([r for r in records if r[0] == vehicle_id])
+            assert stats[vehicle_id]['has_data']
+            assert stats[vehicle_id]['average_consumption'] == pytest.approx(sum(consumptions) / len(consumptions))
+            assert stats[vehicle_id]['best_consumption'] == pytest.approx(max(consumptions))
+            assert stats[vehicle_id]['worst_consumption'] == pytest.approx(min(consumptions))
+            assert stats[vehicle_id]['total_km'] == pytest.approx(total_km)
+
+        # Distâncias acima de 2000 km por abastecimento são descartadas
+        assert not stats[3]['has_data']
+        assert stats[3]['total_records'] == 10
+
+    def test_trend_window_and_cost(self):
+        """Tendência, km na janela e custo por km"""
+        start = date(2025, 1, 1)
+        liters = [50, 50, 50, 50, 45, 40, 35]
+        records = [(7, start + timedelta(days=i), 10000 + i * 500, liters[i], 250.0) for i in range(7)]
+
+        stats = compute_efficiency_stats(*zip(*records), window_start=start + timedelta(days=5))[7]
+
+        assert stats['trend'] == 'improving'
+        assert stats['km_in_window'] == pytest.approx(1000)
+        assert stats['cost_per_km'] == pytest.approx(250.0 / 500)
+
+        series = compute_consumption_series(*zip(*records))[7]
+        assert [day for day, _ in series] == [start + timedelta(days=i) for i in range(1, 7)]
+
+    def test_summary_is_weighted(self):
+        """Resumo consolidado usa média ponderada pelos trechos válidos"""
+        start = date(2025, 1, 1)
+        records = [(1, start + timedelta(days=i), 1000 + i * 500, 50, 300.0) for i in range(3)]
+        records += [(2, start + timedelta(days=i), 1000 + i * 200, 20, 120.0) for i in range(5)]
+
+        summary = summarize_efficiency(compute_efficiency_stats(*zip(*records)))
+
+        assert summary['consumption_count'] == 6
+        assert summary['average_consumption'] == pytest.approx((2 * 10 + 4 * 10) / 6)
+        assert summary['total_km'] == pytest.approx(1000 + 800)
+        assert compute_efficiency_stats([], [], [], [], []) == {}
+
+    def test_large_fleet_is_fast(self):
+        """100 mil abastecimentos devem ser processados rapidamente"""
+        rng = np.random.default_rng(42)
+        n_records, n_vehicles = 100_000, 500
+        vehicle_ids = rng.integers(1, n_vehicles + 1, n_records)
+        days = np.datetime64('2022-01-01') + rng.integers(0, 1000, n_records).astype('timedelta64[D]')
+        odometers = (days - np.datetime64('2022-01-01')).astype(np.int64) * 60 + vehicle_ids
+        liters = rng.uniform(20, 60, n_records)
+        costs = liters * 5.8
+
+        began = time.perf_counter()
+        stats = compute_efficiency_stats(vehicle_ids, days, odometers, liters, costs)
+        elapsed = time.perf_counter() - began
+
+        assert len(stats) == n_vehicles
+        assert elapsed < 2
+
+
+class TestEwmaState:
+    """Passo incremental das médias móveis de consumo"""
+
+    def test_matches_batch_ewma(self):
+        """Aplicar os passos um a um deve igualar a média exponencial calculada em lote"""
+        values = [12, 11.5, 12.4, 12.1, 11.8, 12.3, 9.0, 8.8]
+        count, mean, variance, recent, _ = 0, None, None, None, None
+        for value in values:
+            count, mean, variance, recent, zscore = ewma_update(count, mean, variance, recent, value)
+
+        weights = [(1 - CONSUMPTION_EWMA_ALPHA) ** (len(values) - 1)]
+        weights += [CONSUMPTION_EWMA_ALPHA * (1 - CONSUMPTION_EWMA_ALPHA) ** (len(values) - 1 - i)
+                    for i in range(1, len(values))]
+        assert count == len(values)
+        assert mean == pytest.approx(float(np.dot(weights, values)))
+        assert variance > 0
+        assert recent < mean < 12
+        assert zscore < -1
+
+    def test_first_sample_and_constant_series(self):
+        """Primeiro trecho inicia o estado; série constante não tem variância nem z-score"""
+        state = ewma_update(0, None, None, None, 10.0)
+        assert state == (1, 10.0, 0.0, 10.0, 0.0)
+        state = ewma_update(*state[:4], 10.0)
+        assert state == (2, 10.0, 0.0, 10.0, 0.0)
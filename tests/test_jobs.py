@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Testes da Fila de Jobs - RodoStats
+Enfileiramento, worker, novas tentativas e endpoints de acompanhamento
+"""
+
+import pytest
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+
+from app import (app, db, User, Vehicle, FleetInvite, BackgroundJob, JobRun, job_handler, enqueue_job, claim_next_job,
+                 run_worker, maintain_job_queue, acquire_lease, release_lease, run_exclusive, run_due_periodic_jobs,
+                 JOB_LEASE_SECONDS, periodic_jobs)
+from seed_data import seed_database, SEED_PASSWORD
+
+calls = []
+
+
+def echo_job(job):
+    calls.append(job.payload['value'])
+    return {'value': job.payload['value']}
+
+
+def flaky_job(job):
+    calls.append(job.attempts)
+    raise RuntimeError('falha simulada')
+
+
+@pytest.fixture
+def client(client):
+    """Cliente de teste com a fila em modo worker, sem alertas incrementais nem emails"""
+    # test_app recarrega o módulo app: o código da fila lê a configuração do app atual do módulo
+    config = sys.modules['app'].app.config
+    previous = {key: config.get(key) for key in ('JOB_EXECUTION_MODE', 'ALERT_INCREMENTAL_MODE', 'ALERT_EMAIL_MODE')}
+    config.update(JOB_EXECUTION_MODE='worker', ALERT_INCREMENTAL_MODE='off', ALERT_EMAIL_MODE='off')
+    suppress = app.extensions['mail'].suppress
+    app.extensions['mail'].suppress = True
+    job_handler('test_echo')(echo_job)
+    job_handler('test_flaky')(flaky_job)
+    calls.clear()
+
+    yield client
+
+    config.update(previous)
+    app.extensions['mail'].suppress = suppress
+
+
+@pytest.fixture
+def fleet_owner(client):
+    """Frota sintética com o dono logado"""
+    with app.app_context():
+        summary = seed_database(users=1, fleets=1, vehicles=2, user_vehicles=1, years=1, seed=5)
+    username = summary['fleet_owner_usernames'][0]
+    client.post('/login', data={'username': username, 'password': SEED_PASSWORD})
+    return username
+
+
+class TestJobQueue:
+    """Fila, prioridades e novas tentativas"""
+
+    def test_worker_runs_by_priority(self, client):
+        """Jobs de maior prioridade executam primeiro; na mesma prioridade, por chegada"""
+        with app.app_context():
+            low_id = enqueue_job('test_echo', {'value': 'baixa'}).id
+            high_id = enqueue_job('test_echo', {'value': 'alta'}, priority=10).id
+            enqueue_job('test_echo', {'value': 'baixa 2'})
+
+            assert run_worker(once=True) == 3
+            assert calls == ['alta', 'baixa', 'baixa 2']
+            assert db.session.get(BackgroundJob, high_id).status == 'succeeded'
+            assert db.session.get(BackgroundJob, low_id).result == {'value': 'baixa'}
+
+    def test_claim_is_exclusive(self, client):
+        """Um job assumido por um worker não é entregue a outro"""
+        with app.app_context():
+            enqueue_job('test_echo', {'value': 1})
+            first = claim_next_job('worker-a')
+            assert first.status == 'running' and first.attempts == 1
+            assert claim_next_job('worker-b') is None
+
+    def test_retries_with_backoff_then_fails(self, client):
+        """Falhas voltam para a fila com espera crescente até esgotar as tentativas"""
+        with app.app_context():
+            job_id = enqueue_job('test_flaky', max_attempts=2).id
+
+            assert run_worker(once=True) == 1
+            job = db.session.get(BackgroundJob, job_id)
+            assert job.status == 'queued'
+            assert job.run_after > datetime.utcnow()
+            assert 'falha simulada' in job.error
+
+            # Ainda em espera: o worker não pega o job antes da hora
+            assert run_worker(once=True) == 0
+
+            BackgroundJob.query.filter_by(id=job_id).update({'run_after': datetime.utcnow()})
+            db.session.commit()
+            assert run_worker(once=True) == 1
+            job = db.session.get(BackgroundJob, job_id)
+            assert job.status == 'failed'
+            assert calls == [1, 2]
+
+    def test_stale_running_job_is_requeued(self, client):
+        """Job de um worker que caiu volta para a fila após o prazo"""
+        with app.app_context():
+            job = enqueue_job('test_echo', {'value': 'x'})
+            claim_next_job('worker-morto')
+            job = db.session.get(BackgroundJob, job.id)
+            job.locked_at = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS + 60)
+            db.session.commit()
+
+            assert maintain_job_queue()['requeued'] == 1
+            assert run_worker(once=True) == 1
+            assert calls == ['x']
+
+    def test_result_recorded_after_session_reset(self, client):
+        """Handler que descarta a sessão não impede o registro do resultado"""
+        def reset_session_job(job):
+            db.session.remove()
+            return {'ok': True}
+
+        job_handler('test_reset_session')(reset_session_job)
+        with app.app_context():
+            job_id = enqueue_job('test_reset_session').id
+            assert run_worker(once=True) == 1
+            job = db.session.get(BackgroundJob, job_id)
+            assert (job.status, job.result) == ('succeeded', {'ok': True})
+
+    def test_inline_mode_runs_on_enqueue(self, client):
+        """No modo inline o job executa no próprio request"""
+        sys.modules['app'].app.config['JOB_EXECUTION_MODE'] = 'inline'
+        with app.app_context():
+            job = enqueue_job('test_echo', {'value': 'agora'})
+            assert db.session.get(BackgroundJob, job.id).status == 'succeeded'
+        assert calls == ['agora']
+
+
+class TestJobEndpoints:
+    """Requests enfileiram e retornam imediatamente"""
+
+    def test_run_alerts_is_enqueued(self, client, fleet_owner):
+        """A API de alertas responde 202 e o worker executa a varredura"""
+        # Varredura global: só administradores, e só por POST
+        assert client.post('/api/run_alerts').status_code == 302
+        with app.app_context():
+            User.query.filter_by(username=fleet_owner).update({'user_role': 'admin'})
+            db.session.commit()
+        assert client.get('/api/run_alerts').status_code == 405
+
+        response = client.post('/api/run_alerts')
+        assert response.status_code == 202
+        data = response.get_json()
+
+        # Pedido repetido reaproveita a varredura pendente
+        assert client.post('/api/run_alerts').get_json()['job_id'] == data['job_id']
+
+        status = client.get(data['status_url']).get_json()['job']
+        assert status['status'] == 'queued'
+
+        # Varredura pendente de outro dono (agendador) não é devolvida: o status não seria visível
+        with app.app_context():
+            BackgroundJob.query.filter_by(id=data['job_id']).update({'user_id': None})
+            db.session.commit()
+        data = client.post('/api/run_alerts').get_json()
+        assert client.get(data['status_url']).status_code == 200
+        with app.app_context():
+            BackgroundJob.query.filter(BackgroundJob.user_id.is_(None)).delete()
+            db.session.commit()
+
+        with app.app_context():
+            run_worker(once=True)
+
+        status = client.get(data['status_url']).get_json()['job']
+        assert status['status'] == 'succeeded'
+        assert 'alerts_created' in status['result']
+
+    def test_report_job_download(self, client, fleet_owner):
+        """Relatório é gerado pelo worker e baixado pelo link do job"""
+        response = client.post('/api/fleet/reports', json={'type': 'excel', 'period': 30})
+        assert response.status_code == 202
+        status_url = response.get_json()['status_url']
+        assert 'download_url' not in client.get(status_url).get_json()['job']
+
+        with app.app_context():
+            run_worker(once=True)
+
+        job = client.get(status_url).get_json()['job']
+        assert job['status'] == 'succeeded'
+        download = client.get(job['download_url'])
+        assert download.status_code == 200
+        assert download.mimetype == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        assert download.data[:2] == b'PK'
+
+    def test_jobs_are_private(self, client, fleet_owner):
+        """Outros usuários não veem o job"""
+        job_id = client.post('/api/fleet/reports', json={'type': 'pdf'}).get_json()['job_id']
+        client.get('/logout')
+
+        with app.app_context():
+            other = User(username='outro', email='outro@example.com')
+            other.set_password('Senha123!')
+            db.session.add(other)
+            db.session.commit()
+        client.post('/login', data={'username': 'outro', 'password': 'Senha123!'})
+
+        assert client.get(f'/api/jobs/{job_id}').status_code == 404
+        assert client.get(f'/api/jobs/{job_id}/download').status_code == 404
+
+    def test_registration_enqueues_welcome_email(self, client, monkeypatch):
+        """Cadastro não espera o envio do email de boas-vindas"""
+        sent = []
+        monkeypatch.setattr(sys.modules['app'], 'send_welcome_email', lambda user: sent.append(user.email) or True)
+        response = client.post('/register', data={
+            'username': 'novo', 'email': 'novo@example.com',
+            'password': 'Senha123!', 'confirm_password': 'Senha123!'
+        })
+        assert response.status_code == 302
+
+        with app.app_context():
+            job = BackgroundJob.query.one()
+            assert job.job_type == 'welcome_email'
+            job_id = job.id
+            assert run_worker(once=True) == 1
+            assert db.session.get(BackgroundJob, job_id).status == 'succeeded'
+        assert sent == ['novo@example.com']
+
+    def test_invite_email_failure_marks_invite(self, client, fleet_owner, monkeypatch):
+        """Convite fica 'failed' quando todas as tentativas de envio falham"""
+        monkeypatch.setattr(sys.modules['app'], 'send_email', lambda **kwargs: False)
+        with app.app_context():
+            owner = User.query.filter_by(username=fleet_owner).one()
+            invite = FleetInvite(fleet_id=1, inviter_id=owner.id, email='convidado@example.com',
+                                 expires_at=datetime.utcnow() + timedelta(days=7), token='token-teste')
+            db.session.add(invite)
+            db.session.commit()
+            invite_id = invite.id
+            job_id = enqueue_job('fleet_invite_email', {'invite_id': invite_id, 'subject': 'Convite', 'context': {}},
+                                 max_attempts=1).id
+
+            run_worker(once=True)
+            assert db.session.get(BackgroundJob, job_id).status == 'failed'
+            assert db.session.get(FleetInvite, invite_id).status == 'failed'
+
+
+class TestScheduler:
+    """Trava entre processos e histórico das tarefas periódicas"""
+
+    def test_lease_has_single_holder(self, client):
+        """Só um processo detém a trava até ela ser liberada ou expirar"""
+        with app.app_context():
+            assert acquire_lease('periodic:teste', 'worker-a', 60)
+            assert not acquire_lease('periodic:teste', 'worker-b', 60)
+            release_lease('periodic:teste', 'worker-a')
+            assert acquire_lease('periodic:teste', 'worker-b', 0)
+            assert acquire_lease('periodic:teste', 'worker-c', 60)  # Trava anterior já expirou
+
+    def test_run_exclusive_records_runs(self, client):
+        """Cada execução registra status, duração e resultado ou erro"""
+        with app.app_context():
+            run = run_exclusive('teste', lambda: {'ok': True}, trigger='manual')
+            assert (run.status, run.trigger, run.result) == ('succeeded', 'manual', {'ok': True})
+            assert run.duration_seconds >= 0 and run.finished_at is not None
+
+            def broken():
+                raise RuntimeError('quebrou')
+            run = run_exclusive('teste', broken)
+            assert run.status == 'failed' and 'quebrou' in run.error
+
+    def test_held_lease_skips_run(self, client):
+        """Com a trava em outro processo a tarefa não executa"""
+        with app.app_context():
+            acquire_lease('periodic:teste', 'outro-worker', 60)
+            assert run_exclusive('teste', lambda: calls.append('executou')) is None
+            assert calls == [] and JobRun.query.count() == 0
+
+    def test_due_jobs_run_once_per_interval(self, client):
+        """Tarefas vencidas executam uma vez; na chamada seguinte ainda não venceram"""
+        with app.app_context():
+            runs = run_due_periodic_jobs(names=['daily_alerts', 'cleanup'])
+            assert sorted(run.job_name for run in runs) == ['cleanup', 'daily_alerts']
+            assert run_due_periodic_jobs(names=['daily_alerts', 'cleanup']) == []
+            assert JobRun.query.filter_by(status='succeeded').count() == 2
+
+    def test_failed_alert_scan_marks_run_failed(self, client, monkeypatch):
+        """Regra que levanta exceção deixa a execução 'failed' para ser repetida"""
+        def broken_rule(vehicle, today, inputs):
+            raise RuntimeError('regra quebrada')
+        monkeypatch.setattr(sys.modules['app'], 'daily_alert_rules', lambda full=False: (broken_rule,))
+
+        with app.app_context():
+            user = User(username='dono', email='dono@example.com')
+            user.set_password('Senha123!')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Vehicle(user_id=user.id, name='Carro', brand='Fiat', model='Uno', year=2020,
+                                   fuel_type='gasolina', tank_capacity=50))
+            db.session.commit()
+
+            runs = run_due_periodic_jobs(names=['daily_alerts'])
+            assert [run.status for run in runs] == ['failed']
+            assert 'regra quebrada' in runs[0].error
+
+    def test_cron_endpoint_requires_secret(self, client, monkeypatch):
+        """Gatilho do cron só executa com o segredo configurado"""
+        monkeypatch.setenv('CRON_SECRET', 'segredo')
+        assert client.get('/api/cron/periodic').status_code == 401
+
+        response = client.get('/api/cron/periodic', headers={'Authorization': 'Bearer segredo'})
+        assert response.status_code == 200
+        assert {run['job_name'] for run in response.get_json()['runs']} == {'daily_alerts', 'cleanup', 'ranking_snapshots'}
+
+        # Sem worker, o gatilho também consome a fila
+        with app.app_context():
+            enqueue_job('test_echo', {'value': 'cron'})
+        response = client.get('/api/cron/periodic', headers={'Authorization': 'Bearer segredo'})
+        assert response.get_json()['jobs_processed'] == 1
+        assert calls == ['cron']
+
+    def test_admin_job_runs_clamps_limit(self, client):
+        """Limite inválido usa o padrão e limites abaixo de 1 retornam uma execução"""
+        with app.app_context():
+            admin = User(username='admin', email='admin@example.com', user_role='admin')
+            admin.set_password('Senha123!')
+            db.session.add(admin)
+            db.session.commit()
+            for _ in range(2):
+                run_exclusive('teste', lambda: {'ok': True})
+        client.post('/login', data={'username': 'admin', 'password': 'Senha123!'})
+
+        assert len(client.get('/admin/job_runs?limit=0').get_json()['runs']) == 1
+        assert len(client.get('/admin/job_runs?limit=abc').get_json()['runs']) == 2
+
+    def test_vercel_cron_covers_shortest_interval(self):
+        """O cron da Vercel dispara pelo menos tão frequentemente quanto a tarefa mais curta"""
+        with open(os.path.join(os.path.dirname(__file__), '..', 'vercel.json'), encoding='utf-8') as f:
+            crons = json.load(f)['crons']
+        schedule = next(cron['schedule'] for cron in crons if cron['path'] == '/api/cron/periodic')
+        minute, hour = schedule.split()[:2]
+        assert minute.isdigit() and hour == '*'
+        assert min(job['interval'] for job in periodic_jobs.values()) >= timedelta(hours=1)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Testes de Planos de Consulta - RodoStats
+Garante que as consultas principais usam os índices das tabelas quentes
+"""
+
+import pytest
+import re
+import sys
+from datetime import date, datetime, timedelta
+
+from app import (app, db, User, Fleet, FleetMember, Driver, Vehicle, FuelRecord, Alert,
+                 backfill_fuel_segments, refresh_fuel_segments)
+from query_counter import QueryCounter
+
+# Tabelas que nunca devem ser lidas por varredura completa nas consultas principais
+HOT_TABLES = ('fuel_records', 'alerts', 'vehicles', 'fleet_members', 'fleet_daily_rollups')
+
+
+@pytest.fixture
+def seeded(client):
+    """Banco com usuários, frota, motoristas, veículos, abastecimentos e alertas"""
+    with app.app_context():
+        owner = User(username='gestor', email='gestor@example.com')
+        owner.set_password('Senha123!')
+        db.session.add(owner)
+        db.session.flush()
+
+        fleet = Fleet(name='Transportes Teste', company_name='Transportes Teste LTDA',
+                      email='frota@example.com')
+        db.session.add(fleet)
+        db.session.flush()
+        db.session.add(FleetMember(fleet_id=fleet.id, user_id=owner.id, role='owner'))
+
+        vehicle_ids = []
+        for index in range(12):
+            driver = Driver(fleet_id=fleet.id, name=f'Motorista {index}')
+            db.session.add(driver)
+            db.session.flush()
+
+            vehicle = Vehicle(
+                user_id=owner.id, name=f'Caminhão {index}', brand='Volvo', model='FH',
+                year=2020, fuel_type='diesel', tank_capacity=400,
+                fleet_id=fleet.id, driver_id=driver.id, is_active=index % 4 != 0
+            )
+            db.session.add(vehicle)
+            db.session.flush()
+            vehicle_ids.append(vehicle.id)
+
+            start = date.today() - timedelta(days=120)
+            for day in range(30):
+                db.session.add(FuelRecord(
+                    vehicle_id=vehicle.id, date=start + timedelta(days=day * 4),
+                    odometer=50000 + day * 900, liters=300, price_per_liter=6.1,
+                    total_cost=1830, gas_station='Posto Rodovia', fuel_type='diesel'
+                ))
+            db.session.add(Alert(
+                user_id=owner.id, fleet_id=fleet.id, vehicle_id=vehicle.id,
+                alert_type='fuel_anomaly', title='Consumo alto', message='Consumo acima do normal'
+            ))
+        db.session.commit()
+        backfill_fuel_segments()
+
+        ids = {'user_id': owner.id, 'fleet_id': fleet.id, 'vehicle_ids': vehicle_ids}
+
+    client.post('/login', data={'username': 'gestor', 'password': 'Senha123!'})
+    return ids
+
+
+def explain(statement, params):
+    """Plano de execução de um comando SQL (PostgreSQL ou SQLite)"""
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', params).all()
+        return [row[-1] for row in rows]
+
+    # No PostgreSQL, desligar seq scan revela consultas que não têm índice utilizável
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    rows = connection.exec_driver_sql(f'EXPLAIN {statement}', params).all()
+    return [row[0] for row in rows]
+
+
+def sequential_scans(plan):
+    """Tabelas quentes lidas por varredura completa no plano"""
+    pattern = r'^SCAN (\w+)' if db.engine.dialect.name == 'sqlite' else r'Seq Scan on (\w+)'
+    scans = []
+    for line in plan:
+        match = re.search(pattern, line.strip())
+        if match and match.group(1) in HOT_TABLES:
+            scans.append(line.strip())
+    return scans
+
+
+class CapturedSelects(QueryCounter):
+    """Captura os SELECTs (com parâmetros) executados dentro do bloco para inspecionar os planos"""
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            self.statements.append((statement, parameters))
+
+    def regressions(self):
+        """SELECTs capturados cujo plano varre uma tabela quente"""
+        with app.app_context():
+            found = []
+            for statement, parameters in self.statements:
+                scans = sequential_scans(explain(statement, parameters))
+                if scans:
+                    found.append((statement, scans))
+            return found
+
+
+def explain_query(query):
+    """Plano de uma consulta do ORM (executa e explica o SQL realmente emitido)"""
+    with CapturedSelects(app) as captured:
+        query.all()
+    plan = []
+    for statement, parameters in captured.statements:
+        plan.extend(explain(statement, parameters))
+    return plan
+
+
+class TestQueryPlans:
+    """Consultas principais devem usar índice nas tabelas quentes"""
+
+    def test_indexes_declared(self, client):
+        """Índices compostos devem existir no banco"""
+        with app.app_context():
+            inspector = db.inspect(db.engine)
+            indexes = {
+                table: {index['name']: index['column_names'] for index in inspector.get_indexes(table)}
+                for table in HOT_TABLES
+            }
+        assert indexes['fuel_records']['ix_fuel_records_vehicle_date'] == ['vehicle_id', 'date']
+        assert indexes['fuel_records']['ix_fuel_records_vehicle_odometer'] == ['vehicle_id', 'odometer']
+        assert indexes['alerts']['ix_alerts_vehicle_type_created'] == ['vehicle_id', 'alert_type', 'created_at']
+        assert indexes['alerts']['ix_alerts_fleet_created'] == ['fleet_id', 'created_at', 'id']
+        assert indexes['vehicles']['ix_vehicles_user_active'] == ['user_id', 'is_active']
+        assert indexes['vehicles']['ix_vehicles_fleet_active'] == ['fleet_id', 'is_active']
+        assert indexes['vehicles']['ix_vehicles_driver'] == ['driver_id']
+        assert indexes['fleet_members']['ix_fleet_members_user_active'] == ['user_id', 'is_active']
+        assert indexes['fleet_daily_rollups']['ix_fleet_daily_rollups_fleet_day'] == ['fleet_id', 'day']
+
+    def test_dashboard_plans(self, client, seeded):
+        """Todas as consultas do dashboard devem usar índice"""
+        with CapturedSelects(app) as captured:
+            assert client.get('/dashboard').status_code == 200
+        assert captured.statements
+        assert captured.regressions() == []
+
+    def test_fleet_dashboard_plans(self, client, seeded):
+        """Dashboard da frota e rollup diário devem usar índice"""
+        with CapturedSelects(app) as captured:
+            assert client.get('/fleet/dashboard?period=365').status_code == 200
+        assert any('fleet_daily_rollups' in statement for statement, _ in captured.statements)
+        assert captured.regressions() == []
+
+    def test_vehicle_detail_plans(self, client, seeded):
+        """Histórico do veículo deve usar o índice (vehicle_id, date)"""
+        vehicle_id = seeded['vehicle_ids'][1]
+        with CapturedSelects(app) as captured:
+            assert client.get(f'/vehicle/{vehicle_id}').status_code == 200
+        assert captured.regressions() == []
+
+    def test_segment_refresh_plans(self, client, seeded):
+        """Busca de vizinhos por odômetro deve usar o índice (vehicle_id, odometer)"""
+        vehicle_id = seeded['vehicle_ids'][1]
+        with app.app_context():
+            record = FuelRecord.query.filter_by(vehicle_id=vehicle_id).first()
+            position = (record.odometer, record.id)
+            with CapturedSelects(app) as captured:
+                refresh_fuel_segments(vehicle_id, position)
+            db.session.rollback()
+        assert captured.regressions() == []
+
+    def test_alert_inbox_plans(self, client, seeded):
+        """Caixa de entrada e contador de não lidos devem usar índice"""
+        with CapturedSelects(app) as captured:
+            first = client.get('/api/alerts?limit=5').get_json()
+            client.get(f"/api/alerts?limit=5&cursor={first['next_cursor']}")
+            assert client.get('/api/alerts/unread_count').status_code == 200
+        assert captured.regressions() == []
+
+    def test_alert_dedup_plan(self, client, seeded):
+        """Verificação de alerta existente deve usar (vehicle_id, alert_type, created_at)"""
+        with app.app_context():
+            plan = explain_query(Alert.query.filter(
+                Alert.vehicle_id == seeded['vehicle_ids'][1],
+                Alert.alert_type == 'fuel_anomaly',
+                Alert.is_active == True,
+                Alert.created_at >= datetime.utcnow() - timedelta(days=7)
+            ))
+            assert sequential_scans(plan) == []
+
+    def test_ranking_plans(self, client, seeded):
+        """Consultas do ranking por motorista e frota devem usar índice"""
+        with CapturedSelects(app) as captured:
+            assert client.get('/fleet/ranking').status_code == 200
+            assert client.get('/api/fleet/ranking_data?period=60').status_code == 200
+        assert captured.regressions() == []
+
+        with app.app_context():
+            driver_vehicles = Vehicle.query.filter_by(driver_id=1, is_active=True)
+            fleet_vehicles = Vehicle.query.filter_by(fleet_id=seeded['fleet_id'], is_active=True)
+            membership = FleetMember.query.filter_by(user_id=seeded['user_id'], is_active=True)
+            period_records = FuelRecord.query.filter(
+                FuelRecord.vehicle_id.in_(seeded['vehicle_ids'][:3]),
+                FuelRecord.date >= date.today() - timedelta(days=30),
+                FuelRecord.date <= date.today()
+            )
+            for query in (driver_vehicles, fleet_vehicles, membership, period_records):
+                assert sequential_scans(explain_query(query)) == []
+
+    def test_ranking_grouped_query(self, client, seeded, monkeypatch):
+        """Ranking sai de uma consulta agrupada, com as métricas de cada motorista"""
+        from app import generate_driver_ranking
+
+        monkeypatch.setitem(sys.modules['app'].app.config, 'RANKING_SNAPSHOT_ENABLED', False)
+        with app.app_context():
+            with CapturedSelects(app) as captured:
+                ranking = generate_driver_ranking(seeded['fleet_id'], 30, 'score')
+            assert len([s for s in captured.statements if 'JOIN fuel_records' in s[0]]) == 1
+
+            # Motoristas de veículos inativos ficam de fora
+            assert ranking['fleet_stats']['total_drivers'] == 9
+            start = date.today() - timedelta(days=30)
+            for entry in ranking['drivers']:
+                vehicle_id = entry['vehicles'][0]['id']
+                records = FuelRecord.query.filter(FuelRecord.vehicle_id == vehicle_id,
+                                                  FuelRecord.date >= start).all()
+                metrics = entry['metrics']
+                assert metrics['fuel_records_count'] == len(records)
+                assert metrics['total_cost'] == pytest.approx(sum(r.total_cost for r in records))
+                assert metrics['total_km'] == pytest.approx(sum(r.kilometers for r in records if r.kilometers))
+                assert metrics['avg_consumption'] == pytest.approx(
+                    sum(r.consumption for r in records) / len(records))
+                assert metrics['cost_per_km'] == pytest.approx(metrics['total_cost'] / metrics['total_km'])
+            scores = [entry['metrics']['efficiency_score'] for entry in ranking['drivers']]
+            assert scores == sorted(scores, reverse=True)
+
+    def test_ranking_snapshot(self, client, seeded):
+        """Períodos padrão vêm do snapshot, atualizado quando os abastecimentos mudam"""
+        from app import generate_driver_ranking, RankingSnapshot
+
+        with app.app_context():
+            live = generate_driver_ranking(seeded['fleet_id'], 31, 'cost')
+            first = generate_driver_ranking(seeded['fleet_id'], 30, 'cost')
+            assert first['snapshot'] is not None
+            assert RankingSnapshot.query.count() == 1
+
+            # Snapshot atualizado: nenhuma leitura dos abastecimentos
+            with CapturedSelects(app) as captured:
+                page = generate_driver_ranking(seeded['fleet_id'], 30, 'cost', limit=3, offset=3)
+            assert not [s for s in captured.statements if 'JOIN fuel_records' in s[0]]
+            assert [d['position'] for d in page['drivers']] == [4, 5, 6]
+            assert [d['driver']['id'] for d in page['drivers']] == [d['driver']['id'] for d in first['drivers'][3:6]]
+            assert page['fleet_stats'] == pytest.approx(first['fleet_stats'])
+            assert first['fleet_stats']['total_drivers'] == live['fleet_stats']['total_drivers']
+
+            # Novo abastecimento invalida o snapshot da frota
+            version = RankingSnapshot.query.one().data_version
+            db.session.add(FuelRecord(
+                vehicle_id=seeded['vehicle_ids'][1], date=date.today(), odometer=90000, liters=300,
+                price_per_liter=6.1, total_cost=1830, gas_station='Posto Rodovia', fuel_type='diesel'
+            ))
+            db.session.commit()
+            generate_driver_ranking(seeded['fleet_id'], 7, 'score')
+            db.session.expire_all()
+            assert RankingSnapshot.query.one().data_version == version + 1
+
+        response = client.get('/api/fleet/ranking_data?period=90&metric=score&limit=2')
+        data = response.get_json()
+        assert len(data['ranking']['drivers']) == 2
+        assert data['snapshot']['age_seconds'] >= 0
+
+    def test_harness_detects_scans(self, client, seeded):
+        """Filtro sem índice deve ser apontado como varredura completa"""
+        with app.app_context():
+            plan = explain_query(FuelRecord.query.filter(FuelRecord.gas_station == 'Posto Rodovia'))
+            assert sequential_scans(plan)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Testes do Seeder e do Benchmark - RodoStats
+Geração de dados sintéticos em lote e medições de desempenho
+"""
+
+import pytest
+
+from app import app, db, User, Fleet, Vehicle, FuelRecord, MaintenanceRecord, compute_fuel_segments
+from seed_data import seed_database, SEED_PASSWORD
+import benchmark
+
+
+class TestSeeder:
+    """Testes do gerador de dados sintéticos"""
+
+    def test_seed_counts_and_histories(self, client):
+        """Seeder deve criar usuários, frotas e históricos coerentes"""
+        with app.app_context():
+            summary = seed_database(users=2, fleets=1, vehicles=3, user_vehicles=2, years=1, seed=7)
+
+            assert User.query.count() == 3
+            assert Fleet.query.count() == 1
+            assert Vehicle.query.count() == summary['vehicles'] == 7
+            assert FuelRecord.query.count() == summary['fuel_records'] > 7 * 20
+            assert MaintenanceRecord.query.count() == summary['maintenance_records'] > 0
+
+            # Odômetro cresce com a data e os segmentos já estão calculados
+            for vehicle in Vehicle.query.all():
+                odometers = [r.odometer for r in FuelRecord.query.filter_by(vehicle_id=vehicle.id)
+                             .order_by(FuelRecord.date, FuelRecord.id)]
+                assert odometers == sorted(odometers)
+
+            segments = compute_fuel_segments()
+            stored = dict(db.session.query(FuelRecord.id, FuelRecord.consumption).all())
+            assert all(stored[record_id] == pytest.approx(segment[1]) for record_id, segment in segments.items())
+
+        response = client.post('/login', data={
+            'username': summary['fleet_owner_usernames'][0], 'password': SEED_PASSWORD
+        })
+        assert response.status_code == 302
+
+    def test_same_seed_is_reproducible(self, client):
+        """Mesma semente deve gerar os mesmos volumes"""
+        with app.app_context():
+            first = seed_database(users=1, fleets=0, user_vehicles=1, years=1, seed=3)
+            db.drop_all()
+            db.create_all()
+            second = seed_database(users=1, fleets=0, user_vehicles=1, years=1, seed=3)
+        assert first['fuel_records'] == second['fuel_records']
+
+    def test_demo_user_uses_seed_helpers(self, client):
+        """Usuário demo continua sendo criado com abastecimentos"""
+        response = client.get('/create_demo_user')
+        assert response.get_json()['success'] is True
+        with app.app_context():
+            assert Vehicle.query.count() == 3
+            assert FuelRecord.query.filter(FuelRecord.consumption.isnot(None)).count() > 0
+
+
+class TestBenchmark:
+    """Testes do benchmark das rotas pesadas"""
+
+    def test_run_size_measures_all_targets(self, client):
+        """Todas as rotas e rotinas devem ser medidas sem erro"""
+        results = benchmark.run_size('tiny', benchmark.BENCHMARK_SIZES['tiny'], app=app)
+
+        assert [row['target'] for row in results] == [
+            '/dashboard', '/dashboard (cache)', '/vehicle/<id>', '/fleet/dashboard',
+            '/fleet/ranking', '/export_data', 'generate_fleet_reports', 'run_daily_alert_checks'
+        ]
+        for row in results:
+            assert row['status'] in ('200', 'ok'), row
+            assert row['queries'] > 0
+            assert row['peak_memory_kb'] > 0
+
+    def test_baseline_comparison(self):
+        """Mais consultas ou tempo acima da tolerância devem ser apontados"""
+        baseline = [{'size': 'small', 'target': '/dashboard', 'status': '200', 'seconds': 0.1, 'queries': 9}]
+        current = [{'size': 'small', 'target': '/dashboard', 'status': '200', 'seconds': 0.11, 'queries': 9}]
+        assert benchmark.compare_with_baseline(current, baseline) == []
+
+        current[0].update({'seconds': 0.2, 'queries': 30})
+        regressions = benchmark.compare_with_baseline(current, baseline)
+        assert len(regressions) == 2